@@ -33,7 +33,7 @@ class LinearClassifier(object):
         num_classes = np.max(y) + 1  # assume y takes values 0...K-1 where K is number of classes
         if self.W is None:
             # lazily initialize W
-            self.W = 0.001 * np.random.randn(dim, num_classes)
+            self.W = self._init_weights(dim, num_classes)
 
         # Run stochastic gradient descent to optimize W
         loss_history = []
@@ -105,6 +105,13 @@ class LinearClassifier(object):
         ###########################################################################
         return y_pred
 
+    def _init_weights(self, dim, num_classes):
+        """
+        Returns the initial weights for dim features and num_classes classes.
+        Subclasses that need extra weight columns override this.
+        """
+        return 0.001 * np.random.randn(dim, num_classes)
+
     def loss(self, X_batch, y_batch, reg):
         """
         Compute the loss function and its derivative. 
@@ -135,3 +142,49 @@ class Softmax(LinearClassifier):
 
     def loss(self, X_batch, y_batch, reg):
         return softmax_loss_vectorized(self.W, X_batch, y_batch, reg)
+
+
+class SampledSoftmax(LinearClassifier):
+    """
+    A subclass that trains with a sampled softmax loss over num_sampled
+    negative classes, for large numbers of classes; predict still uses the
+    full scores.
+    """
+
+    def __init__(self, num_sampled, proposal=None):
+        super(SampledSoftmax, self).__init__()
+        self.num_sampled = num_sampled
+        self.proposal = proposal
+
+    def loss(self, X_batch, y_batch, reg):
+        return softmax_loss_sampled(self.W, X_batch, y_batch, reg,
+                                    self.num_sampled, self.proposal)
+
+
+class HierarchicalSoftmax(LinearClassifier):
+    """
+    A subclass that uses a two-level hierarchical softmax, for large numbers
+    of classes. W has an extra column per cluster of cluster_size classes;
+    the default cluster size is ceil(sqrt(C)).
+    """
+
+    def __init__(self, cluster_size=None):
+        super(HierarchicalSoftmax, self).__init__()
+        self.cluster_size = cluster_size
+        self.num_classes = None
+
+    def _init_weights(self, dim, num_classes):
+        self.num_classes = num_classes
+        if self.cluster_size is None:
+            self.cluster_size = int(np.ceil(np.sqrt(num_classes)))
+        num_clusters = -(-num_classes // self.cluster_size)
+        return 0.001 * np.random.randn(dim, num_classes + num_clusters)
+
+    def loss(self, X_batch, y_batch, reg):
+        return softmax_loss_hierarchical(self.W, X_batch, y_batch, reg,
+                                         self.num_classes, self.cluster_size)
+
+    def predict(self, X):
+        scores = softmax_scores_hierarchical(self.W, X, self.num_classes,
+                                             self.cluster_size)
+        return np.argmax(scores, axis=1)
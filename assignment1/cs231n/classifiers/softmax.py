@@ -94,3 +94,135 @@ def softmax_loss_vectorized(W, X, y, reg):
     #############################################################################
 
     return loss, dW
+
+
+def softmax_loss_sampled(W, X, y, reg, num_sampled, proposal=None):
+    """
+    Sampled softmax loss function for large numbers of classes. Each example
+    is scored against its true class and num_sampled negative classes drawn
+    from the proposal distribution (shared across the minibatch), with logits
+    corrected by the log expected count of each class so that the gradient
+    estimates that of the full softmax. Use the full scores for prediction.
+
+    Inputs are the same as softmax_loss_naive, plus:
+    - num_sampled: Number of negative classes to draw.
+    - proposal: A numpy array of shape (C,) of positive probabilities to draw
+      negatives from, e.g. the class frequencies; default is uniform.
+
+    Returns a tuple of:
+    - loss as single float
+    - gradient with respect to weights W; only the columns of the true and
+      sampled classes have a data term. The regularization term makes it a
+      dense (D, C) array that is allocated on every call; for very large C
+      this, not the sampled scores, is the main cost of a step.
+    """
+    num_train = X.shape[0]
+    num_classes = W.shape[1]
+    if proposal is None:
+        proposal = np.ones(num_classes) / num_classes
+
+    sampled = np.random.choice(num_classes, num_sampled, p=proposal)
+
+    # Column 0 holds the true class, the rest the sampled classes
+    scores = np.empty((num_train, num_sampled + 1))
+    scores[:, 0] = np.sum(X * W[:, y].T, axis=1) - np.log(num_sampled * proposal[y])
+    scores[:, 1:] = X.dot(W[:, sampled]) - np.log(num_sampled * proposal[sampled])
+    scores[:, 1:][sampled == y[:, np.newaxis]] = -np.inf
+    scores = np.exp(scores - np.max(scores, axis=1, keepdims=True))
+    probs = scores / np.sum(scores, axis=1, keepdims=True)
+    loss = -np.sum(np.log(probs[:, 0]))
+    probs[:, 0] -= 1
+
+    # Sum the gradient of each row over the scores that share a class with one
+    # bincount, giving dscores over the distinct classes touched, so that the
+    # columns of dW for those classes are a single matrix product
+    classes, inverse = np.unique(np.concatenate([y, sampled]), return_inverse=True)
+    num_touched = classes.shape[0]
+    columns = np.empty((num_train, num_sampled + 1), dtype=np.intp)
+    columns[:, 0] = inverse[:num_train]
+    columns[:, 1:] = inverse[num_train:]
+    columns += num_touched * np.arange(num_train)[:, np.newaxis]
+    dscores = np.bincount(columns.ravel(), weights=probs.ravel(),
+                          minlength=num_train * num_touched)
+    dscores = dscores.reshape(num_train, num_touched)
+
+    loss /= num_train
+    loss += reg * np.sum(W * W)
+
+    dW = 2 * reg * W
+    dW[:, classes] += X.T.dot(dscores) / num_train
+    return loss, dW
+
+
+def softmax_loss_hierarchical(W, X, y, reg, num_classes, cluster_size):
+    """
+    Two-level hierarchical softmax loss function. Classes are split into
+    K = ceil(C / cluster_size) clusters of consecutive labels and
+    p(c | x) = p(cluster | x) * p(c | cluster, x), so each example only
+    normalizes over the K clusters and the classes of its own cluster.
+
+    Inputs are the same as softmax_loss_naive, except:
+    - W: A numpy array of shape (D, C + K); the first C columns score each
+      class within its cluster and the last K columns score the clusters.
+    - num_classes: The number of classes C.
+    - cluster_size: Number of classes per cluster.
+
+    Returns a tuple of:
+    - loss as single float
+    - gradient with respect to weights W; an array of same shape as W
+    """
+    num_train = X.shape[0]
+    clusters = y // cluster_size
+    dW = np.zeros_like(W)
+
+    # Which cluster
+    scores = X.dot(W[:, num_classes:])
+    scores = np.exp(scores - np.max(scores, axis=1, keepdims=True))
+    probs = scores / np.sum(scores, axis=1, keepdims=True)
+    loss = -np.sum(np.log(probs[np.arange(num_train), clusters]))
+    probs[np.arange(num_train), clusters] -= 1
+    dW[:, num_classes:] = X.T.dot(probs)
+
+    # Which class within the cluster
+    for k in np.unique(clusters):
+        rows = np.flatnonzero(clusters == k)
+        cols = slice(k * cluster_size, min((k + 1) * cluster_size, num_classes))
+        scores = X[rows].dot(W[:, cols])
+        scores = np.exp(scores - np.max(scores, axis=1, keepdims=True))
+        probs = scores / np.sum(scores, axis=1, keepdims=True)
+        labels = y[rows] - k * cluster_size
+        loss -= np.sum(np.log(probs[np.arange(len(rows)), labels]))
+        probs[np.arange(len(rows)), labels] -= 1
+        dW[:, cols] += X[rows].T.dot(probs)
+
+    loss /= num_train
+    dW /= num_train
+    dW += 2 * reg * W
+
+    loss += reg * np.sum(W * W)
+    return loss, dW
+
+
+def softmax_scores_hierarchical(W, X, num_classes, cluster_size):
+    """
+    Exact log-probabilities of all classes under the hierarchical softmax of
+    softmax_loss_hierarchical, for prediction.
+
+    Returns:
+    - scores: A numpy array of shape (N, C) of log p(c | x)
+    """
+    num_train = X.shape[0]
+    num_clusters = W.shape[1] - num_classes
+
+    cluster_scores = X.dot(W[:, num_classes:])
+    cluster_scores -= np.max(cluster_scores, axis=1, keepdims=True)
+    cluster_scores -= np.log(np.sum(np.exp(cluster_scores), axis=1, keepdims=True))
+
+    # Pad the classes to full clusters so every cluster is normalized at once
+    scores = np.full((num_train, num_clusters * cluster_size), -np.inf)
+    scores[:, :num_classes] = X.dot(W[:, :num_classes])
+    scores = scores.reshape(num_train, num_clusters, cluster_size)
+    scores -= np.max(scores, axis=2, keepdims=True)
+    scores -= np.log(np.sum(np.exp(scores), axis=2, keepdims=True))
+    scores += cluster_scores[:, :, np.newaxis]
+    return scores.reshape(num_train, -1)[:, :num_classes]
@@ -0,0 +1,162 @@
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+import collections
+import copy
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+"""
+This file implements the checkpoint format used by the Solver. A checkpoint
+is a nested structure of dicts, lists and tuples whose leaves are numpy
+arrays, Python scalars, strings, None, slices or numpy dtypes. It is written
+as an uncompressed .npz file: every array is stored as its own raw buffer
+under its path in the structure, e.g. 'optim_configs/W1/m', and the rest of
+the structure is stored as JSON in the '__meta__' entry. Nothing is pickled,
+so a checkpoint can be read without importing the code that wrote it.
+"""
+
+
+def save_checkpoint(state, filename):
+    """
+    Write state to filename. The file is written under a temporary name and
+    renamed when complete, so a crash never leaves a truncated checkpoint.
+    """
+    arrays = {}
+    meta = _flatten(state, '', arrays)
+    arrays['__meta__'] = np.frombuffer(json.dumps(meta).encode('utf-8'),
+                                       dtype=np.uint8)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmp_filename, filename)
+
+
+def load_checkpoint(filename):
+    """
+    Read a state written by save_checkpoint.
+    """
+    with np.load(filename) as data:
+        meta = json.loads(data['__meta__'].tobytes().decode('utf-8'))
+        return _unflatten(meta, data)
+
+
+def _flatten(obj, path, arrays):
+    """
+    Returns a JSON-compatible description of obj, moving its arrays to the
+    dictionary arrays keyed by their path.
+    """
+    if isinstance(obj, np.ndarray):
+        arrays[path] = obj
+        return {'__array__': path}
+    if isinstance(obj, dict):
+        return {'__dict__': dict((k, _flatten(v, path + '/' + k, arrays))
+                                 for k, v in obj.items())}
+    if isinstance(obj, (list, tuple)):
+        items = [_flatten(v, '%s/%d' % (path, i), arrays)
+                 for i, v in enumerate(obj)]
+        return {'__tuple__' if isinstance(obj, tuple) else '__list__': items}
+    if isinstance(obj, slice):
+        return {'__slice__': [obj.start, obj.stop, obj.step]}
+    if isinstance(obj, (np.dtype, type)):
+        return {'__dtype__': np.dtype(obj).name}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _unflatten(meta, arrays):
+    if not isinstance(meta, dict):
+        return meta
+    key, value = list(meta.items())[0]
+    if key == '__array__':
+        return arrays[value]
+    if key == '__dict__':
+        return dict((k, _unflatten(v, arrays)) for k, v in value.items())
+    if key == '__list__':
+        return [_unflatten(v, arrays) for v in value]
+    if key == '__tuple__':
+        return tuple(_unflatten(v, arrays) for v in value)
+    if key == '__slice__':
+        return slice(*value)
+    if key == '__dtype__':
+        return np.dtype(value)
+    raise ValueError('Unrecognized checkpoint entry "%s"' % key)
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints on a background thread so that training does not wait
+    for the disk.
+
+    save() copies the state before it returns, so training may go on
+    modifying its arrays in place; the copy is the only cost on the training
+    thread. At most max_pending copies wait to be written, after which save()
+    blocks. If keep_last is not None, only the keep_last most recent
+    checkpoints written by this writer are kept on disk.
+
+    An error raised while writing is raised again by the next call to save(),
+    wait() or close().
+    """
+
+    def __init__(self, keep_last=None, max_pending=1):
+        self.keep_last = keep_last
+        self.written = collections.deque()
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = None
+
+    def save(self, state, filename):
+        """
+        Queue a snapshot of state to be written to filename.
+        """
+        self._check()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+        self._jobs.put((copy.deepcopy(state), filename))
+
+    def wait(self):
+        """
+        Wait until every queued checkpoint is on disk.
+        """
+        self._jobs.join()
+        self._check()
+
+    def close(self):
+        """
+        Write every queued checkpoint and stop the writer thread.
+        """
+        if self._thread is not None:
+            self._jobs.put(None)
+            self._thread.join()
+            self._thread = None
+        self._check()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                self._jobs.task_done()
+                return
+            state, filename = job
+            try:
+                save_checkpoint(state, filename)
+                if filename in self.written:
+                    self.written.remove(filename)
+                self.written.append(filename)
+                while self.keep_last is not None and len(self.written) > self.keep_last:
+                    os.remove(self.written.popleft())
+            except Exception as e:
+                self._error = e
+            self._jobs.task_done()
@@ -4,6 +4,7 @@ import numpy as np
 from cs231n.layers import *
 from cs231n.fast_layers import *
 from cs231n.layer_utils import *
+from cs231n.param_store import ParamStore
 
 
 class ThreeLayerConvNet(object):
@@ -19,7 +20,8 @@ class ThreeLayerConvNet(object):
 
     def __init__(self, input_dim=(3, 32, 32), num_filters=32, filter_size=7,
                  hidden_dim=100, num_classes=10, weight_scale=1e-3, reg=0.0,
-                 dtype=np.float32):
+                 dtype=np.float32, activation_dtype=None, flat_params=False,
+                 fused=True, conv_param=None, pool_param=None):
         """
         Initialize a new network.
 
@@ -33,10 +35,30 @@ class ThreeLayerConvNet(object):
           of weights.
         - reg: Scalar giving L2 regularization strength
         - dtype: numpy datatype to use for computation.
+        - activation_dtype: If not None, a narrower datatype such as np.float16
+          in which the activations cached for the backward pass are stored.
+        - flat_params: If True, store the parameters in a ParamStore so that
+          they share one contiguous buffer.
+        - fused: If True, use conv_relu_pool_forward_fused for the
+          convolutional layer; if False, use conv_relu_pool_forward, which runs
+          conv_forward_fast and max_pool_forward_fast and so honours the
+          options below.
+        - conv_param: Optional dictionary of extra options for
+          conv_forward_fast, e.g. {'backend': 'auto'} or
+          {'engine': ConvEngine()}. The fused layer ignores them.
+        - pool_param: Optional dictionary of extra options for
+          max_pool_forward_fast, e.g. {'compact_cache': True}. The fused layer
+          ignores them.
         """
         self.params = {}
         self.reg = reg
         self.dtype = dtype
+        self.activation_dtype = activation_dtype
+        self.fused = fused
+        self.conv_param = dict(conv_param or {})
+        self.pool_param = dict(pool_param or {})
+        # Set by the Solver when training with loss scaling
+        self.loss_scale = 1.0
 
         ############################################################################
         # TODO: Initialize weights and biases for the three-layer convolutional    #
@@ -65,6 +87,8 @@ class ThreeLayerConvNet(object):
 
         for k, v in self.params.items():
             self.params[k] = v.astype(dtype)
+        if flat_params:
+            self.params = ParamStore(self.params)
 
 
     def loss(self, X, y=None):
@@ -73,16 +97,23 @@ class ThreeLayerConvNet(object):
 
         Input / output: Same API as TwoLayerNet in fc_net.py.
         """
+        X = X.astype(self.dtype)
         W1, b1 = self.params['W1'], self.params['b1']
         W2, b2 = self.params['W2'], self.params['b2']
         W3, b3 = self.params['W3'], self.params['b3']
 
         # pass conv_param to the forward pass for the convolutional layer
         filter_size = W1.shape[2]
-        conv_param = {'stride': 1, 'pad': (filter_size - 1) // 2}
+        conv_param = dict(self.conv_param, stride=1, pad=(filter_size - 1) // 2)
 
         # pass pool_param to the forward pass for the max-pooling layer
-        pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+        pool_param = dict(self.pool_param, pool_height=2, pool_width=2, stride=2)
+
+        if self.fused:
+            conv_forward, conv_backward = (conv_relu_pool_forward_fused,
+                                           conv_relu_pool_backward_fused)
+        else:
+            conv_forward, conv_backward = conv_relu_pool_forward, conv_relu_pool_backward
 
         scores = None
         ############################################################################
@@ -90,9 +121,13 @@ class ThreeLayerConvNet(object):
         # computing the class scores for X and storing them in the scores          #
         # variable.                                                                #
         ############################################################################
-        out, cache1 = conv_relu_pool_forward(X, W1, b1, conv_param, pool_param)
+        params = list(self.params.values())
+        out, cache1 = conv_forward(X, W1, b1, conv_param, pool_param)
+        cache1 = cast_cache(cache1, self.activation_dtype, params)
         out, cache2 = affine_relu_forward(out, W2, b2)
+        cache2 = cast_cache(cache2, self.activation_dtype, params)
         scores, cache3 = affine_forward(out, W3, b3)
+        cache3 = cast_cache(cache3, self.activation_dtype, params)
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
@@ -107,10 +142,12 @@ class ThreeLayerConvNet(object):
         # data loss using softmax, and make sure that grads[k] holds the gradients #
         # for self.params[k]. Don't forget to add L2 regularization!               #
         ############################################################################
-        loss, dX = softmax_loss(scores, y)
+        loss, dX = softmax_loss(scores, y, inplace=True)
+        if self.loss_scale != 1:
+            dX *= self.loss_scale
         dX, dW3, dB3 = affine_backward(dX, cache3)
         dX, dW2, dB2 = affine_relu_backward(dX, cache2)
-        dX, dW1, dB1 = conv_relu_pool_backward(dX, cache1)
+        dX, dW1, dB1 = conv_backward(dX, cache1)
         
         loss += np.sum(W1 ** 2) * self.reg
         loss += np.sum(W2 ** 2) * self.reg
@@ -4,6 +4,7 @@ import numpy as np
 
 from cs231n.layers import *
 from cs231n.layer_utils import *
+from cs231n.param_store import ParamStore
 
 
 class TwoLayerNet(object):
@@ -23,7 +24,7 @@ class TwoLayerNet(object):
     """
 
     def __init__(self, input_dim=3*32*32, hidden_dim=100, num_classes=10,
-                 weight_scale=1e-3, reg=0.0):
+                 weight_scale=1e-3, reg=0.0, flat_params=False):
         """
         Initialize a new network.
 
@@ -35,6 +36,8 @@ class TwoLayerNet(object):
         - weight_scale: Scalar giving the standard deviation for random
           initialization of the weights.
         - reg: Scalar giving L2 regularization strength.
+        - flat_params: If True, store the parameters in a ParamStore so that
+          they share one contiguous buffer.
         """
         self.params = {}
         self.reg = reg
@@ -55,6 +58,9 @@ class TwoLayerNet(object):
         #                             END OF YOUR CODE                             #
         ############################################################################
 
+        if flat_params:
+            self.params = ParamStore(self.params)
+
 
     def loss(self, X, y=None):
         """
@@ -138,7 +144,9 @@ class FullyConnectedNet(object):
 
     def __init__(self, hidden_dims, input_dim=3*32*32, num_classes=10,
                  dropout=0, use_batchnorm=False, reg=0.0,
-                 weight_scale=1e-2, dtype=np.float32, seed=None):
+                 weight_scale=1e-2, dtype=np.float32, seed=None,
+                 activation_dtype=None, loss_type='softmax', loss_param=None,
+                 flat_params=False):
         """
         Initialize a new FullyConnectedNet.
 
@@ -158,12 +166,30 @@ class FullyConnectedNet(object):
         - seed: If not None, then pass this random seed to the dropout layers. This
           will make the dropout layers deteriminstic so we can gradient check the
           model.
+        - activation_dtype: If not None, a narrower datatype such as np.float16
+          in which the activations cached for the backward pass are stored.
+          Parameters and all arithmetic stay in dtype.
+        - loss_type: Training loss for the output layer, for large numbers of
+          classes. 'softmax' is the full softmax; 'sampled' uses
+          sampled_softmax_loss, configured by loss_param (num_sampled is
+          required); 'hierarchical' uses hierarchical_softmax_loss with
+          loss_param['cluster_size'] classes per cluster, default
+          ceil(sqrt(num_classes)), and adds cluster weights Wc and bc. Test-time
+          scores are always exact: the full affine scores, or the
+          hierarchical log-probabilities.
+        - loss_param: Dictionary of options for loss_type, see above.
+        - flat_params: If True, store the parameters in a ParamStore so that
+          they share one contiguous buffer.
         """
         self.use_batchnorm = use_batchnorm
         self.use_dropout = dropout > 0
         self.reg = reg
         self.num_layers = 1 + len(hidden_dims)
         self.dtype = dtype
+        self.activation_dtype = activation_dtype
+        # The Solver sets this when training with loss scaling; the returned
+        # gradients are then those of loss_scale times the loss.
+        self.loss_scale = 1.0
         self.params = {}
 
         ############################################################################
@@ -204,12 +230,25 @@ class FullyConnectedNet(object):
         #                             END OF YOUR CODE                             #
         ############################################################################
 
+        self.loss_type = loss_type
+        self.loss_param = {} if loss_param is None else loss_param
+        if loss_type == 'hierarchical':
+            cluster_size = self.loss_param.setdefault(
+                'cluster_size', int(np.ceil(np.sqrt(num_classes))))
+            num_clusters = -(-num_classes // cluster_size)
+            self.params['Wc'] = weight_scale * np.random.randn(hidden_dims[-1], num_clusters)
+            self.params['bc'] = np.zeros(num_clusters)
+        elif loss_type not in ('softmax', 'sampled'):
+            raise ValueError('Unrecognized loss_type "%s"' % loss_type)
+
         # When using dropout we need to pass a dropout_param dictionary to each
         # dropout layer so that the layer knows the dropout probability and the mode
         # (train / test). You can pass the same dropout_param to each dropout layer.
+        # Dropout follows a ReLU, whose output nothing else caches, and gets a
+        # fresh gradient from the next affine layer, so it can run in place.
         self.dropout_param = {}
         if self.use_dropout:
-            self.dropout_param = {'mode': 'train', 'p': dropout}
+            self.dropout_param = {'mode': 'train', 'p': dropout, 'inplace': True}
             if seed is not None:
                 self.dropout_param['seed'] = seed
 
@@ -217,14 +256,20 @@ class FullyConnectedNet(object):
         # variances, so we need to pass a special bn_param object to each batch
         # normalization layer. You should pass self.bn_params[0] to the forward pass
         # of the first batch normalization layer, self.bn_params[1] to the forward
-        # pass of the second batch normalization layer, etc.
+        # pass of the second batch normalization layer, etc. The input of each
+        # batchnorm layer is a fresh affine output that nothing else caches,
+        # and its upstream gradient is a fresh ReLU gradient, so both can be
+        # overwritten in place.
         self.bn_params = []
         if self.use_batchnorm:
-            self.bn_params = [{'mode': 'train'} for i in range(self.num_layers - 1)]
+            self.bn_params = [{'mode': 'train', 'inplace': True}
+                              for i in range(self.num_layers - 1)]
 
         # Cast all parameters to the correct datatype
         for k, v in self.params.items():
             self.params[k] = v.astype(dtype)
+        if flat_params:
+            self.params = ParamStore(self.params)
 
 
     def loss(self, X, y=None):
@@ -259,30 +304,47 @@ class FullyConnectedNet(object):
         ############################################################################
 
         caches = []
+        params = list(self.params.values())
 
         # {affine - [batch norm] - relu - [dropout]} x (L - 1) - affine - softmax
+        # Every layer runs in place: each ReLU input is a fresh affine or
+        # batchnorm output, and in training the affine layers freeze the
+        # activations they cache until their backward pass, so nothing
+        # downstream can overwrite them. Only activations allocated here are
+        # frozen, never the caller's X, so an exception or a forward pass
+        # without its backward pass leaves nothing read-only that the caller
+        # can see. Caches cast to activation_dtype hold copies, so then
+        # nothing is frozen.
+        freeze = mode == 'train' and self.activation_dtype is None
         H = X
         for L in range(self.num_layers - 1):
             L += 1
 
-            H, cache = affine_forward(H, self.params['W%d' % L], self.params['b%d' % L])
-            caches.append(cache)
+            H, cache = affine_forward(H, self.params['W%d' % L], self.params['b%d' % L],
+                                      inplace=freeze and L > 1)
+            caches.append(cast_cache(cache, self.activation_dtype, params))
 
             if self.use_batchnorm:
-                H, cache = batchnorm_forward(H, self.params['gamma%d' % L], self.params['beta%d' % L], self.bn_params[L-1])
-                caches.append(cache)
+                H, cache = batchnorm_forward_fused(H, self.params['gamma%d' % L], self.params['beta%d' % L], self.bn_params[L-1])
+                caches.append(cast_cache(cache, self.activation_dtype, params))
 
-            H, cache = relu_forward(H)
-            caches.append(cache)
+            H, cache = relu_forward(H, inplace=True)
+            caches.append(cast_cache(cache, self.activation_dtype, params))
 
             if self.use_dropout:
                 H, cache = dropout_forward(H, self.dropout_param)
-                caches.append(cache)
-
-        O, cache = affine_forward(H, self.params['W%d' % self.num_layers], self.params['b%d' % self.num_layers])
-        caches.append(cache)
-
-        scores = O
+                caches.append(cast_cache(cache, self.activation_dtype, params))
+
+        # The sampled and hierarchical losses score only the classes they need
+        # from H, so the full output layer only runs for softmax and at test time
+        W, b = self.params['W%d' % self.num_layers], self.params['b%d' % self.num_layers]
+        if self.loss_type == 'hierarchical' and mode == 'test':
+            scores = hierarchical_softmax_scores(H, W, b, self.params['Wc'], self.params['bc'],
+                                                 self.loss_param['cluster_size'])
+        elif self.loss_type == 'softmax' or mode == 'test':
+            O, cache = affine_forward(H, W, b, inplace=freeze)
+            caches.append(cast_cache(cache, self.activation_dtype, params))
+            scores = O
 
         ############################################################################
         #                             END OF YOUR CODE                             #
@@ -306,13 +368,30 @@ class FullyConnectedNet(object):
         # automated tests, make sure that your L2 regularization includes a factor #
         # of 0.5 to simplify the expression for the gradient.                      #
         ############################################################################
-        loss, dx = softmax_loss(O, y)
+        W_name, b_name = 'W%d' % self.num_layers, 'b%d' % self.num_layers
+        if self.loss_type == 'softmax':
+            # The scores are not needed after the loss, so dx can reuse them
+            loss, dx = softmax_loss(O, y, inplace=True)
+            if self.loss_scale != 1:
+                dx *= self.loss_scale
+            dx, grads[W_name], grads[b_name] = affine_backward(dx, caches.pop())
+        else:
+            if self.loss_type == 'sampled':
+                loss, dx, grads[W_name], grads[b_name] = sampled_softmax_loss(
+                    H, W, b, y, self.loss_param)
+            else:
+                loss, dx, grads[W_name], grads[b_name], grads['Wc'], grads['bc'] = \
+                    hierarchical_softmax_loss(H, W, b, self.params['Wc'], self.params['bc'],
+                                              y, self.loss_param['cluster_size'])
+            if self.loss_scale != 1:
+                for g in [dx] + list(grads.values()):
+                    g *= self.loss_scale
 
         for L in range(self.num_layers):
             L += 1
             loss += 0.5 * self.reg * np.sum(self.params['W%d' % L] ** 2)
-
-        dx, grads['W%d' % self.num_layers], grads['b%d' % self.num_layers] = affine_backward(dx, caches.pop())
+        if self.loss_type == 'hierarchical':
+            loss += 0.5 * self.reg * np.sum(self.params['Wc'] ** 2)
 
         # {affine - [batch norm] - relu - [dropout]} x (L - 1) - affine - softmax
         for L in reversed(range(self.num_layers - 1)):
@@ -321,16 +400,18 @@ class FullyConnectedNet(object):
             if self.use_dropout:
                 dx = dropout_backward(dx, caches.pop())
 
-            dx = relu_backward(dx, caches.pop())
+            dx = relu_backward(dx, caches.pop(), inplace=True)
 
             if self.use_batchnorm:
-                dx, grads['gamma%d' % L], grads['beta%d' % L] = batchnorm_backward(dx, caches.pop())
+                dx, grads['gamma%d' % L], grads['beta%d' % L] = batchnorm_backward_fused(dx, caches.pop())
 
             dx, grads['W%d' % L], grads['b%d' % L] = affine_backward(dx, caches.pop())
 
         for L in range(self.num_layers):
             L += 1
-            grads['W%d' % L] += self.reg * self.params['W%d' % L]
+            grads['W%d' % L] += self.reg * self.loss_scale * self.params['W%d' % L]
+        if self.loss_type == 'hierarchical':
+            grads['Wc'] += self.reg * self.loss_scale * self.params['Wc']
         ############################################################################
         #                             END OF YOUR CODE                             #
         ############################################################################
@@ -15,42 +15,45 @@ def load_pickle(f):
         return  pickle.load(f, encoding='latin1')
     raise ValueError("invalid python version: {}".format(version))
 
-def load_CIFAR_batch(filename):
+def load_CIFAR_batch(filename, dtype="float"):
     """ load single batch of cifar """
     with open(filename, 'rb') as f:
         datadict = load_pickle(f)
         X = datadict['data']
         Y = datadict['labels']
-        X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype("float")
+        X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype(dtype)
         Y = np.array(Y)
         return X, Y
 
-def load_CIFAR10(ROOT):
+def load_CIFAR10(ROOT, dtype="float"):
     """ load all of cifar """
     xs = []
     ys = []
     for b in range(1,6):
         f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
-        X, Y = load_CIFAR_batch(f)
+        X, Y = load_CIFAR_batch(f, dtype)
         xs.append(X)
         ys.append(Y)
     Xtr = np.concatenate(xs)
     Ytr = np.concatenate(ys)
     del X, Y
-    Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'))
+    Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'), dtype)
     return Xtr, Ytr, Xte, Yte
 
 
 def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
-                     subtract_mean=True):
+                     subtract_mean=True, dtype=np.float64):
     """
     Load the CIFAR-10 dataset from disk and perform preprocessing to prepare
     it for classifiers. These are the same steps as we used for the SVM, but
     condensed to a single function.
+
+    The images are stored as dtype; np.float16 quarters the memory of the
+    default float64, and models cast each minibatch to their own dtype.
     """
     # Load the raw CIFAR-10 data
     cifar10_dir = 'cs231n/datasets/cifar-10-batches-py'
-    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir)
+    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir, dtype)
 
     # Subsample the data
     mask = list(range(num_training, num_training + num_validation))
@@ -0,0 +1,203 @@
+from future import standard_library
+standard_library.install_aliases()
+from builtins import range
+from builtins import object
+import copy
+import queue
+import threading
+
+import numpy as np
+
+
+def evaluate(model, X, y=None, batch_size=100, num_samples=None, top_k=(1,),
+             confusion=False, loss=False, rng=None):
+    """
+    Evaluate a model on a dataset in one streaming pass over minibatches.
+
+    Without subsampling the minibatches are contiguous slices of X, so no part
+    of X is copied; with num_samples, a sorted random subset of the rows is
+    drawn without replacement and gathered one minibatch at a time. Either way
+    the memory used beyond the model is O(batch_size) plus the predictions.
+
+    Inputs:
+    - model: A model whose loss(X) returns class scores, as in Solver
+    - X: Array of data, of shape (N, d_1, ..., d_k)
+    - y: Array of labels, of shape (N,), or None to only predict
+    - batch_size: Number of samples per forward pass
+    - num_samples: If not None and less than N, evaluate on this many
+      randomly chosen samples
+    - top_k: Values of k for which to compute the top-k accuracy
+    - confusion: If True, also compute the confusion matrix
+    - loss: If True, also compute the mean softmax loss of the scores
+    - rng: RandomState used for subsampling; np.random by default. Pass
+      one when evaluating off the training thread, which must not share
+      np.random with training.
+
+    Returns a dictionary holding:
+    - y_pred: Integer array of the predicted classes
+    - idx: The indices of the evaluated rows of X, or None for all of them
+    and, if y is given:
+    - acc: Accuracy of y_pred
+    - top<k>: Top-k accuracy for every k > 1 in top_k
+    - confusion: If requested, array of shape (C, C) whose [i, j] element
+      counts the samples of class i predicted as class j
+    - loss: If requested, the mean softmax loss
+    """
+    N = X.shape[0]
+    idx = None
+    if num_samples is not None and N > num_samples:
+        if rng is None:
+            rng = np.random
+        idx = np.sort(rng.choice(N, num_samples, replace=False))
+        N = num_samples
+
+    y_pred = np.empty(N, dtype=np.intp)
+    top_k = [k for k in top_k if k > 1]
+    num_correct = dict((k, 0) for k in top_k)
+    conf = None
+    total_loss = 0.0
+
+    for start in range(0, N, batch_size):
+        end = min(start + batch_size, N)
+        if idx is None:
+            X_batch = X[start:end]
+            y_batch = None if y is None else y[start:end]
+        else:
+            X_batch = X[idx[start:end]]
+            y_batch = None if y is None else y[idx[start:end]]
+
+        scores = model.loss(X_batch)
+        np.argmax(scores, axis=1, out=y_pred[start:end])
+        if y is None:
+            continue
+
+        for k in top_k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            num_correct[k] += np.sum(top == y_batch[:, None])
+        if confusion:
+            C = scores.shape[1]
+            if conf is None:
+                conf = np.zeros((C, C), dtype=np.int64)
+            conf += np.bincount(y_batch * C + y_pred[start:end],
+                                minlength=C * C).reshape(C, C)
+        if loss:
+            shifted = scores - np.max(scores, axis=1, keepdims=True)
+            log_z = np.log(np.sum(np.exp(shifted), axis=1))
+            total_loss += np.sum(log_z - shifted[np.arange(end - start), y_batch])
+
+    results = {'y_pred': y_pred, 'idx': idx}
+    if y is None:
+        return results
+    y_eval = y if idx is None else y[idx]
+    results['acc'] = np.mean(y_pred == y_eval)
+    for k in top_k:
+        results['top%d' % k] = num_correct[k] / float(N)
+    if confusion:
+        results['confusion'] = conf
+    if loss:
+        results['loss'] = total_loss / N
+    return results
+
+
+class AsyncEvaluator(object):
+    """
+    Runs evaluations on a worker thread while training continues.
+
+    submit() takes a deep copy of the model, so the evaluation sees the
+    parameters as they were at that moment, and queues it for evaluate_fn.
+    Since NumPy releases the GIL in its heavy operations, the evaluation
+    overlaps with the training steps that follow. Results are returned in
+    submission order by poll() and wait().
+
+    evaluate_fn runs concurrently with training, so it must not draw from
+    np.random: pass it a seed or RandomState created on the training thread,
+    e.g. through the args of submit(), and give that to evaluate(rng=...).
+
+    Example usage:
+
+    evaluator = AsyncEvaluator(lambda model, epoch: evaluate(model, X_val, y_val))
+    evaluator.submit(model, epoch)
+    ...
+    for results in evaluator.poll():
+        ...
+    """
+
+    def __init__(self, evaluate_fn, max_pending=1):
+        """
+        Inputs:
+        - evaluate_fn: Function evaluate_fn(model, *args) run on the worker;
+          its return value is what poll() and wait() return
+        - max_pending: Maximum number of model copies waiting to be evaluated;
+          submit() blocks while this many are queued
+        """
+        self.evaluate_fn = evaluate_fn
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._results = queue.Queue()
+        self._num_pending = 0
+        self._thread = None
+
+    def submit(self, model, *args):
+        """
+        Queue an evaluation of a snapshot of model.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work)
+            self._thread.daemon = True
+            self._thread.start()
+        self._jobs.put((copy.deepcopy(model), args))
+        self._num_pending += 1
+
+    def poll(self):
+        """
+        Returns a list with the results of all evaluations that have finished,
+        without waiting for the others.
+        """
+        results = []
+        while self._num_pending > 0:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            results.append(self._unwrap(result))
+        return results
+
+    def wait(self):
+        """
+        Wait for all submitted evaluations and return their results as a list.
+        """
+        results = []
+        while self._num_pending > 0:
+            results.append(self._unwrap(self._results.get()))
+        return results
+
+    def close(self):
+        """
+        Wait for all submitted evaluations, discarding their results, and stop
+        the worker thread.
+        """
+        if self._thread is None:
+            return
+        self._jobs.put(None)
+        self._thread.join()
+        self._thread = None
+        self._results = queue.Queue()
+        self._num_pending = 0
+
+    def _unwrap(self, result):
+        self._num_pending -= 1
+        ok, value = result
+        if not ok:
+            raise value
+        return value
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            model, args = job
+            try:
+                result = (True, self.evaluate_fn(model, *args))
+            except Exception as e:
+                result = (False, e)
+            self._results.put(result)
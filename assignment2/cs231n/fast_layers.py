@@ -1,14 +1,36 @@
 from __future__ import print_function
+import json
+import multiprocessing
+import os
+import threading
+from timeit import default_timer
+
 import numpy as np
 try:
     from cs231n.im2col_cython import col2im_cython, im2col_cython
     from cs231n.im2col_cython import col2im_6d_cython
+    from cs231n.im2col_cython import im2col_cython_parallel
+    from cs231n.im2col_cython import col2im_cython_parallel
+    from cs231n.im2col_cython import col2im_6d_cython_parallel
 except ImportError:
     print('run the following from the cs231n directory and try again:')
     print('python setup.py build_ext --inplace')
     print('You may also need to restart your iPython kernel')
 
 from cs231n.im2col import *
+from cs231n.layers import conv_forward_naive, conv_backward_naive
+from cs231n.layers import conv_forward_vectorized, conv_backward_vectorized
+
+# Number of OpenMP threads used by the parallel im2col / col2im kernels
+cython_num_threads = multiprocessing.cpu_count()
+
+
+def set_cython_num_threads(n):
+    """
+    Set the number of threads used by the Cython im2col / col2im kernels.
+    """
+    global cython_num_threads
+    cython_num_threads = max(1, int(n))
 
 
 def conv_forward_im2col(x, w, b, conv_param):
@@ -30,7 +52,8 @@ def conv_forward_im2col(x, w, b, conv_param):
     out = np.zeros((N, num_filters, out_height, out_width), dtype=x.dtype)
 
     # x_cols = im2col_indices(x, w.shape[2], w.shape[3], pad, stride)
-    x_cols = im2col_cython(x, w.shape[2], w.shape[3], pad, stride)
+    x_cols = im2col_cython_parallel(x, w.shape[2], w.shape[3], pad, stride,
+                                    cython_num_threads)
     res = w.reshape((w.shape[0], -1)).dot(x_cols) + b.reshape(-1, 1)
 
     out = res.reshape(w.shape[0], out.shape[2], out.shape[3], x.shape[0])
@@ -40,14 +63,16 @@ def conv_forward_im2col(x, w, b, conv_param):
     return out, cache
 
 
-def conv_forward_strides(x, w, b, conv_param):
-    N, C, H, W = x.shape
-    F, _, HH, WW = w.shape
-    stride, pad = conv_param['stride'], conv_param['pad']
+def im2col_strides(x, HH, WW, stride, pad):
+    """
+    Pad x and lay out its receptive fields as the columns of a matrix by
+    picking clever strides, as used by conv_forward_strides.
 
-    # Check dimensions
-    #assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
-    #assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+    Returns a tuple of:
+    - x_cols: Array of shape (C * HH * WW, N * out_h * out_w)
+    - out_h, out_w: Spatial size of the convolution output
+    """
+    N, C, H, W = x.shape
 
     # Pad the input
     p = pad
@@ -67,6 +92,19 @@ def conv_forward_strides(x, w, b, conv_param):
                   shape=shape, strides=strides)
     x_cols = np.ascontiguousarray(x_stride)
     x_cols.shape = (C * HH * WW, N * out_h * out_w)
+    return x_cols, out_h, out_w
+
+
+def conv_forward_strides(x, w, b, conv_param):
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+
+    # Check dimensions
+    #assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
+    #assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+
+    x_cols, out_h, out_w = im2col_strides(x, HH, WW, stride, pad)
 
     # Now all our convolutions are a big matrix multiply
     res = w.reshape(F, -1).dot(x_cols) + b.reshape(-1, 1)
@@ -99,8 +137,41 @@ def conv_backward_strides(dout, cache):
 
     dx_cols = w.reshape(F, -1).T.dot(dout_reshaped)
     dx_cols.shape = (C, HH, WW, N, out_h, out_w)
-    dx = col2im_6d_cython(dx_cols, N, C, H, W, HH, WW, pad, stride)
+    dx = col2im_6d_cython_parallel(dx_cols, N, C, H, W, HH, WW, pad, stride,
+                                   cython_num_threads)
+
+    return dx, dw, db
+
+
+def conv_backward_gemm(da, x, w, conv_param):
+    """
+    Gradients of a convolution given the upstream gradient da in the
+    (F, N, out_h, out_w) layout of the GEMM output, computed with the same
+    matrix multiplies as conv_backward_strides. The im2col columns are rebuilt
+    from x rather than read from a cache; this is used by the fused layers in
+    layer_utils, which only keep the input around. If x was stored in a
+    narrower dtype (see layer_utils.cast_cache) it is upcast to w.dtype first.
+
+    Returns a tuple of:
+    - dx, dw, db: Gradients with respect to x, w and the bias
+    """
+    x = x.astype(w.dtype, copy=False)
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    _, _, out_h, out_w = da.shape
+
+    db = np.sum(da, axis=(1, 2, 3))
+
+    da = da.reshape(F, -1)
+    x_cols, _, _ = im2col_strides(x, HH, WW, stride, pad)
+    dw = da.dot(x_cols.T).reshape(w.shape)
+    del x_cols
 
+    dx_cols = w.reshape(F, -1).T.dot(da)
+    dx_cols.shape = (C, HH, WW, N, out_h, out_w)
+    dx = col2im_6d_cython_parallel(dx_cols, N, C, H, W, HH, WW, pad, stride,
+                                   cython_num_threads)
     return dx, dw, db
 
 
@@ -120,24 +191,580 @@ def conv_backward_im2col(dout, cache):
 
     dx_cols = w.reshape(num_filters, -1).T.dot(dout_reshaped)
     # dx = col2im_indices(dx_cols, x.shape, filter_height, filter_width, pad, stride)
-    dx = col2im_cython(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
-                       filter_height, filter_width, pad, stride)
+    dx = col2im_cython_parallel(dx_cols, x.shape[0], x.shape[1], x.shape[2],
+                                x.shape[3], filter_height, filter_width, pad,
+                                stride, cython_num_threads)
+
+    return dx, dw, db
+
+
+class ConvEngine(object):
+    """
+    A convolution engine that implements the same algorithm as
+    conv_forward_strides / conv_backward_strides, but preallocates its padded
+    input, column, GEMM and output buffers and reuses them across calls. GEMM
+    results are written straight into the buffers with out=, so after the first
+    call for a given layer shape a forward / backward pass allocates nothing
+    input-sized except the returned weight gradient.
+
+    Workspaces are keyed by (N, C, H, W, F, HH, WW, stride, pad, dtype). The
+    arrays returned by forward and backward are views into the workspace, so
+    they are only valid until the next call with the same key; likewise the
+    cache returned by forward refers to the workspace and must be consumed by
+    backward before the engine runs forward again on the same shape. In
+    practice this means you should use one engine per convolutional layer.
+
+    Example usage:
+
+    engine = ConvEngine()
+    conv_param = {'stride': 1, 'pad': 1, 'engine': engine}
+    out, cache = conv_relu_forward(x, w, b, conv_param)
+    dx, dw, db = conv_relu_backward(dout, cache)
+    """
+
+    def __init__(self):
+        self.workspaces = {}
+
+    def clear(self):
+        """
+        Release all buffers held by the engine.
+        """
+        self.workspaces = {}
+
+    def _workspace(self, x, w, stride, pad):
+        N, C, H, W = x.shape
+        F, _, HH, WW = w.shape
+        dtype = np.result_type(x, w)
+        key = (N, C, H, W, F, HH, WW, stride, pad, dtype.str)
+        ws = self.workspaces.get(key)
+        if ws is not None:
+            return ws
+
+        Hp, Wp = H + 2 * pad, W + 2 * pad
+        out_h = (Hp - HH) // stride + 1
+        out_w = (Wp - WW) // stride + 1
+        ws = {
+          'out_h': out_h,
+          'out_w': out_w,
+          # Borders of the padded buffers are zeroed once and never written
+          'x_padded': np.zeros((N, C, Hp, Wp), dtype=dtype),
+          'x_cols': np.empty((C * HH * WW, N * out_h * out_w), dtype=dtype),
+          'res': np.empty((F, N * out_h * out_w), dtype=dtype),
+          'out': np.empty((N, F, out_h, out_w), dtype=dtype),
+          'dout_reshaped': np.empty((F, N * out_h * out_w), dtype=dtype),
+          'dx_cols': np.empty((C * HH * WW, N * out_h * out_w), dtype=dtype),
+          'dx_padded': np.empty((N, C, Hp, Wp), dtype=dtype),
+        }
+        self.workspaces[key] = ws
+        return ws
+
+    def forward(self, x, w, b, conv_param):
+        """
+        Forward pass; same inputs and outputs as conv_forward_strides.
+        """
+        N, C, H, W = x.shape
+        F, _, HH, WW = w.shape
+        stride, pad = conv_param['stride'], conv_param['pad']
+        ws = self._workspace(x, w, stride, pad)
+        out_h, out_w = ws['out_h'], ws['out_w']
+
+        # Copy the input into the interior of the padded buffer
+        x_padded = ws['x_padded']
+        x_padded[:, :, pad:pad + H, pad:pad + W] = x
+
+        # Gather the strided im2col view straight into the column buffer
+        Hp, Wp = x_padded.shape[2:]
+        shape = (C, HH, WW, N, out_h, out_w)
+        strides = (Hp * Wp, Wp, 1, C * Hp * Wp, stride * Wp, stride)
+        strides = x_padded.itemsize * np.array(strides)
+        x_stride = np.lib.stride_tricks.as_strided(x_padded,
+                      shape=shape, strides=strides)
+        x_cols = ws['x_cols']
+        np.copyto(x_cols.reshape(shape), x_stride)
+
+        # GEMM into the result buffer, then add the bias in place
+        res = ws['res']
+        np.dot(w.reshape(F, -1).astype(res.dtype, copy=False), x_cols, out=res)
+        res += b.reshape(-1, 1)
+
+        out = ws['out']
+        np.copyto(out, res.reshape(F, N, out_h, out_w).transpose(1, 0, 2, 3))
+
+        cache = (x.shape, w, conv_param, ws)
+        return out, cache
+
+    def backward(self, dout, cache):
+        """
+        Backward pass; same inputs and outputs as conv_backward_strides.
+        """
+        x_shape, w, conv_param, ws = cache
+        stride, pad = conv_param['stride'], conv_param['pad']
+
+        N, C, H, W = x_shape
+        F, _, HH, WW = w.shape
+        out_h, out_w = ws['out_h'], ws['out_w']
+
+        db = np.sum(dout, axis=(0, 2, 3))
+
+        dout_reshaped = ws['dout_reshaped']
+        np.copyto(dout_reshaped.reshape(F, N, out_h, out_w),
+                  dout.transpose(1, 0, 2, 3))
+        dw = dout_reshaped.dot(ws['x_cols'].T).reshape(w.shape)
+
+        dx_cols = ws['dx_cols']
+        w_flat = w.reshape(F, -1).astype(dx_cols.dtype, copy=False)
+        np.dot(w_flat.T, dout_reshaped, out=dx_cols)
+
+        # col2im: one vectorized scatter-add per filter offset
+        dx_cols = dx_cols.reshape(C, HH, WW, N, out_h, out_w)
+        dx_padded = ws['dx_padded']
+        dx_padded.fill(0)
+        for hh in range(HH):
+            for ww in range(WW):
+                window = dx_padded[:, :, hh:hh + stride * out_h:stride,
+                                   ww:ww + stride * out_w:stride]
+                window += dx_cols[:, hh, ww].transpose(1, 0, 2, 3)
+
+        dx = dx_padded[:, :, pad:pad + H, pad:pad + W]
+        return dx, dw, db
+
+
+def conv_forward_fft(x, w, b, conv_param):
+    """
+    A forward pass for a convolutional layer computed in the frequency domain.
+
+    The padded input and the filters are transformed with a 2D real FFT of the
+    padded input size; the channel reduction is then a batched complex matrix
+    multiply per frequency, and a single inverse FFT gives the (circular)
+    correlation, whose first out_h x out_w strided entries are exactly the
+    convolution output. The cost does not grow with the filter size, so this
+    is a good fit for large filters such as 7x7.
+
+    Inputs / outputs: Same as conv_forward_naive, except the cache is
+    (x, w, b, conv_param, x_fft, w_fft).
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    Hp, Wp = H + 2 * pad, W + 2 * pad
+    out_h = (Hp - HH) // stride + 1
+    out_w = (Wp - WW) // stride + 1
+
+    x_fft = np.fft.rfft2(x_padded)
+    w_fft = np.fft.rfft2(w, s=(Hp, Wp))
+    K = x_fft.shape[2] * x_fft.shape[3]
+
+    # Sum over channels: (K, N, C) x (K, C, F) -> (K, N, F)
+    x_k = x_fft.reshape(N, C, K).transpose(2, 0, 1)
+    w_k = np.conj(w_fft).reshape(F, C, K).transpose(2, 1, 0)
+    out_k = np.matmul(x_k, w_k)
+    out_fft = out_k.transpose(1, 2, 0).reshape(N, F, x_fft.shape[2], -1)
+    res = np.fft.irfft2(out_fft, s=(Hp, Wp))
+
+    out = res[:, :, :(out_h - 1) * stride + 1:stride,
+              :(out_w - 1) * stride + 1:stride]
+    out = out + b.reshape(1, -1, 1, 1)
+    out = out.astype(x.dtype, copy=False)
+
+    cache = (x, w, b, conv_param, x_fft, w_fft)
+    return out, cache
+
+
+def conv_backward_fft(dout, cache):
+    """
+    Backward pass for conv_forward_fft.
+
+    The upstream gradient is scattered onto the stride grid of a padded-size
+    array and transformed once; dx is then a frequency-domain convolution with
+    the filters and dw a frequency-domain correlation with the input, reusing
+    the spectra saved by the forward pass.
+    """
+    x, w, b, conv_param, x_fft, w_fft = cache
+    stride, pad = conv_param['stride'], conv_param['pad']
+
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    _, _, out_h, out_w = dout.shape
+    Hp, Wp = H + 2 * pad, W + 2 * pad
+    K = x_fft.shape[2] * x_fft.shape[3]
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    dout_full = np.zeros((N, F, Hp, Wp), dtype=dout.dtype)
+    dout_full[:, :, :out_h * stride:stride, :out_w * stride:stride] = dout
+    dout_fft = np.fft.rfft2(dout_full)
+    dout_k = dout_fft.reshape(N, F, K).transpose(2, 0, 1)
+
+    # dx: (K, N, F) x (K, F, C) -> (K, N, C)
+    w_k = w_fft.reshape(F, C, K).transpose(2, 0, 1)
+    dx_k = np.matmul(dout_k, w_k)
+    dx_fft = dx_k.transpose(1, 2, 0).reshape(N, C, x_fft.shape[2], -1)
+    dx_padded = np.fft.irfft2(dx_fft, s=(Hp, Wp))
+    dx = dx_padded[:, :, pad:pad + H, pad:pad + W].astype(x.dtype)
+
+    # dw: (K, F, N) x (K, N, C) -> (K, F, C)
+    x_k = x_fft.reshape(N, C, K).transpose(2, 0, 1)
+    dw_k = np.matmul(np.conj(dout_k).transpose(0, 2, 1), x_k)
+    dw_fft = dw_k.transpose(1, 2, 0).reshape(F, C, x_fft.shape[2], -1)
+    dw = np.fft.irfft2(dw_fft, s=(Hp, Wp))[:, :, :HH, :WW].astype(w.dtype)
 
     return dx, dw, db
 
 
-conv_forward_fast = conv_forward_strides
-conv_backward_fast = conv_backward_strides
+# Winograd F(2x2, 3x3) transforms; see Lavin & Gray, "Fast Algorithms for
+# Convolutional Neural Networks".
+_WINOGRAD_BT = np.array([[1, 0, -1, 0],
+                         [0, 1, 1, 0],
+                         [0, -1, 1, 0],
+                         [0, 1, 0, -1]], dtype=np.float64)
+_WINOGRAD_G = np.array([[1, 0, 0],
+                        [0.5, 0.5, 0.5],
+                        [0.5, -0.5, 0.5],
+                        [0, 0, 1]], dtype=np.float64)
+_WINOGRAD_AT = np.array([[1, 1, 1, 0],
+                         [0, 1, -1, -1]], dtype=np.float64)
+
+
+def _winograd_correlate(x_padded, w):
+    """
+    Valid stride-1 correlation of an already padded input of shape
+    (N, C, Hp, Wp) with 3x3 filters of shape (F, C, 3, 3), computed with the
+    Winograd F(2x2, 3x3) algorithm. Returns an array of shape
+    (N, F, Hp - 2, Wp - 2) without any bias.
+    """
+    N, C, Hp, Wp = x_padded.shape
+    F = w.shape[0]
+    out_h, out_w = Hp - 2, Wp - 2
+    tiles_h, tiles_w = (out_h + 1) // 2, (out_w + 1) // 2
+    dtype = np.result_type(x_padded, w)
+    BT = _WINOGRAD_BT.astype(dtype)
+    G = _WINOGRAD_G.astype(dtype)
+    AT = _WINOGRAD_AT.astype(dtype)
+
+    # Round the input up to a whole number of overlapping 4x4 tiles
+    extra_h = 2 * tiles_h + 2 - Hp
+    extra_w = 2 * tiles_w + 2 - Wp
+    if extra_h or extra_w:
+        x_padded = np.pad(x_padded, ((0, 0), (0, 0), (0, extra_h), (0, extra_w)),
+                          mode='constant')
+    x_padded = np.ascontiguousarray(x_padded)
+    Wt = x_padded.shape[3]
+    s = x_padded.itemsize
+    shape = (N, C, tiles_h, tiles_w, 4, 4)
+    strides = (C * x_padded.shape[2] * Wt * s, x_padded.shape[2] * Wt * s,
+               2 * Wt * s, 2 * s, Wt * s, s)
+    d = np.lib.stride_tricks.as_strided(x_padded, shape=shape, strides=strides)
+
+    # Input transform V = B^T d B, laid out as (16, C, P)
+    V = np.tensordot(BT, d, axes=(1, 4))      # (4, N, C, th, tw, 4)
+    V = np.tensordot(V, BT, axes=(5, 1))      # (4, N, C, th, tw, 4)
+    V = V.transpose(0, 5, 2, 1, 3, 4).reshape(16, C, -1)
+
+    # Filter transform U = G g G^T, laid out as (16, F, C)
+    U = np.tensordot(G, w, axes=(1, 2))       # (4, F, C, 3)
+    U = np.tensordot(U, G, axes=(3, 1))       # (4, F, C, 4)
+    U = U.transpose(0, 3, 1, 2).reshape(16, F, C)
+
+    # Elementwise products summed over channels are 16 independent GEMMs
+    M = np.matmul(U, V).reshape(4, 4, F, N, tiles_h, tiles_w)
+
+    # Output transform Y = A^T M A
+    Y = np.tensordot(AT, M, axes=(1, 0))      # (2, 4, F, N, th, tw)
+    Y = np.tensordot(Y, AT, axes=(1, 1))      # (2, F, N, th, tw, 2)
+    Y = Y.transpose(2, 1, 3, 0, 4, 5).reshape(N, F, 2 * tiles_h, 2 * tiles_w)
+    return Y[:, :, :out_h, :out_w]
+
+
+def conv_forward_winograd(x, w, b, conv_param):
+    """
+    A forward pass for a convolutional layer with 3x3 filters and stride 1
+    using the Winograd F(2x2, 3x3) minimal filtering algorithm, which needs
+    16 multiplies per 2x2 output tile instead of 36.
+
+    Inputs / outputs: Same as conv_forward_naive, except the cache is
+    (x, w, b, conv_param, x_padded).
+    """
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    assert HH == WW == 3, 'Winograd convolution requires 3x3 filters'
+    assert stride == 1, 'Winograd convolution requires stride 1'
+
+    p = pad
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    out = _winograd_correlate(x_padded, w) + b.reshape(1, -1, 1, 1)
+    out = out.astype(x.dtype, copy=False)
+
+    cache = (x, w, b, conv_param, x_padded)
+    return out, cache
+
+
+def conv_backward_winograd(dout, cache):
+    """
+    Backward pass for conv_forward_winograd.
+
+    dx is itself a stride-1 3x3 correlation of the zero-padded upstream
+    gradient with the flipped, transposed filters, so it reuses the Winograd
+    kernel; dw is accumulated with one tensordot per filter tap.
+    """
+    x, w, b, conv_param, x_padded = cache
+    pad = conv_param['pad']
+
+    N, C, H, W = x.shape
+    _, _, out_h, out_w = dout.shape
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    w_flipped = w[:, :, ::-1, ::-1].transpose(1, 0, 2, 3)
+    dout_padded = np.pad(dout, ((0, 0), (0, 0), (2, 2), (2, 2)), mode='constant')
+    dx_padded = _winograd_correlate(dout_padded, w_flipped)
+    dx = dx_padded[:, :, pad:pad + H, pad:pad + W].astype(x.dtype)
+
+    dw = np.empty(w.shape, dtype=np.result_type(dout, x_padded))
+    for i in range(3):
+        for j in range(3):
+            window = x_padded[:, :, i:i + out_h, j:j + out_w]
+            dw[:, :, i, j] = np.tensordot(dout, window, axes=([0, 2, 3], [0, 2, 3]))
+    dw = dw.astype(w.dtype, copy=False)
+
+    return dx, dw, db
+
+
+def _supports_any(x_shape, w_shape, conv_param):
+    return True
+
+
+def _supports_winograd(x_shape, w_shape, conv_param):
+    return w_shape[2] == w_shape[3] == 3 and conv_param['stride'] == 1
+
+
+def _supports_naive(x_shape, w_shape, conv_param):
+    # conv_backward_naive crops its padded gradient with [pad:-pad]
+    return conv_param['pad'] > 0
+
+
+def _supports_im2col(x_shape, w_shape, conv_param):
+    # im2col_cython indexes filter rows assuming square filters
+    stride, pad = conv_param['stride'], conv_param['pad']
+    return (w_shape[2] == w_shape[3] and
+            (x_shape[2] + 2 * pad - w_shape[2]) % stride == 0 and
+            (x_shape[3] + 2 * pad - w_shape[3]) % stride == 0)
+
+
+# Convolution backends that conv_forward_fast can use. Each entry maps a name
+# to a (forward, backward, supports) triple, where supports takes the input
+# shape, filter shape and conv_param and says whether the backend applies.
+CONV_BACKENDS = {
+  'strides': (conv_forward_strides, conv_backward_strides, _supports_any),
+  'im2col': (conv_forward_im2col, conv_backward_im2col, _supports_im2col),
+  'naive': (conv_forward_naive, conv_backward_naive, _supports_naive),
+  'vectorized': (conv_forward_vectorized, conv_backward_vectorized,
+                 _supports_any),
+  'fft': (conv_forward_fft, conv_backward_fft, _supports_any),
+  'winograd': (conv_forward_winograd, conv_backward_winograd,
+               _supports_winograd),
+}
+
+# Backends that can be named in conv_param['backend'] but are never timed by
+# the tuner: the naive layers loop over every output pixel in Python, which
+# takes tens of seconds on a CIFAR-10 sized layer, and never win.
+_CONV_BACKENDS_UNTUNED = set(['naive'])
+
+# Maps a layer shape key to the name of the fastest backend measured for it
+conv_backend_table = {}
+
+# If not None, conv_backend_table is written to this JSON file whenever a new
+# shape is tuned; set by load_conv_tuning.
+conv_tuning_file = None
+
+# Number of timed runs of each backend when tuning, after one warmup run; the
+# fastest run is what counts.
+conv_tuning_repeats = 3
+
+# Guards conv_backend_table and its file, which may be used from several
+# threads at once, e.g. by the Solver's asynchronous evaluation.
+_conv_tuning_lock = threading.RLock()
+
+
+def _conv_shape_key(x, w, conv_param):
+    """
+    Returns the key of a layer shape in conv_backend_table. The batch size is
+    rounded up to a power of two so that e.g. a smaller last minibatch reuses
+    the decision made for the full ones.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    batch = 1
+    while batch < N:
+        batch *= 2
+    return (batch, C, H, W, F, HH, WW, conv_param['stride'], conv_param['pad'],
+            np.result_type(x, w).str)
+
+
+def _tune_conv_backend(x, w, b, conv_param):
+    """
+    Time the forward and backward pass of every applicable backend on the
+    given inputs and return the name of the fastest one. Each backend runs
+    once to warm up caches and workspaces and is then timed as the best of
+    conv_tuning_repeats runs. Backends that need the Cython extension are
+    skipped if it is not built.
+    """
+    best_name, best_time = None, None
+    for name in sorted(CONV_BACKENDS):
+        forward, backward, supports = CONV_BACKENDS[name]
+        if name in _CONV_BACKENDS_UNTUNED or not supports(x.shape, w.shape, conv_param):
+            continue
+        elapsed = None
+        try:
+            for i in range(conv_tuning_repeats + 1):
+                t0 = default_timer()
+                out, cache = forward(x, w, b, conv_param)
+                backward(np.ones_like(out), cache)
+                t = default_timer() - t0
+                if i > 0 and (elapsed is None or t < elapsed):
+                    elapsed = t
+        except NameError:
+            # A kernel from im2col_cython that failed to import
+            continue
+        if best_time is None or elapsed < best_time:
+            best_name, best_time = name, elapsed
+    return best_name
+
+
+def save_conv_tuning(filename):
+    """
+    Write conv_backend_table to a JSON file so that a later job can skip
+    tuning by calling load_conv_tuning.
+    """
+    with _conv_tuning_lock:
+        records = []
+        for key in sorted(conv_backend_table):
+            batch, C, H, W, F, HH, WW, stride, pad, dtype = key
+            records.append({
+              'batch': batch,
+              'x_shape': [C, H, W],
+              'w_shape': [F, HH, WW],
+              'stride': stride,
+              'pad': pad,
+              'dtype': dtype,
+              'backend': conv_backend_table[key],
+            })
+        with open(filename, 'w') as f:
+            json.dump(records, f)
+
+
+def load_conv_tuning(filename, autosave=True):
+    """
+    Merge the tuning decisions stored in a JSON file by save_conv_tuning into
+    conv_backend_table. Entries naming backends that no longer exist, or
+    written before shapes were keyed per batch bucket, are ignored. A missing
+    file is treated as empty.
+
+    Inputs:
+    - filename: Path to the JSON file.
+    - autosave: If True, newly tuned shapes are written back to filename as
+      soon as they are measured, so the next job starts fully tuned.
+    """
+    global conv_tuning_file
+    with _conv_tuning_lock:
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                records = json.load(f)
+            for r in records:
+                if r['backend'] not in CONV_BACKENDS or 'batch' not in r:
+                    continue
+                key = ((r['batch'],) + tuple(r['x_shape']) + tuple(r['w_shape']) +
+                       (r['stride'], r['pad'], r['dtype']))
+                conv_backend_table[key] = r['backend']
+        if autosave:
+            conv_tuning_file = filename
+
+
+def conv_forward_auto(x, w, b, conv_param):
+    """
+    Forward pass for a convolutional layer that picks the fastest backend in
+    CONV_BACKENDS for this layer shape. The first call for each shape times
+    all applicable backends; the decision is cached in conv_backend_table and
+    reused by subsequent calls. Tuning holds a lock, so concurrent callers
+    neither tune the same shape twice nor skew each other's timings.
+    """
+    key = _conv_shape_key(x, w, conv_param)
+    name = conv_backend_table.get(key)
+    if name is None:
+        with _conv_tuning_lock:
+            name = conv_backend_table.get(key)
+            if name is None:
+                name = _tune_conv_backend(x, w, b, conv_param)
+                conv_backend_table[key] = name
+                if conv_tuning_file is not None:
+                    save_conv_tuning(conv_tuning_file)
+    out, real_cache = CONV_BACKENDS[name][0](x, w, b, conv_param)
+    cache = (name, real_cache)
+    return out, cache
+
+
+def conv_backward_auto(dout, cache):
+    """
+    Backward pass for conv_forward_auto, or for conv_forward_fast with a
+    named backend, using the backend that computed the forward pass.
+    """
+    name, real_cache = cache
+    if name not in CONV_BACKENDS:
+        raise ValueError('Unrecognized method "%s"' % name)
+    return CONV_BACKENDS[name][1](dout, real_cache)
+
+
+def conv_forward_fast(x, w, b, conv_param):
+    """
+    A fast implementation of the forward pass for a convolutional layer.
+
+    If conv_param contains an 'engine' key holding a ConvEngine then the
+    workspace-reusing engine is used. Otherwise conv_param['backend'] picks
+    the implementation: the name of a backend in CONV_BACKENDS, or 'auto' to
+    use the backend that conv_forward_auto measures to be fastest for this
+    layer shape. The default is 'strides'; tuning is opt-in because the first
+    call for every new shape runs each backend four times, about 20 times
+    the cost of one strides step, and picks between backends whose results
+    differ in the last bits.
+    """
+    engine = conv_param.get('engine')
+    if engine is not None:
+        out, engine_cache = engine.forward(x, w, b, conv_param)
+        cache = ('engine', (engine, engine_cache))
+        return out, cache
+    backend = conv_param.get('backend', 'strides')
+    if backend == 'auto':
+        return conv_forward_auto(x, w, b, conv_param)
+    if backend not in CONV_BACKENDS:
+        raise ValueError('Unrecognized backend "%s"' % backend)
+    out, real_cache = CONV_BACKENDS[backend][0](x, w, b, conv_param)
+    cache = (backend, real_cache)
+    return out, cache
+
+
+def conv_backward_fast(dout, cache):
+    """
+    A fast implementation of the backward pass for a convolutional layer.
+
+    This dispatches on the method recorded in the cache by conv_forward_fast.
+    """
+    method, real_cache = cache
+    if method == 'engine':
+        engine, engine_cache = real_cache
+        return engine.backward(dout, engine_cache)
+    return conv_backward_auto(dout, cache)
 
 
 def max_pool_forward_fast(x, pool_param):
     """
     A fast implementation of the forward pass for a max pooling layer.
 
-    This chooses between the reshape method and the im2col method. If the pooling
-    regions are square and tile the input image, then we can use the reshape
-    method which is very fast. Otherwise we fall back on the im2col method, which
-    is not much faster than the naive method.
+    This chooses between the reshape method and the strided method. If the
+    pooling regions are square and tile the input image, then we can use the
+    reshape method which is very fast. Otherwise we fall back on the strided
+    method, which handles arbitrary (including overlapping) windows.
     """
     N, C, H, W = x.shape
     pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
@@ -149,8 +776,8 @@ def max_pool_forward_fast(x, pool_param):
         out, reshape_cache = max_pool_forward_reshape(x, pool_param)
         cache = ('reshape', reshape_cache)
     else:
-        out, im2col_cache = max_pool_forward_im2col(x, pool_param)
-        cache = ('im2col', im2col_cache)
+        out, strided_cache = max_pool_forward_strided(x, pool_param)
+        cache = ('strided', strided_cache)
     return out, cache
 
 
@@ -158,24 +785,156 @@ def max_pool_backward_fast(dout, cache):
     """
     A fast implementation of the backward pass for a max pooling layer.
 
-    This switches between the reshape method an the im2col method depending on
+    This switches between the reshape, strided and im2col methods depending on
     which method was used to generate the cache.
     """
     method, real_cache = cache
     if method == 'reshape':
         return max_pool_backward_reshape(dout, real_cache)
+    elif method == 'strided':
+        return max_pool_backward_strided(dout, real_cache)
     elif method == 'im2col':
         return max_pool_backward_im2col(dout, real_cache)
     else:
         raise ValueError('Unrecognized method "%s"' % method)
 
 
+def max_pool_argmax(x, pool_height, pool_width, stride):
+    """
+    Max pooling over the last two axes of a 4D array with arbitrary (possibly
+    overlapping) windows. The max is taken with a running comparison over the
+    pool_height * pool_width window offsets, each of which is a strided view of
+    x, so no window-sized copy of the input is ever made.
+
+    Returns a tuple of:
+    - out: Pooled array of shape (A, B, H', W')
+    - argmax: uint8 array of the same shape giving the index of the (first)
+      maximum inside each window, in row-major order over the window.
+    """
+    assert pool_height * pool_width <= 256, 'Pooling window too large'
+    H, W = x.shape[2:]
+    out_h = (H - pool_height) // stride + 1
+    out_w = (W - pool_width) // stride + 1
+    h_end, w_end = (out_h - 1) * stride + 1, (out_w - 1) * stride + 1
+
+    out = x[:, :, :h_end:stride, :w_end:stride].copy()
+    argmax = np.zeros(out.shape, dtype=np.uint8)
+    better = np.empty(out.shape, dtype=bool)
+    for i in range(pool_height):
+        for j in range(pool_width):
+            if i == 0 and j == 0:
+                continue
+            window = x[:, :, i:i + h_end:stride, j:j + w_end:stride]
+            np.greater(window, out, out=better)
+            np.copyto(argmax, i * pool_width + j, where=better)
+            np.maximum(out, window, out=out)
+    return out, argmax
+
+
+def max_pool_forward_strided(x, pool_param):
+    """
+    A forward pass for max pooling that handles any window size and stride,
+    including overlapping windows such as 3x3 with stride 2.
+
+    The cache stores, for every output cell, the flat index into x of the
+    element that won the max, so the backward pass is a single scatter-add.
+
+    Inputs / outputs: Same as max_pool_forward_naive, except the cache is
+    (x.shape, flat_argmax).
+    """
+    N, C, H, W = x.shape
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+
+    out, argmax = max_pool_argmax(x, pool_height, pool_width, stride)
+    _, _, out_h, out_w = out.shape
+
+    # Flat index of each window's top-left corner plus the offset of its max
+    corner = (np.arange(N * C, dtype=np.intp).reshape(N, C, 1, 1) * (H * W) +
+              (np.arange(out_h, dtype=np.intp) * (stride * W)).reshape(-1, 1) +
+              np.arange(out_w, dtype=np.intp) * stride)
+    argmax = argmax.astype(np.intp)
+    flat_argmax = corner + (argmax // pool_width) * W + argmax % pool_width
+
+    cache = (x.shape, flat_argmax)
+    return out, cache
+
+
+def max_pool_backward_strided(dout, cache):
+    """
+    Backward pass for max_pool_forward_strided: every upstream gradient is
+    added to the input element that produced its max, in one np.bincount call
+    (which, unlike np.add.at, is a single fast C loop).
+    """
+    x_shape, flat_argmax = cache
+    size = int(np.prod(x_shape))
+    dx = np.bincount(flat_argmax.ravel(), weights=dout.ravel(), minlength=size)
+    return dx.reshape(x_shape).astype(dout.dtype, copy=False)
+
+
+def avg_pool_forward_strided(x, pool_param):
+    """
+    A forward pass for average pooling with any window size and stride.
+
+    Inputs:
+    - x: Input data, of shape (N, C, H, W)
+    - pool_param: dictionary with the keys 'pool_height', 'pool_width' and
+      'stride', as for max pooling.
+
+    Returns a tuple of:
+    - out: Output data
+    - cache: (x.shape, pool_param)
+    """
+    N, C, H, W = x.shape
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    out_h = (H - pool_height) // stride + 1
+    out_w = (W - pool_width) // stride + 1
+    h_end, w_end = (out_h - 1) * stride + 1, (out_w - 1) * stride + 1
+
+    out = np.zeros((N, C, out_h, out_w), dtype=x.dtype)
+    for i in range(pool_height):
+        for j in range(pool_width):
+            out += x[:, :, i:i + h_end:stride, j:j + w_end:stride]
+    out /= pool_height * pool_width
+
+    cache = (x.shape, pool_param)
+    return out, cache
+
+
+def avg_pool_backward_strided(dout, cache):
+    """
+    Backward pass for avg_pool_forward_strided.
+    """
+    x_shape, pool_param = cache
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    _, _, out_h, out_w = dout.shape
+    h_end, w_end = (out_h - 1) * stride + 1, (out_w - 1) * stride + 1
+
+    dx = np.zeros(x_shape, dtype=dout.dtype)
+    dout_scaled = dout / (pool_height * pool_width)
+    for i in range(pool_height):
+        for j in range(pool_width):
+            dx[:, :, i:i + h_end:stride, j:j + w_end:stride] += dout_scaled
+    return dx
+
+
 def max_pool_forward_reshape(x, pool_param):
     """
     A fast implementation of the forward pass for the max pooling layer that uses
     some clever reshaping.
 
     This can only be used for square pooling regions that tile the input.
+
+    By default the cache keeps x and the output so that the backward pass can
+    rebuild the argmax mask. If pool_param['compact_cache'] is True the cache
+    instead stores, for every output cell, a bitmask of all tied argmax
+    positions in the window (uint8 for windows of up to 8 elements, wider
+    otherwise), so the backward pass splits the gradient between ties exactly
+    as it does with the full cache. Setting pool_param['split_ties'] to False
+    as well opts out of that: the cache then stores only the uint8 index of
+    the first argmax of each window, which gets the whole gradient.
     """
     N, C, H, W = x.shape
     pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
@@ -183,6 +942,15 @@ def max_pool_forward_reshape(x, pool_param):
     assert pool_height == pool_width == stride, 'Invalid pool params'
     assert H % pool_height == 0
     assert W % pool_height == 0
+
+    if pool_param.get('compact_cache', False):
+        split_ties = pool_param.get('split_ties', True)
+        out, index = max_pool_argmax(x, pool_height, pool_width, stride)
+        if split_ties:
+            index = _max_pool_tie_bits(x, out, pool_height, pool_width)
+        cache = (x.shape, pool_height, pool_width, index, split_ties)
+        return out, cache
+
     x_reshaped = x.reshape(N, C, H // pool_height, pool_height,
                            W // pool_width, pool_width)
     out = x_reshaped.max(axis=3).max(axis=4)
@@ -191,6 +959,27 @@ def max_pool_forward_reshape(x, pool_param):
     return out, cache
 
 
+def _max_pool_tie_bits(x, out, pool_height, pool_width):
+    """
+    For tiling pooling windows, return an unsigned integer array with the
+    shape of out in which bit k is set if element k of the window (in
+    row-major order) equals the window max.
+    """
+    size = pool_height * pool_width
+    assert size <= 64, 'Pooling window too large'
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if size <= 8 * np.dtype(dtype).itemsize:
+            break
+    bits = np.zeros(out.shape, dtype=dtype)
+    tied = np.empty(out.shape, dtype=bool)
+    for i in range(pool_height):
+        for j in range(pool_width):
+            np.equal(x[:, :, i::pool_height, j::pool_width], out, out=tied)
+            np.bitwise_or(bits, dtype(1 << (i * pool_width + j)), out=bits,
+                          where=tied)
+    return bits
+
+
 def max_pool_backward_reshape(dout, cache):
     """
     A fast implementation of the backward pass for the max pooling layer that
@@ -208,6 +997,9 @@ def max_pool_backward_reshape(dout, cache):
     however this results in a significant performance penalty (about 40% slower)
     and is unlikely to matter in practice so we don't do it.
     """
+    if isinstance(cache[0], tuple):
+        return _max_pool_backward_compact(dout, cache)
+
     x, x_reshaped, out = cache
 
     dx_reshaped = np.zeros_like(x_reshaped)
@@ -222,6 +1014,33 @@ def max_pool_backward_reshape(dout, cache):
     return dx
 
 
+def _max_pool_backward_compact(dout, cache):
+    """
+    Backward pass of max_pool_backward_reshape for the compact cache: the
+    upstream gradient is written straight into each window's argmax, or
+    split evenly between its tied maxima when the cache holds tie bitmasks.
+    """
+    x_shape, pool_height, pool_width, index, split_ties = cache
+
+    dx = np.zeros(x_shape, dtype=dout.dtype)
+    selected = np.empty(index.shape, dtype=bool)
+    if split_ties:
+        num_ties = np.zeros(index.shape, dtype=np.uint8)
+        for k in range(pool_height * pool_width):
+            num_ties += (index >> index.dtype.type(k)) & 1
+        dout = dout / num_ties
+    for i in range(pool_height):
+        for j in range(pool_width):
+            k = i * pool_width + j
+            if split_ties:
+                np.not_equal((index >> index.dtype.type(k)) & 1, 0, out=selected)
+            else:
+                np.equal(index, k, out=selected)
+            np.copyto(dx[:, :, i::pool_height, j::pool_width], dout,
+                      where=selected)
+    return dx
+
+
 def max_pool_forward_im2col(x, pool_param):
     """
     An implementation of the forward pass for max pooling based on im2col.
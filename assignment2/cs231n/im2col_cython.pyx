@@ -1,6 +1,7 @@
 import numpy as np
 cimport numpy as np
 cimport cython
+from cython.parallel import prange
 
 # DTYPE = np.float64
 # ctypedef np.float64_t DTYPE_t
@@ -119,3 +120,142 @@ def col2im_6d_cython(np.ndarray[DTYPE_t, ndim=6] cols, int N, int C, int H, int
     if pad > 0:
         return x_padded[:, :, pad:-pad, pad:-pad]
     return x_padded 
+
+
+# Multi-threaded variants of the functions above. The inner loops run without
+# the GIL and are split across OpenMP threads over a dimension whose output
+# locations are disjoint (channels for im2col / col2im, batch and channel for
+# col2im_6d), so no two threads ever write the same element. If the extension
+# is compiled without OpenMP these run serially.
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int im2col_cython_inner_parallel(DTYPE_t[:, ::1] cols,
+                                      DTYPE_t[:, :, :, ::1] x_padded,
+                                      int N, int C, int H, int W, int HH, int WW,
+                                      int field_height, int field_width, int padding,
+                                      int stride, int num_threads) nogil:
+    cdef int c, ii, jj, row, yy, xx, i, col
+
+    for c in prange(C, num_threads=num_threads, schedule='static'):
+        for yy in range(HH):
+            for xx in range(WW):
+                for ii in range(field_height):
+                    for jj in range(field_width):
+                        row = c * field_width * field_height + ii * field_height + jj
+                        for i in range(N):
+                            col = yy * WW * N + xx * N + i
+                            cols[row, col] = x_padded[i, c, stride * yy + ii, stride * xx + jj]
+    return 0
+
+
+def im2col_cython_parallel(np.ndarray[DTYPE_t, ndim=4] x, int field_height,
+                           int field_width, int padding, int stride,
+                           int num_threads=1):
+    cdef int N = x.shape[0]
+    cdef int C = x.shape[1]
+    cdef int H = x.shape[2]
+    cdef int W = x.shape[3]
+
+    cdef int HH = (H + 2 * padding - field_height) / stride + 1
+    cdef int WW = (W + 2 * padding - field_width) / stride + 1
+
+    cdef int p = padding
+    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.ascontiguousarray(np.pad(x,
+            ((0, 0), (0, 0), (p, p), (p, p)), mode='constant'))
+
+    cdef np.ndarray[DTYPE_t, ndim=2] cols = np.zeros(
+            (C * field_height * field_width, N * HH * WW),
+            dtype=x.dtype)
+
+    if num_threads < 1:
+        num_threads = 1
+    cdef DTYPE_t[:, ::1] cols_view = cols
+    cdef DTYPE_t[:, :, :, ::1] x_padded_view = x_padded
+    with nogil:
+        im2col_cython_inner_parallel(cols_view, x_padded_view, N, C, H, W, HH, WW,
+                                     field_height, field_width, padding, stride,
+                                     num_threads)
+    return cols
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int col2im_cython_inner_parallel(DTYPE_t[:, :] cols,
+                                      DTYPE_t[:, :, :, ::1] x_padded,
+                                      int N, int C, int H, int W, int HH, int WW,
+                                      int field_height, int field_width, int padding,
+                                      int stride, int num_threads) nogil:
+    cdef int c, ii, jj, row, yy, xx, i, col
+
+    for c in prange(C, num_threads=num_threads, schedule='static'):
+        for ii in range(field_height):
+            for jj in range(field_width):
+                row = c * field_width * field_height + ii * field_height + jj
+                for yy in range(HH):
+                    for xx in range(WW):
+                        for i in range(N):
+                            col = yy * WW * N + xx * N + i
+                            x_padded[i, c, stride * yy + ii, stride * xx + jj] += cols[row, col]
+    return 0
+
+
+def col2im_cython_parallel(np.ndarray[DTYPE_t, ndim=2] cols, int N, int C, int H, int W,
+                           int field_height, int field_width, int padding, int stride,
+                           int num_threads=1):
+    cdef int HH = (H + 2 * padding - field_height) / stride + 1
+    cdef int WW = (W + 2 * padding - field_width) / stride + 1
+    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.zeros((N, C, H + 2 * padding, W + 2 * padding),
+                                        dtype=cols.dtype)
+
+    if num_threads < 1:
+        num_threads = 1
+    cdef DTYPE_t[:, :] cols_view = cols
+    cdef DTYPE_t[:, :, :, ::1] x_padded_view = x_padded
+    with nogil:
+        col2im_cython_inner_parallel(cols_view, x_padded_view, N, C, H, W, HH, WW,
+                                     field_height, field_width, padding, stride,
+                                     num_threads)
+    if padding > 0:
+        return x_padded[:, :, padding:-padding, padding:-padding]
+    return x_padded
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int col2im_6d_cython_inner_parallel(DTYPE_t[:, :, :, :, :, :] cols,
+                                         DTYPE_t[:, :, :, ::1] x_padded,
+                                         int N, int C, int H, int W, int HH, int WW,
+                                         int out_h, int out_w, int pad, int stride,
+                                         int num_threads) nogil:
+    cdef int nc, c, hh, ww, n, h, w
+
+    for nc in prange(N * C, num_threads=num_threads, schedule='static'):
+        n = nc / C
+        c = nc % C
+        for hh in range(HH):
+            for ww in range(WW):
+                for h in range(out_h):
+                    for w in range(out_w):
+                        x_padded[n, c, stride * h + hh, stride * w + ww] += cols[c, hh, ww, n, h, w]
+    return 0
+
+
+def col2im_6d_cython_parallel(np.ndarray[DTYPE_t, ndim=6] cols, int N, int C, int H, int W,
+        int HH, int WW, int pad, int stride, int num_threads=1):
+    cdef int out_h = (H + 2 * pad - HH) / stride + 1
+    cdef int out_w = (W + 2 * pad - WW) / stride + 1
+    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad),
+                                                  dtype=cols.dtype)
+
+    if num_threads < 1:
+        num_threads = 1
+    cdef DTYPE_t[:, :, :, :, :, :] cols_view = cols
+    cdef DTYPE_t[:, :, :, ::1] x_padded_view = x_padded
+    with nogil:
+        col2im_6d_cython_inner_parallel(cols_view, x_padded_view, N, C, H, W, HH, WW,
+                                        out_h, out_w, pad, stride, num_threads)
+
+    if pad > 0:
+        return x_padded[:, :, pad:-pad, pad:-pad]
+    return x_padded
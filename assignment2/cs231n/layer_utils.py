@@ -3,30 +3,33 @@ from cs231n.layers import *
 from cs231n.fast_layers import *
 
 
-def affine_relu_forward(x, w, b):
+def affine_relu_forward(x, w, b, inplace=False):
     """
     Convenience layer that perorms an affine transform followed by a ReLU
 
     Inputs:
     - x: Input to the affine layer
     - w, b: Weights for the affine layer
+    - inplace: If True, the ReLU runs in place on the affine output and x is
+      marked read-only while it is cached
 
     Returns a tuple of:
     - out: Output from the ReLU
     - cache: Object to give to the backward pass
     """
-    a, fc_cache = affine_forward(x, w, b)
-    out, relu_cache = relu_forward(a)
+    a, fc_cache = affine_forward(x, w, b, inplace=inplace)
+    out, relu_cache = relu_forward(a, inplace=inplace)
     cache = (fc_cache, relu_cache)
     return out, cache
 
 
-def affine_relu_backward(dout, cache):
+def affine_relu_backward(dout, cache, inplace=False):
     """
-    Backward pass for the affine-relu convenience layer
+    Backward pass for the affine-relu convenience layer. If inplace is True,
+    dout is overwritten.
     """
     fc_cache, relu_cache = cache
-    da = relu_backward(dout, relu_cache)
+    da = relu_backward(dout, relu_cache, inplace=inplace)
     dx, dw, db = affine_backward(da, fc_cache)
     return dx, dw, db
 
@@ -37,7 +40,9 @@ def conv_relu_forward(x, w, b, conv_param):
 
     Inputs:
     - x: Input to the convolutional layer
-    - w, b, conv_param: Weights and parameters for the convolutional layer
+    - w, b, conv_param: Weights and parameters for the convolutional layer.
+      If conv_param['engine'] holds a ConvEngine, the convolution reuses that
+      engine's preallocated buffers.
 
     Returns a tuple of:
     - out: Output from the ReLU
@@ -81,7 +86,9 @@ def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
 
     Inputs:
     - x: Input to the convolutional layer
-    - w, b, conv_param: Weights and parameters for the convolutional layer
+    - w, b, conv_param: Weights and parameters for the convolutional layer.
+      If conv_param['engine'] holds a ConvEngine, the convolution reuses that
+      engine's preallocated buffers.
     - pool_param: Parameters for the pooling layer
 
     Returns a tuple of:
@@ -104,3 +111,146 @@ def conv_relu_pool_backward(dout, cache):
     da = relu_backward(ds, relu_cache)
     dx, dw, db = conv_backward_fast(da, conv_cache)
     return dx, dw, db
+
+
+def conv_relu_forward_fused(x, w, b, conv_param):
+    """
+    A fused conv-relu layer. This computes the same function as
+    conv_relu_forward, but adds the bias and applies the ReLU in place on the
+    GEMM output, and caches only the input and a bit-packed ReLU mask; the
+    im2col columns are rebuilt from x in the backward pass.
+
+    Inputs / outputs: Same as conv_relu_forward.
+    """
+    F, _, HH, WW = w.shape
+    N = x.shape[0]
+    stride, pad = conv_param['stride'], conv_param['pad']
+
+    x_cols, out_h, out_w = im2col_strides(x, HH, WW, stride, pad)
+    res = w.reshape(F, -1).dot(x_cols)
+    del x_cols
+    res += b.reshape(-1, 1)
+    np.maximum(res, 0, out=res)
+    relu_mask = np.packbits(res > 0)
+
+    out = np.ascontiguousarray(res.reshape(F, N, out_h, out_w).transpose(1, 0, 2, 3))
+    cache = (x, w, conv_param, relu_mask)
+    return out, cache
+
+
+def conv_relu_backward_fused(dout, cache):
+    """
+    Backward pass for conv_relu_forward_fused.
+    """
+    x, w, conv_param, relu_mask = cache
+    N, F, out_h, out_w = dout.shape
+
+    # Gradient in the (F, N, out_h, out_w) layout of the GEMM output
+    da = np.ascontiguousarray(dout.transpose(1, 0, 2, 3))
+    da *= np.unpackbits(relu_mask)[:da.size].reshape(da.shape)
+
+    dx, dw, db = conv_backward_gemm(da, x, w, conv_param)
+    return dx, dw, db
+
+
+def conv_relu_pool_forward_fused(x, w, b, conv_param, pool_param):
+    """
+    A fused conv-relu-pool layer. This computes the same function as
+    conv_relu_pool_forward, but never materialises the ReLU activations:
+    since max pooling commutes with adding a per-filter bias and with the
+    ReLU, the pooling runs directly on the GEMM output and the bias and ReLU
+    are applied in place on the (much smaller) pooled output.
+
+    The cache holds the input, the window-local argmax of every pooling
+    window as uint8 and a bit-packed ReLU mask of the pooled output; the
+    im2col columns are rebuilt from x in the backward pass. Pooling windows
+    may overlap.
+
+    Inputs / outputs: Same as conv_relu_pool_forward.
+    """
+    F, _, HH, WW = w.shape
+    N = x.shape[0]
+    stride, pad = conv_param['stride'], conv_param['pad']
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    pool_stride = pool_param['stride']
+
+    x_cols, out_h, out_w = im2col_strides(x, HH, WW, stride, pad)
+    res = w.reshape(F, -1).dot(x_cols)
+    del x_cols
+    res.shape = (F, N, out_h, out_w)
+
+    pooled, argmax = max_pool_argmax(res, pool_height, pool_width, pool_stride)
+    del res
+
+    pooled += b.reshape(-1, 1, 1, 1)
+    np.maximum(pooled, 0, out=pooled)
+    relu_mask = np.packbits(pooled > 0)
+
+    out = np.ascontiguousarray(pooled.transpose(1, 0, 2, 3))
+    cache = (x, w, conv_param, pool_param, (out_h, out_w), argmax, relu_mask)
+    return out, cache
+
+
+def conv_relu_pool_backward_fused(dout, cache):
+    """
+    Backward pass for conv_relu_pool_forward_fused.
+    """
+    x, w, conv_param, pool_param, conv_size, argmax, relu_mask = cache
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    pool_stride = pool_param['stride']
+    N, F, pool_h, pool_w = dout.shape
+    out_h, out_w = conv_size
+    h_end, w_end = (pool_h - 1) * pool_stride + 1, (pool_w - 1) * pool_stride + 1
+
+    dpooled = np.ascontiguousarray(dout.transpose(1, 0, 2, 3))
+    dpooled *= np.unpackbits(relu_mask)[:dpooled.size].reshape(dpooled.shape)
+
+    # Route each pooled gradient to its argmax, one window offset at a time
+    da = np.zeros((F, N, out_h, out_w), dtype=dpooled.dtype)
+    selected = np.empty(argmax.shape, dtype=bool)
+    for i in range(pool_height):
+        for j in range(pool_width):
+            window = da[:, :, i:i + h_end:pool_stride, j:j + w_end:pool_stride]
+            np.equal(argmax, i * pool_width + j, out=selected)
+            np.add(window, dpooled, out=window, where=selected)
+
+    dx, dw, db = conv_backward_gemm(da, x, w, conv_param)
+    return dx, dw, db
+
+
+def cast_cache(cache, dtype, skip=()):
+    """
+    Casts the activations held in a layer cache to a narrower floating point
+    dtype for storage, e.g. float16 while the math runs in float32. The
+    backward passes accept the narrow arrays and promote them as needed.
+
+    Inputs:
+    - cache: A cache returned by any forward pass; tuples and lists are walked
+      recursively, anything else that is not an ndarray is left alone
+    - dtype: Storage dtype for activations, or None to return cache unchanged
+    - skip: Arrays that must not be cast, matched by identity; models pass
+      their parameters here so the backward pass sees the master weights
+
+    Only floating point arrays with at least two dimensions and a wider dtype
+    than the target are cast. Masks, indices and per-feature statistics such
+    as batchnorm's inverse standard deviation are kept as they are.
+
+    Returns:
+    - cache: A cache of the same structure
+    """
+    if dtype is None:
+        return cache
+    dtype = np.dtype(dtype)
+    skip_ids = set(id(a) for a in skip)
+
+    def cast(obj):
+        if isinstance(obj, (tuple, list)):
+            return type(obj)(cast(o) for o in obj)
+        if (isinstance(obj, np.ndarray) and obj.ndim >= 2 and
+                id(obj) not in skip_ids and
+                np.issubdtype(obj.dtype, np.floating) and
+                obj.dtype.itemsize > dtype.itemsize):
+            return obj.astype(dtype)
+        return obj
+
+    return cast(cache)
@@ -2,7 +2,18 @@ from builtins import range
 import numpy as np
 
 
-def affine_forward(x, w, b):
+def _inplace_buffer(x):
+    """
+    Returns x for use as an output buffer, after checking that it is not
+    frozen in the cache of an earlier layer.
+    """
+    if not x.flags.writeable:
+        raise ValueError('Cannot operate in place on a read-only array; it is '
+                         'probably cached by an earlier layer')
+    return x
+
+
+def affine_forward(x, w, b, inplace=False):
     """
     Computes the forward pass for an affine (fully-connected) layer.
 
@@ -15,21 +26,30 @@ def affine_forward(x, w, b):
     - x: A numpy array containing input data, of shape (N, d_1, ..., d_k)
     - w: A numpy array of weights, of shape (D, M)
     - b: A numpy array of biases, of shape (M,)
+    - inplace: If True, x is marked read-only while the cache holds on to
+      it, so that a later in-place layer cannot overwrite it by accident.
+      affine_backward makes it writeable again, so only pass this for arrays
+      the caller owns, such as the activations of its own earlier layers: if
+      the backward pass never runs, x stays read-only.
 
     Returns a tuple of:
     - out: output, of shape (N, M)
-    - cache: (x, w, b)
+    - cache: (x, w, b, frozen), where frozen says whether x was made read-only
     """
     out = None
     ###########################################################################
     # TODO: Implement the affine forward pass. Store the result in out. You   #
     # will need to reshape the input into rows.                               #
     ###########################################################################
-    out = np.reshape(x, (x.shape[0], -1)).dot(w) + b
+    out = np.reshape(x, (x.shape[0], -1)).dot(w)
+    out += b
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
-    cache = (x, w, b)
+    frozen = inplace and x.flags.writeable
+    if frozen:
+        x.flags.writeable = False
+    cache = (x, w, b, frozen)
     return out, cache
 
 
@@ -42,17 +62,24 @@ def affine_backward(dout, cache):
     - cache: Tuple of:
       - x: Input data, of shape (N, d_1, ... d_k)
       - w: Weights, of shape (D, M)
+      - b: Biases, of shape (M,)
+      - frozen: Whether affine_forward made x read-only
 
     Returns a tuple of:
     - dx: Gradient with respect to x, of shape (N, d1, ..., d_k)
     - dw: Gradient with respect to w, of shape (D, M)
     - db: Gradient with respect to b, of shape (M,)
     """
-    x, w, b = cache
+    x, w, b, frozen = cache
+    if frozen:
+        x.flags.writeable = True
     dx, dw, db = None, None, None
     ###########################################################################
     # TODO: Implement the affine backward pass.                               #
     ###########################################################################
+    # x may be stored in a narrower dtype (see layer_utils.cast_cache); mixed
+    # precision matrix products do not go through BLAS, so upcast it first
+    x = x.astype(w.dtype, copy=False)
     dx = dout.dot(w.T).reshape(x.shape)
     dw = x.reshape((x.shape[0],-1)).T.dot(dout)
     db = np.sum(dout, axis=0)
@@ -62,36 +89,42 @@ def affine_backward(dout, cache):
     return dx, dw, db
 
 
-def relu_forward(x):
+def relu_forward(x, inplace=False):
     """
     Computes the forward pass for a layer of rectified linear units (ReLUs).
 
     Input:
     - x: Inputs, of any shape
+    - inplace: If True, the output is written into x
 
     Returns a tuple of:
     - out: Output, of the same shape as x
-    - cache: x
+    - cache: x, or the boolean mask x > 0 if inplace since x is overwritten
     """
     out = None
     ###########################################################################
     # TODO: Implement the ReLU forward pass.                                  #
     ###########################################################################
-    out = np.maximum(x, np.zeros_like(x))
+    if inplace:
+        cache = x > 0
+        out = np.maximum(x, 0, out=_inplace_buffer(x))
+    else:
+        cache = x
+        out = np.maximum(x, 0)
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
-    cache = x
     return out, cache
 
 
-def relu_backward(dout, cache):
+def relu_backward(dout, cache, inplace=False):
     """
     Computes the backward pass for a layer of rectified linear units (ReLUs).
 
     Input:
     - dout: Upstream derivatives, of any shape
-    - cache: Input x, of same shape as dout
+    - cache: Input x, or its mask x > 0, of same shape as dout
+    - inplace: If True, dx is written into dout
 
     Returns:
     - dx: Gradient with respect to x
@@ -105,8 +138,8 @@ def relu_backward(dout, cache):
     #dReLU[x > 0] = 1
     #dx = dout * dReLU
     
-    dx = dout.copy()
-    dx[x <= 0] = 0
+    mask = x if x.dtype == np.bool_ else x > 0
+    dx = np.multiply(dout, mask, out=_inplace_buffer(dout) if inplace else None)
     
     ###########################################################################
     #                             END OF YOUR CODE                            #
@@ -383,7 +416,12 @@ def batchnorm_backward_alt(dout, cache):
     # should be able to compute gradients with respect to the inputs in a     #
     # single statement; our implementation fits on a single 80-character line.#
     ###########################################################################
-    pass
+    xhat, gamma, xmu, ivar, sqrtvar, var, eps = cache
+    N = dout.shape[0]
+
+    dbeta = np.sum(dout, axis=0)
+    dgamma = np.sum(dout * xhat, axis=0)
+    dx = (gamma * ivar / N) * (N * dout - dbeta - xhat * dgamma)
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -391,6 +429,171 @@ def batchnorm_backward_alt(dout, cache):
     return dx, dgamma, dbeta
 
 
+def _reduce_sum_of_products(a, b, axes):
+    """
+    Sum of a * b over the given axes without materialising the product.
+    """
+    subs = ''.join(chr(ord('a') + i) for i in range(a.ndim))
+    kept = ''.join(s for i, s in enumerate(subs) if i not in axes)
+    return np.einsum('%s,%s->%s' % (subs, subs, kept), a, b)
+
+
+def _batchnorm_train_forward(x, gamma, beta, axes, eps, inplace):
+    """
+    Training-time batch normalization of x over the given axes. gamma and
+    beta must already broadcast against x. If inplace is True, x is
+    overwritten with the normalized data.
+
+    Returns a tuple of:
+    - out: Normalized, scaled and shifted data
+    - xhat: Normalized data (x itself if inplace)
+    - inv_std: Inverse standard deviation, of the reduced shape
+    - mean, var: Batch statistics, of the reduced shape
+    """
+    m = int(np.prod([x.shape[a] for a in axes]))
+    mean = np.mean(x, axis=axes)
+    mean_b = mean.reshape(gamma.shape)
+
+    # Center into the xhat buffer and take the variance from it directly, so
+    # there is no squared temporary
+    xhat = np.subtract(x, mean_b, out=_inplace_buffer(x) if inplace else None)
+    var = _reduce_sum_of_products(xhat, xhat, axes) / m
+    inv_std = 1.0 / np.sqrt(var + eps)
+    xhat *= inv_std.reshape(mean_b.shape)
+
+    out = np.multiply(xhat, gamma)
+    out += beta
+    return out, xhat, inv_std, mean, var
+
+
+def _batchnorm_train_backward(dout, xhat, inv_std, gamma, axes, inplace):
+    """
+    Closed-form backward pass for _batchnorm_train_forward. If inplace is
+    True, dout and xhat are used as scratch space and dx is written into dout.
+    """
+    # xhat may be stored in a narrower dtype (see layer_utils.cast_cache)
+    xhat = xhat.astype(dout.dtype, copy=False)
+    m = int(np.prod([dout.shape[a] for a in axes]))
+    dbeta = np.sum(dout, axis=axes)
+    dgamma = _reduce_sum_of_products(dout, xhat, axes)
+
+    # dx = gamma * inv_std / m * (m * dout - dbeta - xhat * dgamma)
+    shape = gamma.shape
+    scale = gamma * inv_std.reshape(shape)
+    if inplace:
+        xhat *= (dgamma / m).reshape(shape)
+        dx = _inplace_buffer(dout)
+        dx -= xhat
+    else:
+        dx = np.multiply(xhat, (-dgamma / m).reshape(shape))
+        dx += dout
+    dx -= (dbeta / m).reshape(shape)
+    dx *= scale
+    return dx, dgamma, dbeta
+
+
+def batchnorm_forward_fused(x, gamma, beta, bn_param):
+    """
+    Forward pass for batch normalization that computes the same function as
+    batchnorm_forward, but without building the staged computational graph:
+    the centered data is written once into the xhat buffer, the variance is
+    reduced from it without a squared temporary, and the cache holds only
+    xhat, the inverse standard deviation and gamma.
+
+    Inputs / outputs: Same as batchnorm_forward, except the cache must be
+    passed to batchnorm_backward_fused. bn_param may additionally contain:
+      - inplace: If True, x is overwritten with the normalized data. Only
+        use this when no other layer needs x for its backward pass.
+    """
+    mode = bn_param['mode']
+    eps = bn_param.get('eps', 1e-5)
+    momentum = bn_param.get('momentum', 0.9)
+    inplace = bn_param.get('inplace', False)
+
+    N, D = x.shape
+    running_mean = bn_param.get('running_mean', np.zeros(D, dtype=x.dtype))
+    running_var = bn_param.get('running_var', np.zeros(D, dtype=x.dtype))
+
+    cache = None
+    if mode == 'train':
+        out, xhat, inv_std, mean, var = _batchnorm_train_forward(
+            x, gamma, beta, (0,), eps, inplace)
+        cache = (xhat, inv_std, gamma, inplace)
+
+        running_mean = running_mean * momentum + mean * (1 - momentum)
+        running_var = running_var * momentum + var * (1 - momentum)
+    elif mode == 'test':
+        scale = gamma / np.sqrt(running_var + eps)
+        out = x * scale
+        out += beta - running_mean * scale
+    else:
+        raise ValueError('Invalid forward batchnorm mode "%s"' % mode)
+
+    # Store the updated running means back into bn_param
+    bn_param['running_mean'] = running_mean
+    bn_param['running_var'] = running_var
+
+    return out, cache
+
+
+def batchnorm_backward_fused(dout, cache):
+    """
+    Closed-form backward pass for batchnorm_forward_fused:
+
+    dx = gamma * inv_std / N * (N * dout - sum(dout) - xhat * sum(dout * xhat))
+
+    If the forward pass was run with bn_param['inplace'] = True, dx is
+    written into dout.
+
+    Inputs / outputs: Same as batchnorm_backward.
+    """
+    xhat, inv_std, gamma, inplace = cache
+    return _batchnorm_train_backward(dout, xhat, inv_std, gamma, (0,), inplace)
+
+
+def _make_rng(seed=None):
+    """
+    Returns a np.random.Generator, or a RandomState on NumPy versions that
+    predate Generator.
+    """
+    if hasattr(np.random, 'default_rng'):
+        return np.random.default_rng(seed)
+    return np.random.RandomState(seed)
+
+
+def get_rng_state(rng):
+    """
+    Returns the state of a generator made by _make_rng, such as the 'rng' of
+    a dropout_param, as a dictionary of scalars and arrays for a checkpoint.
+    """
+    if isinstance(rng, np.random.RandomState):
+        return {'random_state': list(rng.get_state())}
+    return {'bit_generator': rng.bit_generator.state}
+
+
+def rng_from_state(state):
+    """
+    Returns a new generator in a state returned by get_rng_state.
+    """
+    if 'random_state' in state:
+        rng = np.random.RandomState()
+        rng.set_state(tuple(state['random_state']))
+        return rng
+    bit_generator = getattr(np.random, state['bit_generator']['bit_generator'])()
+    bit_generator.state = state['bit_generator']
+    return np.random.Generator(bit_generator)
+
+
+def _random_uniform(rng, shape):
+    """
+    Uniform samples in [0, 1) of the given shape, in float32 where the
+    generator supports it.
+    """
+    if isinstance(rng, np.random.RandomState):
+        return rng.random_sample(shape)
+    return rng.random(shape, dtype=np.float32)
+
+
 def dropout_forward(x, dropout_param):
     """
     Performs the forward pass for (inverted) dropout.
@@ -404,15 +607,28 @@ def dropout_forward(x, dropout_param):
       - seed: Seed for the random number generator. Passing seed makes this
         function deterministic, which is needed for gradient checking but not
         in real networks.
+      - rng: Random generator to draw masks from when no seed is given. If
+        missing, one is created and stored here on the first call.
+      - inplace: If True, x is overwritten with the output and the backward
+        pass writes dx into dout. Only use this when no other layer needs x
+        or dout afterwards.
 
     Outputs:
     - out: Array of the same shape as x.
     - cache: tuple (dropout_param, mask). In training mode, mask is the dropout
-      mask that was used to multiply the input; in test mode, mask is None.
+      mask that was used to multiply the input, packed to one bit per element
+      with np.packbits; in test mode, mask is None.
     """
     p, mode = dropout_param['p'], dropout_param['mode']
+    inplace = dropout_param.get('inplace', False)
     if 'seed' in dropout_param:
-        np.random.seed(dropout_param['seed'])
+        # A fresh generator per call gives the same mask every time without
+        # touching the global NumPy random state
+        rng = _make_rng(dropout_param['seed'])
+    else:
+        rng = dropout_param.get('rng')
+        if rng is None:
+            rng = dropout_param['rng'] = _make_rng()
 
     mask = None
     out = None
@@ -422,8 +638,10 @@ def dropout_forward(x, dropout_param):
         # TODO: Implement training phase forward pass for inverted dropout.   #
         # Store the dropout mask in the mask variable.                        #
         #######################################################################
-        mask = (np.random.randn(*x.shape) < p) / p
-        out = x * mask
+        keep = _random_uniform(rng, x.shape) >= p
+        out = np.multiply(x, keep, out=_inplace_buffer(x) if inplace else None)
+        out *= 1.0 / (1 - p)
+        mask = np.packbits(keep, axis=None)
         #######################################################################
         #                           END OF YOUR CODE                          #
         #######################################################################
@@ -458,7 +676,11 @@ def dropout_backward(dout, cache):
         #######################################################################
         # TODO: Implement training phase backward pass for inverted dropout   #
         #######################################################################
-        dx = dout * mask
+        p = dropout_param['p']
+        inplace = dropout_param.get('inplace', False)
+        keep = np.unpackbits(mask)[:dout.size].reshape(dout.shape)
+        dx = np.multiply(dout, keep, out=_inplace_buffer(dout) if inplace else None)
+        dx *= 1.0 / (1 - p)
         #######################################################################
         #                          END OF YOUR CODE                           #
         #######################################################################
@@ -587,6 +809,87 @@ def conv_backward_naive(dout, cache):
     return dx, dw, db
 
 
+def _conv_windows(x_padded, HH, WW, stride, out_h, out_w):
+    """
+    Return a read-only view of shape (N, C, out_h, out_w, HH, WW) into the
+    padded input, where [:, :, i, j] is the receptive field of output (i, j).
+    """
+    N, C = x_padded.shape[:2]
+    sN, sC, sH, sW = x_padded.strides
+    shape = (N, C, out_h, out_w, HH, WW)
+    strides = (sN, sC, stride * sH, stride * sW, sH, sW)
+    windows = np.lib.stride_tricks.as_strided(x_padded, shape=shape,
+                                              strides=strides)
+    windows.flags.writeable = False
+    return windows
+
+
+def conv_forward_vectorized(x, w, b, conv_param):
+    """
+    A vectorized reference implementation of the forward pass for a
+    convolutional layer. This computes exactly what conv_forward_naive does,
+    but builds a strided view of all receptive fields and contracts it with
+    the filters in a single tensordot instead of looping over N, H', W' and F
+    in Python. It needs only NumPy, not the Cython extension.
+
+    Inputs / outputs: Same as conv_forward_naive, including the cache layout
+    (x, w, b, conv_param), so conv_backward_naive accepts its cache too.
+    """
+    N, C, H, W = x.shape
+    F, C, HH, WW = w.shape
+    stride = conv_param.get('stride', 1)
+    pad = conv_param.get('pad', 0)
+
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+
+    x_padded = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode='constant')
+    windows = _conv_windows(x_padded, HH, WW, stride, out_h, out_w)
+
+    # (N, C, H', W', HH, WW) x (F, C, HH, WW) -> (N, H', W', F)
+    out = np.tensordot(windows, w, axes=([1, 4, 5], [1, 2, 3]))
+    out = out.transpose(0, 3, 1, 2) + b.reshape(1, -1, 1, 1)
+
+    cache = (x, w, b, conv_param)
+    return out, cache
+
+
+def conv_backward_vectorized(dout, cache):
+    """
+    A vectorized reference implementation of the backward pass for a
+    convolutional layer; see conv_forward_vectorized. The only Python loop is
+    over the HH * WW filter taps.
+
+    Inputs / outputs: Same as conv_backward_naive.
+    """
+    x, w, b, conv_param = cache
+    N, C, H, W = x.shape
+    F, C, HH, WW = w.shape
+    _, _, out_h, out_w = dout.shape
+    stride = conv_param.get('stride', 1)
+    pad = conv_param.get('pad', 0)
+
+    x_padded = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode='constant')
+    windows = _conv_windows(x_padded, HH, WW, stride, out_h, out_w)
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    # (N, F, H', W') x (N, C, H', W', HH, WW) -> (F, C, HH, WW)
+    dw = np.tensordot(dout, windows, axes=([0, 2, 3], [0, 2, 3]))
+
+    # Each filter tap scatters into a strided slice of the padded gradient
+    dx_padded = np.zeros_like(x_padded)
+    for i in range(HH):
+        for j in range(WW):
+            # (N, F, H', W') x (F, C) -> (N, H', W', C)
+            contrib = np.tensordot(dout, w[:, :, i, j], axes=([1], [0]))
+            dx_padded[:, :, i:i + stride * out_h:stride,
+                      j:j + stride * out_w:stride] += contrib.transpose(0, 3, 1, 2)
+    dx = dx_padded[:, :, pad:pad + H, pad:pad + W]
+
+    return dx, dw, db
+
+
 def max_pool_forward_naive(x, pool_param):
     """
     A naive implementation of the forward pass for a max pooling layer.
@@ -686,8 +989,11 @@ def spatial_batchnorm_forward(x, gamma, beta, bn_param):
         old information is discarded completely at every time step, while
         momentum=1 means that new information is never incorporated. The
         default of momentum=0.9 should work well in most situations.
-      - running_mean: Array of shape (D,) giving running mean of features
-      - running_var Array of shape (D,) giving running variance of features
+      - running_mean: Array of shape (C,) giving running mean of features
+      - running_var Array of shape (C,) giving running variance of features
+      - inplace: If True, x is overwritten with the normalized data and the
+        backward pass writes dx into dout. Only use this when no other layer
+        needs x or dout afterwards.
 
     Returns a tuple of:
     - out: Output data, of shape (N, C, H, W)
@@ -702,11 +1008,35 @@ def spatial_batchnorm_forward(x, gamma, beta, bn_param):
     # version of batch normalization defined above. Your implementation should#
     # be very short; ours is less than five lines.                            #
     ###########################################################################
+    # Reduce over (N, H, W) directly in NCHW layout; going through the vanilla
+    # layer needs a transpose to NHWC and a reshape copy on the way in and out.
+    mode = bn_param['mode']
+    eps = bn_param.get('eps', 1e-5)
+    momentum = bn_param.get('momentum', 0.9)
+    inplace = bn_param.get('inplace', False)
+
     N, C, H, W = x.shape
-    x_T = x.transpose((0,2,3,1))
-    x_flat = x_T.reshape(-1, C)
-    out, cache = batchnorm_forward(x_flat, gamma, beta, bn_param)
-    out = out.reshape((N,H,W,C)).transpose(0,3,1,2)
+    running_mean = bn_param.get('running_mean', np.zeros(C, dtype=x.dtype))
+    running_var = bn_param.get('running_var', np.zeros(C, dtype=x.dtype))
+
+    gamma_b = gamma.reshape(1, C, 1, 1)
+    beta_b = beta.reshape(1, C, 1, 1)
+    if mode == 'train':
+        out, xhat, inv_std, mean, var = _batchnorm_train_forward(
+            x, gamma_b, beta_b, (0, 2, 3), eps, inplace)
+        cache = (xhat, inv_std, gamma_b, inplace)
+
+        running_mean = running_mean * momentum + mean * (1 - momentum)
+        running_var = running_var * momentum + var * (1 - momentum)
+    elif mode == 'test':
+        scale = gamma / np.sqrt(running_var + eps)
+        out = x * scale.reshape(1, C, 1, 1)
+        out += (beta - running_mean * scale).reshape(1, C, 1, 1)
+    else:
+        raise ValueError('Invalid forward batchnorm mode "%s"' % mode)
+
+    bn_param['running_mean'] = running_mean
+    bn_param['running_var'] = running_var
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -736,11 +1066,9 @@ def spatial_batchnorm_backward(dout, cache):
     # version of batch normalization defined above. Your implementation should#
     # be very short; ours is less than five lines.                            #
     ###########################################################################
-    N, C, H, W = dout.shape
-    dout_T = dout.transpose((0,2,3,1))
-    dout_flat = dout_T.reshape(-1, C)
-    dx, dgamma, dbeta = batchnorm_backward(dout_flat, cache)
-    dx = dx.reshape((N,H,W,C)).transpose(0,3,1,2)
+    xhat, inv_std, gamma_b, inplace = cache
+    dx, dgamma, dbeta = _batchnorm_train_backward(
+        dout, xhat, inv_std, gamma_b, (0, 2, 3), inplace)
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -748,7 +1076,18 @@ def spatial_batchnorm_backward(dout, cache):
     return dx, dgamma, dbeta
 
 
-def svm_loss(x, y):
+def _loss_chunks(N, chunk_size):
+    """
+    Yields (start, end) row ranges of at most chunk_size rows covering N rows;
+    a single range if chunk_size is None.
+    """
+    if chunk_size is None:
+        chunk_size = max(N, 1)
+    for start in range(0, N, chunk_size):
+        yield start, min(start + chunk_size, N)
+
+
+def svm_loss(x, y, inplace=False, chunk_size=None):
     """
     Computes the loss and gradient using for multiclass SVM classification.
 
@@ -757,25 +1096,34 @@ def svm_loss(x, y):
       class for the ith input.
     - y: Vector of labels, of shape (N,) where y[i] is the label for x[i] and
       0 <= y[i] < C
+    - inplace: If True, dx is computed in the memory of x
+    - chunk_size: If not None, process this many rows at a time so that the
+      temporaries are of shape (chunk_size, C) rather than (N, C)
 
     Returns a tuple of:
     - loss: Scalar giving the loss
     - dx: Gradient of the loss with respect to x
     """
     N = x.shape[0]
-    correct_class_scores = x[np.arange(N), y]
-    margins = np.maximum(0, x - correct_class_scores[:, np.newaxis] + 1.0)
-    margins[np.arange(N), y] = 0
-    loss = np.sum(margins) / N
-    num_pos = np.sum(margins > 0, axis=1)
-    dx = np.zeros_like(x)
-    dx[margins > 0] = 1
-    dx[np.arange(N), y] -= num_pos
+    dx = _inplace_buffer(x) if inplace else np.empty_like(x)
+    loss = 0.0
+    for start, end in _loss_chunks(N, chunk_size):
+        rows, y_chunk = np.arange(end - start), y[start:end]
+        d = dx[start:end]
+        correct_class_scores = x[start:end][rows, y_chunk]
+
+        # Margins, then the indicator of positive margins, in the dx buffer
+        np.subtract(x[start:end], (correct_class_scores - 1.0)[:, np.newaxis], out=d)
+        np.maximum(d, 0, out=d)
+        d[rows, y_chunk] = 0
+        loss += np.sum(d)
+        np.greater(d, 0, out=d)
+        d[rows, y_chunk] = -np.sum(d, axis=1)
     dx /= N
-    return loss, dx
+    return loss / N, dx
 
 
-def softmax_loss(x, y):
+def softmax_loss(x, y, inplace=False, chunk_size=None):
     """
     Computes the loss and gradient for softmax classification.
 
@@ -784,18 +1132,189 @@ def softmax_loss(x, y):
       class for the ith input.
     - y: Vector of labels, of shape (N,) where y[i] is the label for x[i] and
       0 <= y[i] < C
+    - inplace: If True, dx is computed in the memory of x
+    - chunk_size: If not None, process this many rows at a time so that the
+      temporaries are of shape (chunk_size, C) rather than (N, C)
 
     Returns a tuple of:
     - loss: Scalar giving the loss
     - dx: Gradient of the loss with respect to x
     """
-    shifted_logits = x - np.max(x, axis=1, keepdims=True)
-    Z = np.sum(np.exp(shifted_logits), axis=1, keepdims=True)
-    log_probs = shifted_logits - np.log(Z)
-    probs = np.exp(log_probs)
     N = x.shape[0]
-    loss = -np.sum(log_probs[np.arange(N), y]) / N
-    dx = probs.copy()
-    dx[np.arange(N), y] -= 1
+    dx = _inplace_buffer(x) if inplace else np.empty_like(x)
+    loss = 0.0
+    for start, end in _loss_chunks(N, chunk_size):
+        rows, y_chunk = np.arange(end - start), y[start:end]
+        d = dx[start:end]
+
+        # Shifted logits, then probabilities, in the dx buffer
+        np.subtract(x[start:end], np.max(x[start:end], axis=1, keepdims=True), out=d)
+        correct_logits = d[rows, y_chunk]
+        np.exp(d, out=d)
+        Z = np.sum(d, axis=1, keepdims=True)
+        loss += np.sum(np.log(Z)) - np.sum(correct_logits)
+        d /= Z
+        d[rows, y_chunk] -= 1
     dx /= N
-    return loss, dx
+    return loss / N, dx
+
+
+def sampled_softmax_loss(x, w, b, y, loss_param):
+    """
+    Computes a sampled softmax loss for an affine output layer over a large
+    number of classes. Instead of normalizing over all C classes, each row is
+    scored against its true class and num_sampled negative classes drawn from
+    a proposal distribution, shared across the minibatch. Logits are corrected
+    by the log expected count of each class under the proposal so that the
+    gradient is an estimate of the full softmax gradient. The loss value is
+    not comparable to the full softmax loss; use softmax_loss on the full
+    scores for evaluation.
+
+    Inputs:
+    - x: Inputs to the output layer, of shape (N, D)
+    - w: Weights of the output layer, of shape (D, C)
+    - b: Biases of the output layer, of shape (C,)
+    - y: Vector of labels, of shape (N,) where 0 <= y[i] < C
+    - loss_param: A dictionary with the following keys:
+      - num_sampled: Number of negative classes to draw per minibatch; required
+      - proposal: Array of shape (C,) of positive probabilities to draw
+        negatives from, e.g. the class frequencies of the training labels.
+        Default is uniform.
+      - seed, rng: As in dropout_param
+
+    Returns a tuple of:
+    - loss: Scalar giving the sampled loss
+    - dx: Gradient with respect to x, of shape (N, D)
+    - dw: Gradient with respect to w, of shape (D, C); only the columns of the
+      true and sampled classes are nonzero. It is a dense array allocated on
+      every call, since models add their weight decay to all of it; for very
+      large C this, not the sampled scores, is the main cost of a step.
+    - db: Gradient with respect to b, of shape (C,)
+    """
+    N = x.shape[0]
+    C = w.shape[1]
+    num_sampled = loss_param['num_sampled']
+    proposal = loss_param.get('proposal')
+    if proposal is None:
+        proposal = np.full(C, 1.0 / C)
+    if 'seed' in loss_param:
+        rng = _make_rng(loss_param['seed'])
+    else:
+        rng = loss_param.get('rng')
+        if rng is None:
+            rng = loss_param['rng'] = _make_rng()
+
+    sampled = rng.choice(C, num_sampled, p=proposal)
+    w_true, w_sampled = w[:, y], w[:, sampled]
+
+    # Column 0 holds the true class, the rest the sampled classes
+    logits = np.empty((N, num_sampled + 1), dtype=np.result_type(x, w))
+    logits[:, 0] = np.einsum('nd,dn->n', x, w_true)
+    logits[:, 0] += b[y] - np.log(num_sampled * proposal[y])
+    logits[:, 1:] = x.dot(w_sampled)
+    logits[:, 1:] += b[sampled] - np.log(num_sampled * proposal[sampled])
+    # A sampled class that is the true class of a row is not a negative for it
+    logits[:, 1:][sampled == y[:, np.newaxis]] = -np.inf
+
+    loss, dlogits = softmax_loss(logits, np.zeros(N, dtype=np.intp), inplace=True)
+    dtrue, dsampled = dlogits[:, 0], dlogits[:, 1:]
+
+    dx = dsampled.dot(w_sampled.T)
+    dx += dtrue[:, np.newaxis] * w_true.T
+
+    # Sum the gradient of each row over the logits that share a class with one
+    # bincount, giving dscores of shape (N, U) over the U distinct classes
+    # touched; dw of those columns is then a single (D, N) x (N, U) product.
+    classes, inverse = np.unique(np.concatenate([y, sampled]), return_inverse=True)
+    U = classes.shape[0]
+    columns = np.empty((N, num_sampled + 1), dtype=np.intp)
+    columns[:, 0] = inverse[:N]
+    columns[:, 1:] = inverse[N:]
+    columns += U * np.arange(N)[:, np.newaxis]
+    dscores = np.bincount(columns.ravel(), weights=dlogits.ravel(), minlength=N * U)
+    dscores = dscores.reshape(N, U).astype(dlogits.dtype, copy=False)
+    dw = np.zeros_like(w)
+    dw[:, classes] = x.T.dot(dscores)
+    db = np.zeros(C, dtype=b.dtype)
+    db[classes] = np.sum(dscores, axis=0)
+    return loss, dx, dw, db
+
+
+def _log_softmax(s, axis):
+    """
+    Log of the softmax of s along axis, computed stably.
+    """
+    s = s - np.max(s, axis=axis, keepdims=True)
+    s -= np.log(np.sum(np.exp(s), axis=axis, keepdims=True))
+    return s
+
+
+def hierarchical_softmax_loss(x, w, b, wc, bc, y, cluster_size):
+    """
+    Computes a two-level hierarchical softmax loss. Classes are split into
+    K = ceil(C / cluster_size) clusters of consecutive labels, and
+    p(c | x) = p(cluster | x) * p(c | cluster, x): a K-way softmax over
+    clusters followed by a softmax over the classes of the true cluster only,
+    so each row costs O(K + cluster_size) instead of O(C).
+
+    Inputs:
+    - x: Inputs to the output layer, of shape (N, D)
+    - w, b: Class weights and biases, of shape (D, C) and (C,); the columns of
+      a cluster score the classes within it
+    - wc, bc: Cluster weights and biases, of shape (D, K) and (K,)
+    - y: Vector of labels, of shape (N,) where 0 <= y[i] < C
+    - cluster_size: Number of classes per cluster
+
+    Returns a tuple of:
+    - loss: Scalar giving the loss
+    - dx: Gradient with respect to x
+    - dw, db, dwc, dbc: Gradients with respect to w, b, wc and bc
+    """
+    N = x.shape[0]
+    C = w.shape[1]
+    clusters = y // cluster_size
+
+    # Which cluster
+    loss, dscores = softmax_loss(x.dot(wc) + bc, clusters, inplace=True)
+    dx = dscores.dot(wc.T)
+    dwc = x.T.dot(dscores)
+    dbc = np.sum(dscores, axis=0)
+
+    # Which class within the cluster, one GEMM per cluster in the minibatch
+    dw = np.zeros_like(w)
+    db = np.zeros_like(b)
+    for k in np.unique(clusters):
+        rows = np.flatnonzero(clusters == k)
+        cols = slice(k * cluster_size, min((k + 1) * cluster_size, C))
+        x_k = x[rows]
+        loss_k, dscores = softmax_loss(x_k.dot(w[:, cols]) + b[cols],
+                                       y[rows] - k * cluster_size, inplace=True)
+        weight = len(rows) / float(N)
+        loss += weight * loss_k
+        dscores *= weight
+        dx[rows] += dscores.dot(w[:, cols].T)
+        dw[:, cols] += x_k.T.dot(dscores)
+        db[cols] += np.sum(dscores, axis=0)
+
+    return loss, dx, dw, db, dwc, dbc
+
+
+def hierarchical_softmax_scores(x, w, b, wc, bc, cluster_size):
+    """
+    Exact log-probabilities of all classes under the two-level hierarchical
+    softmax of hierarchical_softmax_loss, for evaluation.
+
+    Returns:
+    - scores: Array of shape (N, C) where scores[i, c] = log p(c | x[i])
+    """
+    N = x.shape[0]
+    C = w.shape[1]
+    K = wc.shape[1]
+    cluster_scores = _log_softmax(x.dot(wc) + bc, axis=1)
+
+    # Pad the classes to K full clusters so every cluster is normalized at once
+    scores = np.full((N, K * cluster_size), -np.inf, dtype=np.result_type(x, w))
+    scores[:, :C] = x.dot(w) + b
+    scores = _log_softmax(scores.reshape(N, K, cluster_size), axis=2)
+    scores += cluster_scores[:, :, np.newaxis]
+    return scores.reshape(N, -1)[:, :C]
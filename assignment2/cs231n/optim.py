@@ -1,5 +1,9 @@
+import threading
+
 import numpy as np
 
+from cs231n.param_store import ParamStore
+
 """
 This file implements various first-order update rules that are commonly used
 for training neural networks. Each update rule accepts current weights and the
@@ -28,10 +32,173 @@ perform well; however the default values of the other hyperparameters should
 work well for a variety of different problems.
 
 For efficiency, update rules may perform in-place updates, mutating w and
-setting next_w equal to w.
+setting next_w equal to w. All rules below except sgd do so, and also
+update their state arrays in place, using scratch buffers that are shared by
+all rules and parameters (see _scratch) instead of allocating temporaries on
+every step. The elementwise rules work through large contiguous arrays, such
+as the buffer of a ParamStore, in chunks of _CHUNK_SIZE elements, so the
+scratch buffers stay a few megabytes however large the model is.
+
+Every rule that keeps per-parameter state (momentum, moving averages) also
+accepts config['state_dtype'] to store that state compactly: np.float16, or
+'bfloat16' for bfloat16 emulated in uint16 arrays (the top half of float32).
+Either halves optimizer memory for float32 weights. The state is expanded to
+the dtype of w in scratch buffers for each step, so the arithmetic is
+unchanged. Second moments
+(running averages or sums of squared gradients) are kept in bfloat16 even when
+state_dtype is np.float16: squared gradients are often below the smallest
+float16 and would flush to zero, turning the step into m / epsilon. bfloat16
+has the exponent range of float32.
 """
 
 
+# Scratch buffers of the update rules: one flat array per (dtype, slot) and
+# thread, grown to the largest array a rule has been run on, which is at most
+# _CHUNK_SIZE elements for the rules that split their work into chunks.
+_scratch_space = threading.local()
+
+# Number of elements that the elementwise rules update at a time
+_CHUNK_SIZE = 2 ** 16
+
+
+def _scratch(w, slot=0, dtype=None):
+    """
+    Returns an uninitialized scratch array with the shape of w and the dtype
+    of w, or dtype. Arrays with different slots or dtypes never overlap, and
+    those with the same ones are the same memory, so a rule must be done with
+    one before it asks for the same slot again. Slot 0 is the rules' own
+    scratch, slots 1 and 2 hold expanded compact state (see _state) and
+    slot 3 is used while converting it.
+    """
+    dtype = w.dtype if dtype is None else np.dtype(dtype)
+    buffers = getattr(_scratch_space, 'buffers', None)
+    if buffers is None:
+        buffers = _scratch_space.buffers = {}
+    buf = buffers.get((dtype, slot))
+    if buf is None or buf.size < w.size:
+        buf = buffers[(dtype, slot)] = np.empty(w.size, dtype=dtype)
+    return buf[:w.size].reshape(w.shape)
+
+
+# Keys of the states that hold squared gradients
+_SECOND_MOMENTS = ('v', 'cache')
+
+
+def _storage_dtype(config, key):
+    """
+    Returns the dtype in which the state config[key] is stored: None for the
+    dtype of w, 'bfloat16' for bfloat16 emulated in uint16, or a numpy dtype.
+    """
+    state_dtype = config.get('state_dtype')
+    if state_dtype is None:
+        return None
+    if isinstance(state_dtype, str) and state_dtype == 'bfloat16':
+        return 'bfloat16'
+    state_dtype = np.dtype(state_dtype)
+    if key in _SECOND_MOMENTS and state_dtype == np.float16:
+        return 'bfloat16'
+    return state_dtype
+
+
+def _is_bfloat16(storage_dtype):
+    return isinstance(storage_dtype, str) and storage_dtype == 'bfloat16'
+
+
+def _init_state(config, key, w):
+    """
+    Creates the optimizer state config[key] for w as zeros, in its storage
+    dtype, if it does not exist yet.
+    """
+    if key in config:
+        return
+    storage_dtype = _storage_dtype(config, key)
+    if storage_dtype is None:
+        config[key] = np.zeros_like(w)
+    elif _is_bfloat16(storage_dtype):
+        config[key] = np.zeros(w.shape, dtype=np.uint16)
+    else:
+        config[key] = np.zeros(w.shape, dtype=storage_dtype)
+
+
+def _state(config, key, w, slot):
+    """
+    Returns the optimizer state config[key] in the dtype of w, creating it
+    as zeros on first use. Without a state_dtype this is the stored array
+    itself; otherwise it is expanded into the scratch array of the given slot
+    and must be written back with _save_state after it is updated.
+    """
+    _init_state(config, key, w)
+    storage_dtype = _storage_dtype(config, key)
+    state = config[key]
+    if storage_dtype is None:
+        return state
+    expanded = _scratch(w, slot)
+    if _is_bfloat16(storage_dtype):
+        bits = expanded if expanded.dtype == np.float32 else _scratch(w, 3, np.float32)
+        np.left_shift(state, 16, out=bits.view(np.uint32), dtype=np.uint32)
+        state = bits
+    if state is not expanded:
+        np.copyto(expanded, state)
+    return expanded
+
+
+def _save_state(config, key, value):
+    """
+    Writes an updated state returned by _state back into config[key].
+    """
+    storage_dtype = _storage_dtype(config, key)
+    if storage_dtype is None:
+        return
+    if _is_bfloat16(storage_dtype):
+        if value.dtype != np.float32:
+            value32 = _scratch(value, 3, np.float32)
+            np.copyto(value32, value, casting='same_kind')
+            value = value32
+        # Round to nearest even on the 16 bits that are dropped
+        bits = value.view(np.uint32)
+        rounded = _scratch(value, 3, np.uint32)
+        np.right_shift(bits, 16, out=rounded)
+        rounded &= 1
+        rounded += 0x7FFF
+        rounded += bits
+        np.right_shift(rounded, 16, out=config[key], casting='unsafe')
+    else:
+        config[key][...] = value
+
+
+def _chunked(w):
+    """
+    Whether an elementwise rule should update w in chunks.
+    """
+    return w.size > _CHUNK_SIZE and w.flags.c_contiguous
+
+
+def _update_in_chunks(update_rule, w, dw, config, keys):
+    """
+    Runs an elementwise update_rule over chunks of _CHUNK_SIZE elements of w,
+    giving it views of the matching chunks of the state arrays named by keys.
+    An iteration count config['t'] advances once for the whole of w.
+
+    Returns:
+    - w, updated in place
+    """
+    for key in keys:
+        _init_state(config, key, w)
+    flat_w, flat_dw = w.reshape(-1), dw.reshape(-1)
+    t = config.get('t')
+    chunk_config = dict(config)
+    for start in range(0, w.size, _CHUNK_SIZE):
+        chunk = slice(start, start + _CHUNK_SIZE)
+        for key in keys:
+            chunk_config[key] = config[key].reshape(-1)[chunk]
+        if t is not None:
+            chunk_config['t'] = t
+        update_rule(flat_w[chunk], flat_dw[chunk], chunk_config)
+    if t is not None:
+        config['t'] = t + 1
+    return w
+
+
 def sgd(w, dw, config=None):
     """
     Performs vanilla stochastic gradient descent.
@@ -56,23 +223,29 @@ def sgd_momentum(w, dw, config=None):
       Setting momentum = 0 reduces to sgd.
     - velocity: A numpy array of the same shape as w and dw used to store a
       moving average of the gradients.
+    - state_dtype: Optional compact storage dtype for velocity, see above.
     """
     if config is None: config = {}
     config.setdefault('learning_rate', 1e-2)
     config.setdefault('momentum', 0.9)
-    v = config.get('velocity', np.zeros_like(w))
+    if _chunked(w):
+        return _update_in_chunks(sgd_momentum, w, dw, config, ('velocity',)), config
+    v = _state(config, 'velocity', w, 1)
 
     next_w = None
     ###########################################################################
     # TODO: Implement the momentum update formula. Store the updated value in #
     # the next_w variable. You should also use and update the velocity v.     #
     ###########################################################################
-    v = config['momentum'] * v - config['learning_rate'] * dw
-    next_w = w + v
+    scratch = _scratch(w)
+    v *= config['momentum']
+    v -= np.multiply(dw, config['learning_rate'], out=scratch)
+    w += v
+    next_w = w
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
-    config['velocity'] = v
+    _save_state(config, 'velocity', v)
 
     return next_w, config
 
@@ -89,12 +262,14 @@ def rmsprop(x, dx, config=None):
       gradient cache.
     - epsilon: Small scalar used for smoothing to avoid dividing by zero.
     - cache: Moving average of second moments of gradients.
+    - state_dtype: Optional compact storage dtype for cache, see above.
     """
     if config is None: config = {}
     config.setdefault('learning_rate', 1e-2)
     config.setdefault('decay_rate', 0.99)
     config.setdefault('epsilon', 1e-8)
-    config.setdefault('cache', np.zeros_like(x))
+    if _chunked(x):
+        return _update_in_chunks(rmsprop, x, dx, config, ('cache',)), config
 
     next_x = None
     ###########################################################################
@@ -102,8 +277,19 @@ def rmsprop(x, dx, config=None):
     # in the next_x variable. Don't forget to update cache value stored in    #
     # config['cache'].                                                        #
     ###########################################################################
-    config['cache'] = config['decay_rate'] * config['cache'] + (1 - config['decay_rate']) * dx**2
-    next_x = x - config['learning_rate'] * dx / (np.sqrt(config['cache']) + config['epsilon'])
+    cache, scratch = _state(config, 'cache', x, 1), _scratch(x)
+    cache *= config['decay_rate']
+    np.square(dx, out=scratch)
+    scratch *= 1 - config['decay_rate']
+    cache += scratch
+    _save_state(config, 'cache', cache)
+
+    np.sqrt(cache, out=scratch)
+    scratch += config['epsilon']
+    np.divide(dx, scratch, out=scratch)
+    scratch *= config['learning_rate']
+    x -= scratch
+    next_x = x
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
@@ -111,6 +297,44 @@ def rmsprop(x, dx, config=None):
     return next_x, config
 
 
+def _adam_step(x, dx, config):
+    """
+    Updates the Adam moments in config and returns the bias-corrected step
+    m_hat / (sqrt(v_hat) + epsilon) in the scratch buffer, so that the caller
+    can rescale it before subtracting it from x.
+    """
+    config['t'] += 1
+    beta1, beta2, t = config['beta1'], config['beta2'], config['t']
+    m, v = _state(config, 'm', x, 1), _state(config, 'v', x, 2)
+    scratch = _scratch(x)
+    m *= beta1
+    m += np.multiply(dx, 1 - beta1, out=scratch)
+    v *= beta2
+    np.square(dx, out=scratch)
+    scratch *= 1 - beta2
+    v += scratch
+
+    # With the bias corrections m_hat = m / (1 - beta1^t) and
+    # v_hat = v / (1 - beta2^t)
+    np.divide(v, 1 - beta2 ** t, out=scratch)
+    np.sqrt(scratch, out=scratch)
+    scratch += config['epsilon']
+    np.divide(m, scratch, out=scratch)
+    scratch *= 1.0 / (1 - beta1 ** t)
+
+    _save_state(config, 'm', m)
+    _save_state(config, 'v', v)
+    return scratch
+
+
+def _adam_defaults(config, learning_rate):
+    config.setdefault('learning_rate', learning_rate)
+    config.setdefault('beta1', 0.9)
+    config.setdefault('beta2', 0.999)
+    config.setdefault('epsilon', 1e-8)
+    config.setdefault('t', 0)
+
+
 def adam(x, dx, config=None):
     """
     Uses the Adam update rule, which incorporates moving averages of both the
@@ -124,15 +348,12 @@ def adam(x, dx, config=None):
     - m: Moving average of gradient.
     - v: Moving average of squared gradient.
     - t: Iteration number.
+    - state_dtype: Optional compact storage dtype for m and v, see above.
     """
     if config is None: config = {}
-    config.setdefault('learning_rate', 1e-3)
-    config.setdefault('beta1', 0.9)
-    config.setdefault('beta2', 0.999)
-    config.setdefault('epsilon', 1e-8)
-    config.setdefault('m', np.zeros_like(x))
-    config.setdefault('v', np.zeros_like(x))
-    config.setdefault('t', 0)
+    _adam_defaults(config, 1e-3)
+    if _chunked(x):
+        return _update_in_chunks(adam, x, dx, config, ('m', 'v')), config
 
     next_x = None
     ###########################################################################
@@ -140,14 +361,234 @@ def adam(x, dx, config=None):
     # the next_x variable. Don't forget to update the m, v, and t variables   #
     # stored in config.                                                       #
     ###########################################################################
-    config['t'] += 1
-    config['m'] = config['beta1'] * config['m'] + (1 - config['beta1']) * dx
-    config['v'] = config['beta2'] * config['v'] + (1 - config['beta2']) * (dx**2)
-    m = config['m'] / (1 - config['beta1'] ** config['t'])
-    v = config['v'] / (1 - config['beta2'] ** config['t'])
-    next_x = x - config['learning_rate'] * m / (np.sqrt(v) + config['epsilon'])
+    step = _adam_step(x, dx, config)
+    step *= config['learning_rate']
+    x -= step
+    next_x = x
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
 
     return next_x, config
+
+
+def adamw(x, dx, config=None):
+    """
+    Uses Adam with decoupled weight decay (AdamW): the decay is applied to
+    the weights directly rather than added to the gradient, so it is not
+    rescaled by the adaptive learning rate. Models trained with adamw should
+    set their own L2 regularization to zero.
+
+    config format: Same as adam, plus
+    - weight_decay: Scalar weight decay, applied to every array the rule
+      updates (including biases, unless their config sets it to zero).
+    """
+    if config is None: config = {}
+    _adam_defaults(config, 1e-3)
+    config.setdefault('weight_decay', 1e-2)
+    if _chunked(x):
+        return _update_in_chunks(adamw, x, dx, config, ('m', 'v')), config
+
+    step = _adam_step(x, dx, config)
+    x *= 1 - config['learning_rate'] * config['weight_decay']
+    step *= config['learning_rate']
+    x -= step
+    return x, config
+
+
+def nesterov_momentum(w, dw, config=None):
+    """
+    Performs stochastic gradient descent with Nesterov momentum, in the form
+    that keeps w at the look-ahead point:
+
+    v_next = momentum * v - learning_rate * dw
+    w_next = w - momentum * v + (1 + momentum) * v_next
+
+    config format: Same as sgd_momentum.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('momentum', 0.9)
+    if _chunked(w):
+        return _update_in_chunks(nesterov_momentum, w, dw, config, ('velocity',)), config
+    mu = config['momentum']
+    v = _state(config, 'velocity', w, 1)
+    scratch = _scratch(w)
+
+    w -= np.multiply(v, mu, out=scratch)
+    v *= mu
+    v -= np.multiply(dw, config['learning_rate'], out=scratch)
+    w += np.multiply(v, 1 + mu, out=scratch)
+    _save_state(config, 'velocity', v)
+    return w, config
+
+
+def adagrad(w, dw, config=None):
+    """
+    Uses the Adagrad update rule, which scales the learning rate of each
+    weight by the inverse root of its accumulated squared gradients.
+
+    config format:
+    - learning_rate: Scalar learning rate.
+    - epsilon: Small scalar used for smoothing to avoid dividing by zero.
+    - cache: Sum of squared gradients.
+    - state_dtype: Optional compact storage dtype for cache, see above.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('epsilon', 1e-8)
+    if _chunked(w):
+        return _update_in_chunks(adagrad, w, dw, config, ('cache',)), config
+    cache, scratch = _state(config, 'cache', w, 1), _scratch(w)
+
+    cache += np.square(dw, out=scratch)
+    _save_state(config, 'cache', cache)
+    np.sqrt(cache, out=scratch)
+    scratch += config['epsilon']
+    np.divide(dw, scratch, out=scratch)
+    scratch *= config['learning_rate']
+    w -= scratch
+    return w, config
+
+
+def lamb(w, dw, config=None):
+    """
+    Uses the LAMB update rule for large-batch training: the Adam step plus
+    decoupled weight decay, rescaled per parameter tensor by the trust ratio
+    ||w|| / ||step|| so that every layer moves by a similar relative amount.
+
+    config format: Same as adamw, plus
+    - segments: List of slices of the flattened w that are separate parameter
+      tensors, each getting its own trust ratio; the whole of w by default.
+      multi_tensor_update sets this for a ParamStore.
+
+    The trust ratios need whole tensors, so unlike the other rules lamb does
+    not work in chunks, and its scratch buffers take the size of w.
+    """
+    if config is None: config = {}
+    _adam_defaults(config, 1e-3)
+    config.setdefault('weight_decay', 1e-2)
+
+    step = _adam_step(w, dw, config)
+    step += np.multiply(w, config['weight_decay'], out=_scratch(w, 1))
+
+    segments = config.get('segments')
+    if segments is None:
+        segments = [slice(0, w.size)]
+    starts = [s.start for s in segments]
+    squares = _scratch(w, 1).ravel()
+    w_norm = np.sqrt(np.add.reduceat(np.square(w.ravel(), out=squares), starts))
+    step_norm = np.sqrt(np.add.reduceat(np.square(step.ravel(), out=squares), starts))
+    ratio = np.where((w_norm > 0) & (step_norm > 0),
+                     w_norm / np.maximum(step_norm, 1e-30), 1.0)
+
+    flat_step = step.ravel()
+    for segment, r in zip(segments, ratio * config['learning_rate']):
+        flat_step[segment] *= r
+    w -= step
+    return w, config
+
+
+def multi_tensor_update(update_rule, params, grads, configs, learning_rate=None):
+    """
+    Updates every parameter of a model with one update rule.
+
+    If params is a ParamStore, grads are copied into its gradient buffer and
+    update_rule runs once over the whole parameter buffer, with the single
+    config configs['params'], whose 'segments' are set to the slices of the
+    individual parameters. Otherwise update_rule runs once per parameter,
+    with configs[k] for params[k].
+
+    Inputs:
+    - update_rule: One of the update rules above
+    - params: Dictionary or ParamStore of parameters; updated in place
+    - grads: Dictionary of gradients with the same keys as params
+    - configs: Dictionary of configs as described above; updated in place
+    - learning_rate: If not None, the learning rate for this step, which
+      replaces the 'learning_rate' of every config; see schedules.py
+
+    Returns:
+    - configs
+    """
+    if isinstance(params, ParamStore):
+        params.set_grads(grads)
+        config = configs.get('params')
+        if config is None:
+            config = {}
+        if learning_rate is not None:
+            config['learning_rate'] = learning_rate
+        # Per-tensor rules such as lamb need the parameter boundaries
+        config.setdefault('segments', sorted(params.slices.values(),
+                                             key=lambda s: s.start))
+        next_w, configs['params'] = update_rule(
+            params.data, params.grad_data, config)
+        if next_w is not params.data:
+            params.data[...] = next_w
+    else:
+        for k, w in params.items():
+            config = configs.get(k)
+            if learning_rate is not None:
+                if config is None:
+                    config = configs[k] = {}
+                config['learning_rate'] = learning_rate
+            params[k], configs[k] = update_rule(w, grads[k], config)
+    return configs
+
+
+def benchmark(hidden_dims=(256,) * 12, input_dim=3 * 32 * 32, num_classes=10,
+              rules=('sgd_momentum', 'rmsprop', 'adam'),
+              state_dtypes=(None, 'bfloat16'), num_steps=20):
+    """
+    Measure one optimizer step over the float32 parameters of a batchnorm
+    FullyConnectedNet with the given layer sizes, for every rule and state
+    dtype, with the parameters in a dictionary and in a ParamStore. Prints
+    the time per step and the memory taken by the optimizer state and the
+    scratch buffers.
+    """
+    from timeit import default_timer
+
+    dims = [input_dim] + list(hidden_dims) + [num_classes]
+    shapes = {}
+    for i in range(len(dims) - 1):
+        shapes['W%d' % (i + 1)] = (dims[i], dims[i + 1])
+        shapes['b%d' % (i + 1)] = (dims[i + 1],)
+        if i < len(hidden_dims):
+            shapes['gamma%d' % (i + 1)] = (dims[i + 1],)
+            shapes['beta%d' % (i + 1)] = (dims[i + 1],)
+    rng = np.random.RandomState(0)
+    params = dict((k, rng.randn(*shape).astype(np.float32))
+                  for k, shape in shapes.items())
+    grads = dict((k, 1e-3 * rng.randn(*shape).astype(np.float32))
+                 for k, shape in shapes.items())
+    size = sum(p.nbytes for p in params.values()) / 2.0 ** 20
+
+    print('parameters: %.1f MB' % size)
+    print('%-14s %-9s %-6s %8s %9s %11s' % ('rule', 'state', 'layout', 'ms/step',
+                                            'state MB', 'scratch MB'))
+    for rule in rules:
+        update_rule = globals()[rule]
+        for state_dtype in state_dtypes:
+            for layout in ('dict', 'flat'):
+                _scratch_space.buffers = {}
+                if layout == 'flat':
+                    step_params = ParamStore(params)
+                    configs = {'params': {'state_dtype': state_dtype}}
+                else:
+                    step_params = dict((k, p.copy()) for k, p in params.items())
+                    configs = dict((k, {'state_dtype': state_dtype}) for k in params)
+                multi_tensor_update(update_rule, step_params, grads, configs)
+                t0 = default_timer()
+                for i in range(num_steps):
+                    multi_tensor_update(update_rule, step_params, grads, configs)
+                elapsed = (default_timer() - t0) / num_steps
+                state = sum(v.nbytes for config in configs.values()
+                            for v in config.values() if isinstance(v, np.ndarray))
+                scratch = sum(b.nbytes for b in _scratch_space.buffers.values())
+                print('%-14s %-9s %-6s %8.2f %9.1f %11.1f' % (
+                    rule, state_dtype or 'None', layout, 1000 * elapsed,
+                    state / 2.0 ** 20, scratch / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    # python -m cs231n.optim
+    benchmark()
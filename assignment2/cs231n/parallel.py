@@ -0,0 +1,327 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import multiprocessing
+import sys
+import time
+import traceback
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from cs231n import fast_layers
+from cs231n.param_store import ParamStore
+
+
+def _shared_empty(shape, dtype):
+    """
+    Returns an uninitialized array of the given shape and dtype whose memory
+    is shared with processes forked after it is created.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    raw = RawArray('b', max(size * dtype.itemsize, 1))
+    return np.frombuffer(raw, dtype=dtype, count=size).reshape(shape)
+
+
+def _shard(n, rank, num_workers):
+    """
+    Returns the (start, end) rows of an n-row minibatch assigned to a worker.
+    """
+    return rank * n // num_workers, (rank + 1) * n // num_workers
+
+
+class DataParallel(object):
+    """
+    Computes the loss and gradients of a model on worker processes, each of
+    which runs model.loss on a shard of the minibatch.
+
+    Everything large lives in shared memory, so only small control messages
+    go through the pipes to the workers:
+    - The parameters are moved into a shared buffer, so the update that the
+      Solver makes in place in the parent is seen by the workers without a
+      copy. If the params of the model are a plain dictionary, an update
+      rule may still rebind a key to a new array; loss copies such arrays
+      back into the shared buffer before the workers run.
+    - The parent writes each minibatch into a shared batch buffer, from which
+      every worker reads its shard.
+    - Every worker writes its gradient, weighted by the size of its shard,
+      into its own row of a shared (num_workers, P) array. The rows are then
+      reduced in parallel: worker k sums the k-th slice of every row into the
+      shared output buffer, which holds the gradient of the whole minibatch.
+
+    The loss and the batchnorm running averages come back through the pipes.
+    Batchnorm normalizes every shard with the mean and variance of that
+    shard, not of the whole minibatch, so with batchnorm the loss and
+    gradients differ from those of serial training on the same minibatch,
+    the more so the smaller the shards. Like most data-parallel trainers, the
+    running averages are those that the first worker computes from its shard
+    alone.
+
+    Workers are forked, so this needs the 'fork' start method of Unix. For
+    the best scaling limit every worker to one BLAS thread, e.g. by setting
+    OMP_NUM_THREADS=1 before NumPy is imported; the Cython convolution
+    kernels are limited to one thread in the workers.
+
+    Example usage:
+
+    parallel = DataParallel(model, num_workers=4)
+    parallel.start(batch_size, X_train.shape[1:], X_train.dtype, y_train.dtype)
+    loss, grads = parallel.loss(X_batch, y_batch)
+    ...
+    parallel.close()
+    """
+
+    def __init__(self, model, num_workers, seed=None):
+        """
+        Inputs:
+        - model: A model as described in Solver. Its loss is called in the
+          workers on copies made by fork.
+        - num_workers: Number of worker processes
+        - seed: If not None, the workers seed np.random with seed + rank
+        """
+        if not hasattr(multiprocessing, 'get_context'):
+            self._context = multiprocessing
+        elif 'fork' in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context('fork')
+        else:
+            raise ValueError('DataParallel needs the fork start method')
+        self.model = model
+        self.num_workers = num_workers
+        self.seed = seed
+        self._workers = []
+
+    def start(self, batch_size, x_shape, x_dtype, y_dtype):
+        """
+        Move the parameters of the model into shared memory and fork the
+        workers. Call this again after the model's parameters are replaced,
+        e.g. by Solver.resume.
+
+        Call this while the process runs no other threads: fork copies only
+        the calling thread, so a lock held by another thread at that moment
+        stays locked in every worker.
+
+        Inputs:
+        - batch_size: Maximum number of samples in a minibatch
+        - x_shape: Tuple (d_1, ..., d_k) giving the shape of one sample
+        - x_dtype, y_dtype: Datatypes of the minibatches of data and labels
+        """
+        self.close()
+        params = self.model.params
+        self.names = sorted(params)
+        self.shapes = [params[k].shape for k in self.names]
+        dtype = np.result_type(*[params[k] for k in self.names])
+        size = sum(int(np.prod(shape)) for shape in self.shapes)
+
+        # Parameters, reusing the layout of a ParamStore where there is one
+        self._param_views = None
+        if isinstance(params, ParamStore):
+            params.rebuffer(_shared_empty(size, params.data.dtype),
+                            _shared_empty(size, params.data.dtype))
+            self.grad_out = params.grad_data
+        else:
+            data = _shared_empty(size, dtype)
+            start = 0
+            for k, shape in zip(self.names, self.shapes):
+                end = start + int(np.prod(shape))
+                data[start:end] = params[k].ravel()
+                params[k] = data[start:end].reshape(shape)
+                start = end
+            self._param_views = dict(params)
+            self.grad_out = _shared_empty(size, dtype)
+        self.grads = {}
+        start = 0
+        for k, shape in zip(self.names, self.shapes):
+            end = start + int(np.prod(shape))
+            self.grads[k] = self.grad_out[start:end].reshape(shape)
+            start = end
+
+        self.X_batch = _shared_empty((batch_size,) + tuple(x_shape), x_dtype)
+        self.y_batch = _shared_empty(batch_size, y_dtype)
+        self.grad_rows = _shared_empty((self.num_workers, size), self.grad_out.dtype)
+
+        for rank in range(self.num_workers):
+            parent_conn, child_conn = self._context.Pipe()
+            process = self._context.Process(target=self._work,
+                                            args=(rank, child_conn))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._workers.append((process, parent_conn))
+
+    def loss(self, X, y):
+        """
+        Compute the loss and gradients of the model on a minibatch, as
+        model.loss(X, y) would. The gradients are views into a shared buffer
+        that the next call overwrites.
+        """
+        n = X.shape[0]
+        if n > self.X_batch.shape[0]:
+            raise ValueError('Minibatch of %d samples is larger than batch_size %d'
+                             % (n, self.X_batch.shape[0]))
+        self.X_batch[:n] = X
+        self.y_batch[:n] = y
+
+        # The workers only see the shared views; move any parameter that an
+        # update rebound to a new array back into them.
+        if self._param_views is not None:
+            params = self.model.params
+            for k, view in self._param_views.items():
+                if params[k] is not view:
+                    view[...] = params[k]
+                    params[k] = view
+
+        loss_scale = getattr(self.model, 'loss_scale', None)
+        losses = self._run(('loss', n, loss_scale))
+        bn_state = losses[0][1]
+        if bn_state is not None:
+            for bn_param, state in zip(self.model.bn_params, bn_state):
+                bn_param.update(state)
+        loss = sum(l for l, _ in losses)
+
+        self._run(('reduce',))
+        return loss, dict(self.grads)
+
+    def close(self):
+        """
+        Stop the workers.
+        """
+        for process, conn in self._workers:
+            conn.send(None)
+            conn.close()
+            process.join()
+        self._workers = []
+
+    def _run(self, message):
+        """
+        Send message to every worker and return their replies.
+        """
+        for process, conn in self._workers:
+            conn.send(message)
+        replies, errors = [], []
+        for process, conn in self._workers:
+            ok, reply = conn.recv()
+            if ok:
+                replies.append(reply)
+            else:
+                errors.append(reply)
+        if errors:
+            self.close()
+            raise RuntimeError('DataParallel worker failed:\n' + errors[0])
+        return replies
+
+    def _work(self, rank, conn):
+        """
+        Main loop of a worker process.
+        """
+        fast_layers.set_cython_num_threads(1)
+        if self.seed is not None:
+            np.random.seed(self.seed + rank)
+        else:
+            np.random.seed()
+        # Draw dropout masks from a fresh stream rather than the parent's copy
+        dropout_param = getattr(self.model, 'dropout_param', None)
+        if dropout_param:
+            dropout_param.pop('rng', None)
+
+        grad_row = self.grad_rows[rank]
+        grad_views = {}
+        start = 0
+        for k, shape in zip(self.names, self.shapes):
+            end = start + int(np.prod(shape))
+            grad_views[k] = grad_row[start:end].reshape(shape)
+            start = end
+        size = self.grad_out.shape[0]
+        reduce_slice = slice(*_shard(size, rank, self.num_workers))
+
+        while True:
+            message = conn.recv()
+            if message is None:
+                return
+            try:
+                if message[0] == 'loss':
+                    reply = self._shard_loss(rank, message[1], message[2], grad_views)
+                else:
+                    np.sum(self.grad_rows[:, reduce_slice], axis=0,
+                           out=self.grad_out[reduce_slice])
+                    reply = None
+                conn.send((True, reply))
+            except Exception:
+                conn.send((False, traceback.format_exc()))
+
+    def _shard_loss(self, rank, n, loss_scale, grad_views):
+        """
+        Compute this worker's weighted share of the loss and gradients.
+        """
+        start, end = _shard(n, rank, self.num_workers)
+        loss = 0.0
+        if end > start:
+            if loss_scale is not None:
+                self.model.loss_scale = loss_scale
+            loss, grads = self.model.loss(self.X_batch[start:end],
+                                          self.y_batch[start:end])
+            weight = (end - start) / n
+            loss *= weight
+            for k, view in grad_views.items():
+                if k in grads:
+                    np.multiply(grads[k], weight, out=view)
+                else:
+                    view[...] = 0
+        else:
+            for view in grad_views.values():
+                view[...] = 0
+
+        bn_state = None
+        if rank == 0 and getattr(self.model, 'bn_params', None):
+            bn_state = [dict((k, p[k]) for k in ('running_mean', 'running_var') if k in p)
+                        for p in self.model.bn_params]
+        return loss, bn_state
+
+
+def benchmark(worker_counts=None, hidden_dims=(1024, 1024), batch_size=512,
+              num_steps=20):
+    """
+    Measure the throughput of Solver steps on random CIFAR-10 sized data
+    with 1, 2, 4, ... worker processes, and print the speedup over training
+    in a single process.
+    """
+    from cs231n.classifiers.fc_net import FullyConnectedNet
+    from cs231n.solver import Solver
+
+    if worker_counts is None:
+        num_cpus = multiprocessing.cpu_count()
+        worker_counts = [2 ** i for i in range(num_cpus.bit_length())
+                         if 2 ** i <= num_cpus]
+    X = np.random.randn(4 * batch_size, 3 * 32 * 32).astype(np.float32)
+    y = np.random.randint(10, size=X.shape[0])
+    data = {'X_train': X, 'y_train': y, 'X_val': X[:100], 'y_val': y[:100]}
+
+    print('%8s %12s %8s' % ('workers', 'samples/s', 'speedup'))
+    baseline = None
+    for num_workers in [None] + list(worker_counts):
+        np.random.seed(0)
+        model = FullyConnectedNet(list(hidden_dims), use_batchnorm=True,
+                                  flat_params=True)
+        solver = Solver(model, data, update_rule='sgd_momentum',
+                        batch_size=batch_size, num_workers=num_workers,
+                        verbose=False)
+        if solver.parallel is not None:
+            solver.parallel.start(batch_size, X.shape[1:], X.dtype, y.dtype)
+        solver._step()
+        t0 = time.time()
+        for i in range(num_steps):
+            solver._step()
+        rate = num_steps * batch_size / (time.time() - t0)
+        if solver.parallel is not None:
+            solver.parallel.close()
+        if baseline is None:
+            baseline = rate
+            print('%8s %12.0f %8s' % ('serial', rate, '-'))
+        else:
+            print('%8d %12.0f %7.2fx' % (num_workers, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    # python -m cs231n.parallel [worker counts...]; set OMP_NUM_THREADS=1
+    counts = [int(a) for a in sys.argv[1:]] or None
+    benchmark(counts)
@@ -0,0 +1,179 @@
+from builtins import object
+import numpy as np
+
+
+class ParamStore(dict):
+    """
+    A dictionary of parameter arrays that are all views into one contiguous
+    buffer, with a second buffer of the same layout for their gradients.
+
+    A ParamStore can stand in for the params dictionary of any model: reading
+    self.params['W1'] returns a view, and assigning self.params['W1'] = value
+    copies value into that view instead of rebinding the key, so the buffer
+    stays the single owner of all parameters. This lets an update rule run as
+    one vectorized operation over the whole model (see Solver), and lets a
+    checkpoint write a single array; pickling a ParamStore stores the buffer,
+    not one array per parameter.
+
+    Attributes:
+    - data: 1-D array holding all parameters
+    - grad_data: 1-D array holding all gradients, see set_grads
+    - grads: Dictionary of views into grad_data, keyed like the parameters
+    - slices: Dictionary giving the slice of data that holds each parameter
+    """
+
+    def __init__(self, params, dtype=None):
+        """
+        Pack params into a new buffer.
+
+        Inputs:
+        - params: Dictionary mapping parameter names to arrays
+        - dtype: Datatype of the buffer; by default the common type of params
+        """
+        super(ParamStore, self).__init__()
+        names = sorted(params)
+        if dtype is None:
+            dtype = np.result_type(*[params[k] for k in names])
+        shapes = [np.shape(params[k]) for k in names]
+        size = sum(int(np.prod(shape)) for shape in shapes)
+        self._attach(names, shapes, np.empty(size, dtype=dtype),
+                     np.zeros(size, dtype=dtype))
+        for k in names:
+            self[k] = params[k]
+
+    def _attach(self, names, shapes, data, grad_data):
+        """
+        Expose data and grad_data as views with the given names and shapes.
+        """
+        self.data = data
+        self.grad_data = grad_data
+        self.grads = {}
+        self.slices = {}
+        start = 0
+        for k, shape in zip(names, shapes):
+            end = start + int(np.prod(shape))
+            self.slices[k] = slice(start, end)
+            dict.__setitem__(self, k, data[start:end].reshape(shape))
+            self.grads[k] = grad_data[start:end].reshape(shape)
+            start = end
+
+    def rebuffer(self, data, grad_data):
+        """
+        Move the parameters and gradients into the given buffers, e.g. ones in
+        shared memory, copying their current values. The buffers must have
+        the size and dtype of self.data.
+        """
+        names = sorted(self.slices, key=lambda k: self.slices[k].start)
+        shapes = [self[k].shape for k in names]
+        data[...] = self.data
+        grad_data[...] = self.grad_data
+        self._attach(names, shapes, data, grad_data)
+
+    def __setitem__(self, k, value):
+        if k not in self:
+            raise KeyError('Cannot add parameter "%s" to a ParamStore' % k)
+        view = dict.__getitem__(self, k)
+        if np.ndim(value) > 0 and np.shape(value) != view.shape:
+            raise ValueError('Parameter "%s" has shape %s, got %s'
+                             % (k, view.shape, np.shape(value)))
+        view[...] = value
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def set_grads(self, grads):
+        """
+        Copy a dictionary of gradients, as returned by model.loss, into
+        grad_data. Parameters missing from grads get a zero gradient.
+
+        Returns:
+        - grad_data
+        """
+        for k, view in self.grads.items():
+            if k in grads:
+                view[...] = grads[k]
+            else:
+                view[...] = 0
+        return self.grad_data
+
+    def __reduce__(self):
+        names = sorted(self.slices, key=lambda k: self.slices[k].start)
+        shapes = [self[k].shape for k in names]
+        return (_rebuild_param_store, (names, shapes, self.data, self.grad_data))
+
+
+def _rebuild_param_store(names, shapes, data, grad_data):
+    store = ParamStore.__new__(ParamStore)
+    store._attach(names, shapes, data, grad_data)
+    return store
+
+
+class ParamShadow(object):
+    """
+    A preallocated copy of a model's parameters, e.g. the best parameters
+    seen so far or a moving average of them. The copy lives in one buffer,
+    optionally a memory-mapped file, that is allocated once and then only
+    written in place.
+
+    Attributes:
+    - data: 1-D array or memmap holding the copy
+    - params: Dictionary of views into data, keyed like the parameters
+    """
+
+    def __init__(self, params, filename=None):
+        """
+        Allocate a buffer for a copy of params; its contents are undefined
+        until the first call to copy_from.
+
+        Inputs:
+        - params: Dictionary or ParamStore of parameters
+        - filename: If not None, keep the copy in a memory-mapped file of this
+          name instead of in memory
+        """
+        names = sorted(params)
+        dtype = np.result_type(*[params[k] for k in names])
+        shapes = [np.shape(params[k]) for k in names]
+        size = sum(int(np.prod(shape)) for shape in shapes)
+        if filename is None:
+            self.data = np.empty(size, dtype=dtype)
+        else:
+            self.data = np.memmap(filename, dtype=dtype, mode='w+', shape=(size,))
+
+        # Same layout as a ParamStore of params, so that a ParamStore can be
+        # copied as a single array
+        self.params = {}
+        start = 0
+        for k, shape in zip(names, shapes):
+            end = start + int(np.prod(shape))
+            self.params[k] = self.data[start:end].reshape(shape)
+            start = end
+
+    def _pairs(self, params):
+        if isinstance(params, ParamStore) and params.data.shape == self.data.shape:
+            return [(self.data, params.data)]
+        return [(self.params[k], params[k]) for k in self.params]
+
+    def copy_from(self, params):
+        """
+        Overwrite the copy with params.
+        """
+        for shadow, p in self._pairs(params):
+            shadow[...] = p
+
+    def copy_to(self, params):
+        """
+        Overwrite the arrays of params in place with the copy.
+        """
+        for shadow, p in self._pairs(params):
+            p[...] = shadow
+
+    def update_average(self, params, decay):
+        """
+        Update the copy to an exponential moving average of params:
+        shadow = decay * shadow + (1 - decay) * params, computed in place.
+        """
+        for shadow, p in self._pairs(params):
+            shadow -= p
+            shadow *= decay
+            shadow += p
@@ -0,0 +1,176 @@
+from future import standard_library
+standard_library.install_aliases()
+from builtins import range
+from builtins import object
+import queue
+import threading
+
+import numpy as np
+
+
+class BatchPrefetcher(object):
+    """
+    Gathers random minibatches of training data on background threads, so
+    that sampling and copying the next batches overlaps with the forward and
+    backward pass on the current one. NumPy releases the GIL while it copies,
+    so this helps even though the model runs in the main thread.
+
+    Batches are written into a fixed ring of preallocated buffers that is
+    reused for the whole run: a worker takes a free buffer, fills it and puts
+    it on a bounded queue of ready batches, and the buffer is recycled when
+    the consumer asks for the batch after it. A batch returned by next() is
+    therefore only valid until the following call.
+
+    Each worker samples indices from its own RandomState, so prefetching
+    leaves the global np.random state alone. The batches come in the order
+    the workers finish them.
+
+    Example usage:
+
+    prefetcher = BatchPrefetcher(X_train, y_train, batch_size=100)
+    prefetcher.start()
+    for t in range(num_iterations):
+        X_batch, y_batch = next(prefetcher)
+        ...
+    prefetcher.close()
+    """
+
+    def __init__(self, X, y, batch_size, num_batches=2, num_workers=1,
+                 dtype=None, transform=None, seed=None):
+        """
+        Inputs:
+        - X: Array of data, of shape (N, d_1, ..., d_k)
+        - y: Array of labels, of shape (N,)
+        - batch_size: Number of samples per minibatch
+        - num_batches: Number of batches to keep ready ahead of the consumer
+        - num_workers: Number of worker threads
+        - dtype: If not None, the datatype the batches of X are converted to
+          while they are copied
+        - transform: If not None, a function transform(X_batch, y_batch, rng)
+          called on each gathered batch, e.g. for data augmentation. It may
+          modify X_batch in place and returns the (X_batch, y_batch) to use.
+        - seed: If not None, the seed of the workers' random streams
+        """
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+        self.num_workers = num_workers
+        self.dtype = np.dtype(X.dtype if dtype is None else dtype)
+        self.transform = transform
+        self.seed = seed
+
+        # Every worker may be filling a buffer while num_batches are queued
+        # and the consumer holds one more
+        num_buffers = num_batches + num_workers + 1
+        self.X_buffers = [np.empty((batch_size,) + X.shape[1:], dtype=self.dtype)
+                          for i in range(num_buffers)]
+        self.y_buffers = [np.empty(batch_size, dtype=y.dtype)
+                          for i in range(num_buffers)]
+
+        self._threads = []
+        self._current = None
+
+    def start(self):
+        """
+        Start the worker threads. Does nothing if they are already running.
+        """
+        if self._threads:
+            return
+        self._stop = threading.Event()
+        self._free = queue.Queue()
+        self._ready = queue.Queue(maxsize=self.num_batches)
+        for i in range(len(self.X_buffers)):
+            self._free.put(i)
+        self._current = None
+
+        seeds = np.random.RandomState(self.seed).randint(2 ** 31, size=self.num_workers)
+        for s in seeds:
+            thread = threading.Thread(target=self._work, args=(s,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        """
+        Stop the worker threads and wait for them to exit.
+        """
+        if not self._threads:
+            return
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        Returns a tuple of:
+        - X_batch: Array of shape (batch_size, d_1, ..., d_k)
+        - y_batch: Array of shape (batch_size,)
+        """
+        if not self._threads:
+            self.start()
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        i, batch = self._ready.get()
+        if isinstance(batch, BaseException):
+            self.close()
+            raise batch
+        self._current = i
+        return batch
+
+    def _work(self, seed):
+        rng = np.random.RandomState(seed)
+        num_train = self.X.shape[0]
+        # Staging area for the rows of X when they are converted to self.dtype
+        staging = None
+        if self.dtype != self.X.dtype:
+            staging = np.empty((self.batch_size,) + self.X.shape[1:], dtype=self.X.dtype)
+
+        while not self._stop.is_set():
+            i = self._get(self._free)
+            if i is None:
+                return
+            try:
+                batch_mask = rng.choice(num_train, self.batch_size)
+                X_batch, y_batch = self.X_buffers[i], self.y_buffers[i]
+                if staging is None:
+                    np.take(self.X, batch_mask, axis=0, out=X_batch)
+                else:
+                    np.take(self.X, batch_mask, axis=0, out=staging)
+                    X_batch[...] = staging
+                np.take(self.y, batch_mask, out=y_batch)
+                batch = (X_batch, y_batch)
+                if self.transform is not None:
+                    batch = self.transform(X_batch, y_batch, rng)
+            except Exception as e:
+                batch = e
+            if not self._put(self._ready, (i, batch)):
+                return
+
+    def _get(self, q):
+        """
+        Blocking get from q that gives up when the prefetcher is closed.
+        """
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _put(self, q, item):
+        """
+        Blocking put onto q that gives up when the prefetcher is closed.
+        """
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
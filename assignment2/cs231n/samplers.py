@@ -0,0 +1,220 @@
+from __future__ import division
+from builtins import range
+from builtins import object
+import numpy as np
+
+"""
+This file implements minibatch samplers for the Solver. A sampler is bound to
+a training set and yields one (X_batch, y_batch) tuple per iteration:
+
+sampler = PermutationSampler(X_train, y_train, batch_size=100, seed=0)
+X_batch, y_batch = next(sampler)
+
+An epoch is num_batches = N // batch_size minibatches, the same as in the
+Solver. Every epoch draws its randomness from a RandomState seeded with
+(seed, epoch), so set_epoch(epoch) puts a sampler back in exactly the state
+it had at the start of that epoch, which lets an interrupted run resume with
+the same batches.
+"""
+
+
+class Sampler(object):
+    """
+    Base class for samplers. Subclasses implement _batch(i), returning the
+    i-th minibatch of the current epoch, and may override _new_epoch() to
+    prepare an epoch using self.rng.
+    """
+
+    def __init__(self, X, y, batch_size, seed=None):
+        """
+        Inputs:
+        - X: Array of data, of shape (N, d_1, ..., d_k)
+        - y: Array of labels, of shape (N,)
+        - batch_size: Number of samples per minibatch
+        - seed: Base seed of the per-epoch random streams; drawn from
+          np.random if None
+        """
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.num_batches = max(X.shape[0] // batch_size, 1)
+        if seed is None:
+            seed = np.random.randint(2 ** 31)
+        self.seed = seed
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        """
+        Start epoch number epoch, counting from 0.
+        """
+        self.epoch = epoch
+        self.batch_index = 0
+        self.rng = np.random.RandomState([self.seed, epoch])
+        self._new_epoch()
+
+    def get_state(self):
+        """
+        Returns the position of the sampler as a dictionary of arrays and
+        scalars, e.g. for a checkpoint.
+        """
+        return {'seed': self.seed, 'epoch': self.epoch,
+                'batch_index': self.batch_index,
+                'rng': list(self.rng.get_state())}
+
+    def set_state(self, state):
+        """
+        Restore a position returned by get_state.
+        """
+        self.seed = state['seed']
+        self.set_epoch(state['epoch'])
+        self.batch_index = state['batch_index']
+        self.rng.set_state(tuple(state['rng']))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        Returns a tuple of:
+        - X_batch: Array of shape (batch_size, d_1, ..., d_k)
+        - y_batch: Array of shape (batch_size,)
+        """
+        if self.batch_index == self.num_batches:
+            self.set_epoch(self.epoch + 1)
+        batch = self._batch(self.batch_index)
+        self.batch_index += 1
+        return batch
+
+    def _new_epoch(self):
+        pass
+
+    def _batch(self, i):
+        raise NotImplementedError
+
+
+class RandomSampler(Sampler):
+    """
+    Samples every minibatch independently with replacement, like the Solver
+    does by default, but from a resumable random stream.
+    """
+
+    def _batch(self, i):
+        batch_mask = self.rng.choice(self.X.shape[0], self.batch_size)
+        return self.X[batch_mask], self.y[batch_mask]
+
+
+class PermutationSampler(Sampler):
+    """
+    Samples without replacement: each epoch walks a new random permutation of
+    the training set, so every example is seen once per epoch (the last
+    N % batch_size of the permutation are dropped). The indices of each batch
+    are sorted before the gather so that it reads X in memory order.
+    """
+
+    def _new_epoch(self):
+        self.permutation = self.rng.permutation(self.X.shape[0])
+
+    def _batch(self, i):
+        batch_mask = self.permutation[i * self.batch_size:(i + 1) * self.batch_size]
+        batch_mask = np.sort(batch_mask)
+        return self.X[batch_mask], self.y[batch_mask]
+
+
+class SliceSampler(Sampler):
+    """
+    Samples without replacement like PermutationSampler, but shuffles a copy
+    of the whole training set once per epoch and returns each minibatch as a
+    contiguous slice of that copy, so that no step pays for a gather.
+
+    This holds a second copy of X, and the batches are views into it that are
+    overwritten at the next epoch; models must not modify X_batch in place.
+    """
+
+    def __init__(self, X, y, batch_size, seed=None):
+        self.X_shuffled = np.empty_like(X)
+        self.y_shuffled = np.empty_like(y)
+        super(SliceSampler, self).__init__(X, y, batch_size, seed)
+
+    def _new_epoch(self):
+        permutation = self.rng.permutation(self.X.shape[0])
+        np.take(self.X, permutation, axis=0, out=self.X_shuffled)
+        np.take(self.y, permutation, out=self.y_shuffled)
+
+    def _batch(self, i):
+        batch = slice(i * self.batch_size, (i + 1) * self.batch_size)
+        return self.X_shuffled[batch], self.y_shuffled[batch]
+
+
+class StratifiedSampler(Sampler):
+    """
+    Samples minibatches that contain every class in a fixed proportion:
+    either its frequency in the training set, or if balanced is True the
+    same number of examples of every class, which oversamples rare classes.
+    Within a class, examples are drawn without replacement from a permutation
+    that is redrawn whenever it runs out.
+    """
+
+    def __init__(self, X, y, batch_size, seed=None, balanced=False):
+        self.classes, y_idx = np.unique(y, return_inverse=True)
+        self.class_indices = [np.flatnonzero(y_idx == c)
+                              for c in range(len(self.classes))]
+        self.balanced = balanced
+
+        # Number of examples of each class per batch; with balanced, the
+        # batch_size % C left over are given to random classes in each batch
+        C = len(self.classes)
+        if balanced:
+            self.class_counts = np.full(C, batch_size // C, dtype=int)
+        else:
+            quota = batch_size * np.bincount(y_idx, minlength=C) / len(y)
+            self.class_counts = np.floor(quota).astype(int)
+            remainder = batch_size - self.class_counts.sum()
+            self.class_counts[np.argsort(self.class_counts - quota)[:remainder]] += 1
+        super(StratifiedSampler, self).__init__(X, y, batch_size, seed)
+
+    def _new_epoch(self):
+        self.permutations = [self.rng.permutation(idx) for idx in self.class_indices]
+        self.positions = [0] * len(self.class_indices)
+
+    def get_state(self):
+        state = super(StratifiedSampler, self).get_state()
+        state['permutations'] = list(self.permutations)
+        state['positions'] = list(self.positions)
+        return state
+
+    def set_state(self, state):
+        super(StratifiedSampler, self).set_state(state)
+        self.permutations = list(state['permutations'])
+        self.positions = list(state['positions'])
+
+    def _take(self, c, k):
+        """
+        Returns the next k indices of examples of class c.
+        """
+        if k > len(self.class_indices[c]):
+            return self.rng.choice(self.class_indices[c], k)
+        if self.positions[c] + k > len(self.permutations[c]):
+            self.permutations[c] = self.rng.permutation(self.class_indices[c])
+            self.positions[c] = 0
+        start = self.positions[c]
+        self.positions[c] += k
+        return self.permutations[c][start:start + k]
+
+    def _batch(self, i):
+        counts = self.class_counts
+        remainder = self.batch_size - counts.sum()
+        if remainder > 0:
+            counts = counts.copy()
+            counts[self.rng.choice(len(counts), remainder, replace=False)] += 1
+        batch_mask = np.concatenate([self._take(c, k) for c, k in enumerate(counts)])
+        batch_mask.sort()
+        return self.X[batch_mask], self.y[batch_mask]
+
+
+# Samplers that the Solver can construct by name
+SAMPLERS = {
+    'random': RandomSampler,
+    'permutation': PermutationSampler,
+    'slice': SliceSampler,
+    'stratified': StratifiedSampler,
+}
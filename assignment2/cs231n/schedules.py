@@ -0,0 +1,236 @@
+from __future__ import division
+from builtins import object
+import math
+
+"""
+This file implements learning rate schedules for the Solver. A schedule is
+evaluated once per training iteration and returns the learning rate for that
+iteration, which the Solver hands to every update rule in place of the
+'learning_rate' of its config. Each schedule has the same interface:
+
+class Schedule(LRSchedule):
+
+  def __call__(self, t):
+    Returns the learning rate for iteration t, counting from 0.
+
+  def observe(self, metric):
+    Called by the Solver with the validation accuracy every time it checks
+    accuracy; only used by schedules that react to progress.
+
+The state of a schedule is its attributes; get_state and set_state save and
+restore them for a checkpoint.
+
+Iterations are minibatch updates, not epochs; a schedule that should change
+once per epoch takes its step sizes in multiples of the number of iterations
+per epoch, num_train // batch_size.
+"""
+
+
+class LRSchedule(object):
+    """
+    Base class for learning rate schedules.
+    """
+
+    def __call__(self, t):
+        raise NotImplementedError
+
+    def observe(self, metric):
+        pass
+
+    def get_state(self):
+        """
+        Returns the attributes of the schedule as a dictionary, with those
+        of wrapped schedules as nested dictionaries.
+        """
+        state = {}
+        for k, v in vars(self).items():
+            state[k] = v.get_state() if isinstance(v, LRSchedule) else v
+        return state
+
+    def set_state(self, state):
+        """
+        Restore attributes returned by get_state.
+        """
+        for k, v in state.items():
+            current = getattr(self, k, None)
+            if isinstance(current, LRSchedule):
+                current.set_state(v)
+            else:
+                setattr(self, k, v)
+
+
+class ConstantLR(LRSchedule):
+    """
+    A constant learning rate.
+    """
+
+    def __init__(self, learning_rate):
+        self.learning_rate = learning_rate
+
+    def __call__(self, t):
+        return self.learning_rate
+
+
+class StepLR(LRSchedule):
+    """
+    Multiplies the learning rate by gamma every step_size iterations, or at
+    each of the given milestones.
+
+    Inputs:
+    - learning_rate: Initial learning rate
+    - step_size: Number of iterations between decays
+    - gamma: Scalar decay factor
+    - milestones: If not None, a sorted list of iterations at which to decay,
+      used instead of step_size
+    """
+
+    def __init__(self, learning_rate, step_size=None, gamma=0.1, milestones=None):
+        if (step_size is None) == (milestones is None):
+            raise ValueError('StepLR needs exactly one of step_size and milestones')
+        self.learning_rate = learning_rate
+        self.step_size = step_size
+        self.gamma = gamma
+        self.milestones = milestones
+
+    def __call__(self, t):
+        if self.milestones is None:
+            num_decays = t // self.step_size
+        else:
+            num_decays = sum(1 for m in self.milestones if t >= m)
+        return self.learning_rate * self.gamma ** num_decays
+
+
+class ExponentialLR(LRSchedule):
+    """
+    Decays the learning rate smoothly by a factor of gamma every step_size
+    iterations, e.g. with step_size equal to the iterations per epoch this is
+    the per-iteration version of the Solver's lr_decay.
+    """
+
+    def __init__(self, learning_rate, gamma, step_size=1):
+        self.learning_rate = learning_rate
+        self.gamma = gamma
+        self.step_size = step_size
+
+    def __call__(self, t):
+        return self.learning_rate * self.gamma ** (t / self.step_size)
+
+
+class CosineLR(LRSchedule):
+    """
+    Anneals the learning rate from learning_rate to min_lr along half a cosine
+    over num_iterations, and holds it at min_lr afterwards.
+    """
+
+    def __init__(self, learning_rate, num_iterations, min_lr=0.0):
+        self.learning_rate = learning_rate
+        self.num_iterations = num_iterations
+        self.min_lr = min_lr
+
+    def __call__(self, t):
+        progress = min(t, self.num_iterations) / self.num_iterations
+        return _cosine(self.learning_rate, self.min_lr, progress)
+
+
+class WarmupLR(LRSchedule):
+    """
+    Wraps another schedule with a linear warmup: over the first warmup_iters
+    iterations the learning rate rises from start_factor times the initial
+    rate of schedule to that rate, after which schedule runs as if training
+    started at the end of the warmup. Large minibatches usually need a
+    warmup of a few epochs before they can use a large learning rate.
+
+    Inputs:
+    - schedule: An LRSchedule
+    - warmup_iters: Number of warmup iterations
+    - start_factor: Fraction of the initial learning rate to start from
+    """
+
+    def __init__(self, schedule, warmup_iters, start_factor=0.0):
+        self.schedule = schedule
+        self.warmup_iters = warmup_iters
+        self.start_factor = start_factor
+
+    def __call__(self, t):
+        if t >= self.warmup_iters:
+            return self.schedule(t - self.warmup_iters)
+        progress = (t + 1) / self.warmup_iters
+        factor = self.start_factor + (1 - self.start_factor) * progress
+        return factor * self.schedule(0)
+
+    def observe(self, metric):
+        self.schedule.observe(metric)
+
+
+class OneCycleLR(LRSchedule):
+    """
+    The one-cycle policy: the learning rate rises from max_lr / div_factor to
+    max_lr over the first pct_start of num_iterations and then anneals to
+    max_lr / (div_factor * final_div_factor), both phases along a cosine.
+    """
+
+    def __init__(self, max_lr, num_iterations, pct_start=0.3, div_factor=25.0,
+                 final_div_factor=1e4):
+        self.max_lr = max_lr
+        self.num_iterations = num_iterations
+        self.warmup_iters = max(int(pct_start * num_iterations), 1)
+        self.initial_lr = max_lr / div_factor
+        self.min_lr = self.initial_lr / final_div_factor
+
+    def __call__(self, t):
+        if t < self.warmup_iters:
+            progress = t / self.warmup_iters
+            return _cosine(self.initial_lr, self.max_lr, progress)
+        anneal_iters = max(self.num_iterations - 1 - self.warmup_iters, 1)
+        progress = min(t - self.warmup_iters, anneal_iters) / anneal_iters
+        return _cosine(self.max_lr, self.min_lr, progress)
+
+
+class ReduceLROnPlateau(LRSchedule):
+    """
+    Multiplies the learning rate by factor whenever the observed metric, the
+    validation accuracy by default, has not improved on its best value by
+    more than threshold for more than patience consecutive observations.
+
+    Inputs:
+    - learning_rate: Initial learning rate
+    - factor: Scalar decay factor
+    - patience: Number of observations without improvement to wait
+    - threshold: Minimum change that counts as an improvement
+    - mode: 'max' if larger metrics are better, 'min' if smaller are
+    - min_lr: Lower bound on the learning rate
+    """
+
+    def __init__(self, learning_rate, factor=0.1, patience=3, threshold=1e-4,
+                 mode='max', min_lr=0.0):
+        if mode not in ('max', 'min'):
+            raise ValueError('Unrecognized mode "%s"' % mode)
+        self.learning_rate = learning_rate
+        self.factor = factor
+        self.patience = patience
+        self.threshold = threshold
+        self.mode = mode
+        self.min_lr = min_lr
+        self.best = None
+        self.num_bad = 0
+
+    def __call__(self, t):
+        return self.learning_rate
+
+    def observe(self, metric):
+        sign = 1 if self.mode == 'max' else -1
+        if self.best is None or sign * (metric - self.best) > self.threshold:
+            self.best = metric
+            self.num_bad = 0
+            return
+        self.num_bad += 1
+        if self.num_bad > self.patience:
+            self.learning_rate = max(self.learning_rate * self.factor, self.min_lr)
+            self.num_bad = 0
+
+
+def _cosine(start, end, progress):
+    """
+    Interpolates from start to end along half a cosine, progress in [0, 1].
+    """
+    return end + 0.5 * (start - end) * (1 + math.cos(math.pi * progress))
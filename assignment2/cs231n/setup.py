@@ -1,11 +1,23 @@
+import sys
 from distutils.core import setup
 from distutils.extension import Extension
 from Cython.Build import cythonize
 import numpy
 
+# OpenMP flags for the multi-threaded im2col / col2im kernels. Apple's clang
+# does not ship OpenMP, so on macOS the parallel kernels build and run serially.
+if sys.platform == 'win32':
+    openmp_args = ['/openmp']
+elif sys.platform == 'darwin':
+    openmp_args = []
+else:
+    openmp_args = ['-fopenmp']
+
 extensions = [
   Extension('im2col_cython', ['im2col_cython.pyx'],
-            include_dirs = [numpy.get_include()]
+            include_dirs = [numpy.get_include()],
+            extra_compile_args = openmp_args,
+            extra_link_args = openmp_args,
   ),
 ]
 
@@ -4,11 +4,17 @@ standard_library.install_aliases()
 from builtins import range
 from builtins import object
 import os
-import pickle as pickle
 
 import numpy as np
 
 from cs231n import optim
+from cs231n.checkpoint import CheckpointWriter, load_checkpoint
+from cs231n.layers import get_rng_state, rng_from_state
+from cs231n.param_store import ParamStore, ParamShadow
+from cs231n.prefetch import BatchPrefetcher
+from cs231n.samplers import SAMPLERS
+from cs231n.evaluation import evaluate, AsyncEvaluator
+from cs231n.parallel import DataParallel
 
 
 class Solver(object):
@@ -27,7 +33,8 @@ class Solver(object):
     procedure and train the model.
 
     After the train() method returns, model.params will contain the parameters
-    that performed best on the validation set over the course of training.
+    that performed best on the validation set over the course of training
+    (or their moving average, see ema_decay).
     In addition, the instance variable solver.loss_history will contain a list
     of all losses encountered during training and the instance variables
     solver.train_acc_history and solver.val_acc_history will be lists of the
@@ -56,7 +63,8 @@ class Solver(object):
     A Solver works on a model object that must conform to the following API:
 
     - model.params must be a dictionary mapping string parameter names to numpy
-      arrays containing parameter values.
+      arrays containing parameter values. If it is a ParamStore, each update
+      runs once over the whole parameter buffer with a single optim config.
 
     - model.loss(X, y) must be a function that computes training-time loss and
       gradients, and test-time classification scores, with the following inputs
@@ -79,6 +87,10 @@ class Solver(object):
         names to gradients of the loss with respect to those parameters.
     """
 
+    # Attributes of the model holding a parameter dictionary whose 'rng'
+    # generator is saved in checkpoints, see layers.dropout_forward
+    _RNG_PARAMS = ('dropout_param', 'loss_param')
+
     def __init__(self, model, data, **kwargs):
         """
         Construct a new Solver instance.
@@ -100,6 +112,10 @@ class Solver(object):
           'learning_rate' parameter so that should always be present.
         - lr_decay: A scalar for learning rate decay; after each epoch the
           learning rate is multiplied by this value.
+        - lr_schedule: An LRSchedule from schedules.py giving the learning
+          rate of every iteration; it overrides the learning_rate in
+          optim_config and cannot be combined with lr_decay. The schedule
+          observes the validation accuracy each time it is checked.
         - batch_size: Size of minibatches used to compute loss and gradient
           during training.
         - num_epochs: The number of epochs to run for during training.
@@ -111,8 +127,48 @@ class Solver(object):
           accuracy; default is 1000; set to None to use entire training set.
         - num_val_samples: Number of validation samples to use to check val
           accuracy; default is None, which uses the entire validation set.
-        - checkpoint_name: If not None, then save model checkpoints here every
-          epoch.
+        - checkpoint_name: If not None, then save checkpoints here every
+          epoch, in the background; see _save_checkpoint and resume.
+        - checkpoint_keep: If not None, keep only this many of the most
+          recent checkpoints on disk.
+        - best_params_file: If not None, keep the copy of the best parameters
+          in a memory-mapped file of this name rather than in memory.
+        - ema_decay: If not None, also keep an exponential moving average of
+          the parameters with this decay, e.g. 0.999, updated after every
+          step, and put it into the model at the end of training instead of
+          the parameters with the best validation accuracy.
+        - num_workers: If greater than 1, compute the loss and gradients of
+          each minibatch on this many worker processes, each taking a shard of
+          the minibatch; see parallel.py. The update is still made once, in
+          this process. Default is None, which trains in this process. The
+          batchnorm running averages are those computed by the first worker
+          on its shard only, not over the whole minibatch. The workers are
+          forked at the start of train(), before it starts any thread.
+        - loss_scale: If not None, multiply the loss by this factor before the
+          backward pass and divide the gradients by it before the update, so
+          that small gradients survive activations cached in float16. Pass
+          'dynamic' to start at 2 ** 15, halve the scale and skip the update
+          whenever the gradients overflow, and double it after
+          loss_scale_window overflow-free steps. The model must have a
+          loss_scale attribute that its loss() applies.
+        - loss_scale_window: See loss_scale; default is 1000.
+        - prefetch: If not None, gather minibatches on a background thread
+          while the model computes. Either the number of batches to prepare
+          ahead, or a BatchPrefetcher over the training data to use instead,
+          e.g. one with several workers, a dtype or an augmentation
+          transform. Prefetched batches are sampled from the prefetcher's
+          own random stream rather than np.random.
+        - sampler: How minibatches are drawn. By default each one is sampled
+          with replacement using np.random. Otherwise the name of a sampler in
+          samplers.py ('random', 'permutation', 'slice' or 'stratified'), or a
+          Sampler over the training data. Its position is saved in
+          checkpoints, so a resumed run sees the same batches. Cannot be
+          combined with prefetch.
+        - async_eval: If True, the accuracy checks run on a worker thread, on
+          a copy of the model taken when the check is due, while training
+          continues. Their results are recorded as they arrive; all of them
+          are recorded before train() returns. The worker never uses
+          np.random, so training draws the same random numbers either way.
         """
         self.model = model
         self.X_train = data['X_train']
@@ -124,15 +180,27 @@ class Solver(object):
         self.update_rule = kwargs.pop('update_rule', 'sgd')
         self.optim_config = kwargs.pop('optim_config', {})
         self.lr_decay = kwargs.pop('lr_decay', 1.0)
+        self.lr_schedule = kwargs.pop('lr_schedule', None)
         self.batch_size = kwargs.pop('batch_size', 100)
         self.num_epochs = kwargs.pop('num_epochs', 10)
         self.num_train_samples = kwargs.pop('num_train_samples', 1000)
         self.num_val_samples = kwargs.pop('num_val_samples', None)
 
         self.checkpoint_name = kwargs.pop('checkpoint_name', None)
+        self.checkpoint_keep = kwargs.pop('checkpoint_keep', None)
+        self.best_params_file = kwargs.pop('best_params_file', None)
+        self.ema_decay = kwargs.pop('ema_decay', None)
+        self.num_workers = kwargs.pop('num_workers', None)
         self.print_every = kwargs.pop('print_every', 10)
         self.verbose = kwargs.pop('verbose', True)
 
+        self.loss_scale = kwargs.pop('loss_scale', None)
+        self.loss_scale_window = kwargs.pop('loss_scale_window', 1000)
+
+        self.prefetch = kwargs.pop('prefetch', None)
+        self.sampler = kwargs.pop('sampler', None)
+        self.async_eval = kwargs.pop('async_eval', False)
+
         # Throw an error if there are extra keyword arguments
         if len(kwargs) > 0:
             extra = ', '.join('"%s"' % k for k in list(kwargs.keys()))
@@ -144,6 +212,40 @@ class Solver(object):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        if self.lr_schedule is not None and self.lr_decay != 1.0:
+            raise ValueError('lr_decay cannot be combined with lr_schedule')
+
+        if self.loss_scale is not None and not hasattr(self.model, 'loss_scale'):
+            raise ValueError('loss_scale needs a model with a loss_scale attribute')
+
+        if isinstance(self.sampler, str):
+            if self.sampler not in SAMPLERS:
+                raise ValueError('Invalid sampler "%s"' % self.sampler)
+            self.sampler = SAMPLERS[self.sampler](self.X_train, self.y_train,
+                                                  self.batch_size)
+        if self.sampler is not None and self.prefetch is not None:
+            raise ValueError('sampler cannot be combined with prefetch')
+
+        self.prefetcher = None
+        if isinstance(self.prefetch, BatchPrefetcher):
+            self.prefetcher = self.prefetch
+        elif self.prefetch is not None:
+            self.prefetcher = BatchPrefetcher(self.X_train, self.y_train,
+                                              self.batch_size,
+                                              num_batches=self.prefetch)
+
+        self.checkpoint_writer = None
+        if self.checkpoint_name is not None:
+            self.checkpoint_writer = CheckpointWriter(keep_last=self.checkpoint_keep)
+
+        self.parallel = None
+        if self.num_workers is not None and self.num_workers > 1:
+            self.parallel = DataParallel(self.model, self.num_workers)
+
+        self.evaluator = None
+        if self.async_eval:
+            self.evaluator = AsyncEvaluator(self._evaluate_snapshot)
+
         self._reset()
 
 
@@ -154,17 +256,40 @@ class Solver(object):
         """
         # Set up some variables for book-keeping
         self.epoch = 0
+        self.iteration = 0
+        self._resume_iteration = 0
         self.best_val_acc = 0
         self.best_params = {}
         self.loss_history = []
         self.train_acc_history = []
         self.val_acc_history = []
 
-        # Make a deep copy of the optim_config for each parameter
+        # Preallocated copies of the best parameters, which best_params views
+        # once there are any, and of their moving average
+        self.best_shadow = ParamShadow(self.model.params, self.best_params_file)
+        self.ema_shadow = None
+        if self.ema_decay is not None:
+            self.ema_shadow = ParamShadow(self.model.params)
+            self.ema_shadow.copy_from(self.model.params)
+
+        # Loss scaling state
+        if self.loss_scale == 'dynamic':
+            self.current_loss_scale = 2.0 ** 15
+        else:
+            self.current_loss_scale = self.loss_scale
+        self.good_steps = 0
+        self.skipped_steps = 0
+
+        # Make a deep copy of the optim_config for each parameter. A model
+        # whose params are a ParamStore is updated in one step over the whole
+        # buffer, so it gets a single config.
         self.optim_configs = {}
-        for p in self.model.params:
-            d = {k: v for k, v in self.optim_config.items()}
-            self.optim_configs[p] = d
+        if isinstance(self.model.params, ParamStore):
+            self.optim_configs['params'] = dict(self.optim_config)
+        else:
+            for p in self.model.params:
+                d = {k: v for k, v in self.optim_config.items()}
+                self.optim_configs[p] = d
 
 
     def _step(self):
@@ -173,96 +298,270 @@ class Solver(object):
         be called manually.
         """
         # Make a minibatch of training data
-        num_train = self.X_train.shape[0]
-        batch_mask = np.random.choice(num_train, self.batch_size)
-        X_batch = self.X_train[batch_mask]
-        y_batch = self.y_train[batch_mask]
+        if self.prefetcher is not None:
+            X_batch, y_batch = next(self.prefetcher)
+        elif self.sampler is not None:
+            X_batch, y_batch = next(self.sampler)
+        else:
+            num_train = self.X_train.shape[0]
+            batch_mask = np.random.choice(num_train, self.batch_size)
+            X_batch = self.X_train[batch_mask]
+            y_batch = self.y_train[batch_mask]
 
         # Compute loss and gradient
-        loss, grads = self.model.loss(X_batch, y_batch)
+        if self.current_loss_scale is not None:
+            self.model.loss_scale = self.current_loss_scale
+        if self.parallel is not None:
+            loss, grads = self.parallel.loss(X_batch, y_batch)
+        else:
+            loss, grads = self.model.loss(X_batch, y_batch)
         self.loss_history.append(loss)
 
+        learning_rate = None
+        if self.lr_schedule is not None:
+            learning_rate = self.lr_schedule(self.iteration)
+        self.iteration += 1
+
+        if self.current_loss_scale is not None and not self._unscale_grads(grads):
+            return
+
         # Perform a parameter update
-        for p, w in self.model.params.items():
-            dw = grads[p]
-            config = self.optim_configs[p]
-            next_w, next_config = self.update_rule(w, dw, config)
-            self.model.params[p] = next_w
-            self.optim_configs[p] = next_config
+        optim.multi_tensor_update(self.update_rule, self.model.params, grads,
+                                  self.optim_configs, learning_rate)
+        if self.ema_shadow is not None:
+            self.ema_shadow.update_average(self.model.params, self.ema_decay)
+
+
+    def _unscale_grads(self, grads):
+        """
+        Divide the gradients by the loss scale they were computed with, and
+        adjust a dynamic loss scale. Returns False if the gradients overflowed,
+        in which case the update must be skipped.
+        """
+        scale = self.current_loss_scale
+        finite = all(np.isfinite(g).all() for g in grads.values())
+        if not finite:
+            self.skipped_steps += 1
+            if self.loss_scale == 'dynamic':
+                self.current_loss_scale = scale / 2
+                self.good_steps = 0
+            return False
+
+        if self.loss_scale == 'dynamic':
+            self.good_steps += 1
+            if self.good_steps == self.loss_scale_window:
+                self.current_loss_scale = scale * 2
+                self.good_steps = 0
+
+        for g in grads.values():
+            g /= scale
+        return True
 
 
     def _save_checkpoint(self):
+        """
+        Queue a checkpoint of the training state, to be written to
+        checkpoint_name_epoch_<epoch>.npz by the background writer. See
+        checkpoint.py for the format and resume() to continue from it.
+        """
         if self.checkpoint_name is None: return
-        checkpoint = {
-          'model': self.model,
-          'update_rule': self.update_rule,
+        filename = '%s_epoch_%d.npz' % (self.checkpoint_name, self.epoch)
+        if self.verbose:
+            print('Saving checkpoint to "%s"' % filename)
+        self.checkpoint_writer.save(self._get_state(), filename)
+
+
+    def _get_state(self):
+        """
+        Returns everything needed to continue training exactly where it is:
+        the parameters, the optimizer state, the batchnorm running averages,
+        the book-keeping of train(), and the random state of np.random, of
+        the sampler, of the learning rate schedule and of the generators that
+        the model's dropout and sampled loss draw from. The arrays are
+        references; CheckpointWriter copies them.
+        """
+        state = {
+          'params': dict(self.model.params),
+          'optim_configs': self.optim_configs,
+          'update_rule': self.update_rule.__name__,
           'lr_decay': self.lr_decay,
-          'optim_config': self.optim_config,
           'batch_size': self.batch_size,
           'num_train_samples': self.num_train_samples,
           'num_val_samples': self.num_val_samples,
           'epoch': self.epoch,
+          'iteration': self.iteration,
+          'best_val_acc': self.best_val_acc,
+          'best_params': self.best_params,
           'loss_history': self.loss_history,
           'train_acc_history': self.train_acc_history,
           'val_acc_history': self.val_acc_history,
+          'current_loss_scale': self.current_loss_scale,
+          'good_steps': self.good_steps,
+          'skipped_steps': self.skipped_steps,
+          'random_state': list(np.random.get_state()),
         }
-        filename = '%s_epoch_%d.pkl' % (self.checkpoint_name, self.epoch)
-        if self.verbose:
-            print('Saving checkpoint to "%s"' % filename)
-        with open(filename, 'wb') as f:
-            pickle.dump(checkpoint, f)
-
-
-    def check_accuracy(self, X, y, num_samples=None, batch_size=100):
+        if hasattr(self.model, 'bn_params'):
+            state['bn_params'] = self.model.bn_params
+        if self.sampler is not None:
+            state['sampler'] = self.sampler.get_state()
+        if self.lr_schedule is not None:
+            state['lr_schedule'] = self.lr_schedule.get_state()
+        if self.ema_shadow is not None:
+            state['ema_params'] = self.ema_shadow.params
+        state['rng_states'] = {}
+        for name in self._RNG_PARAMS:
+            rng = (getattr(self.model, name, None) or {}).get('rng')
+            if rng is not None:
+                state['rng_states'][name] = get_rng_state(rng)
+        return state
+
+
+    def resume(self, filename):
+        """
+        Restore the training state from a checkpoint written by this Solver,
+        or one with the same model architecture and options, so that calling
+        train() continues the interrupted run; the remaining iterations take
+        the same minibatches, dropout masks and updates. This is exact unless
+        the run uses prefetch or async_eval.
+
+        With num_workers, train() forks the workers again with the restored
+        parameters. Forking is only safe while this process runs no other
+        threads, so resume and train from the main thread, not from e.g. a
+        callback of an evaluator or prefetcher.
+        """
+        state = load_checkpoint(filename)
+        if isinstance(self.model.params, ParamStore):
+            self.model.params.update(state['params'])
+        else:
+            self.model.params = state['params']
+        self.optim_configs = state['optim_configs']
+        if 'bn_params' in state:
+            self.model.bn_params = state['bn_params']
+
+        self.epoch = state['epoch']
+        self.iteration = state['iteration']
+        # Checkpoints are written after a step, so a multiple of the
+        # iterations per call means the interrupted call had finished.
+        if self.iteration > 0:
+            self._resume_iteration = (self.iteration - 1) % self._num_iterations() + 1
+        self.best_val_acc = state['best_val_acc']
+        self.best_params = {}
+        if state['best_params']:
+            self.best_shadow.copy_from(state['best_params'])
+            self.best_params = self.best_shadow.params
+        if self.ema_shadow is not None:
+            self.ema_shadow.copy_from(state['ema_params'])
+        self.loss_history = state['loss_history']
+        self.train_acc_history = state['train_acc_history']
+        self.val_acc_history = state['val_acc_history']
+        self.current_loss_scale = state['current_loss_scale']
+        self.good_steps = state['good_steps']
+        self.skipped_steps = state['skipped_steps']
+        np.random.set_state(tuple(state['random_state']))
+        if self.sampler is not None:
+            self.sampler.set_state(state['sampler'])
+        if self.lr_schedule is not None:
+            self.lr_schedule.set_state(state['lr_schedule'])
+        for name, rng_state in state.get('rng_states', {}).items():
+            getattr(self.model, name)['rng'] = rng_from_state(rng_state)
+
+
+    def check_accuracy(self, X, y, num_samples=None, batch_size=100, model=None,
+                       rng=None):
         """
         Check accuracy of the model on the provided data.
 
         Inputs:
         - X: Array of data, of shape (N, d_1, ..., d_k)
         - y: Array of labels, of shape (N,)
-        - num_samples: If not None, subsample the data and only test the model
-          on num_samples datapoints.
+        - num_samples: If not None, subsample the data without replacement and
+          only test the model on num_samples datapoints.
         - batch_size: Split X and y into batches of this size to avoid using
           too much memory.
+        - model: The model to test; default is self.model.
+        - rng: RandomState used for subsampling; default is np.random.
 
         Returns:
         - acc: Scalar giving the fraction of instances that were correctly
           classified by the model.
+
+        See evaluation.evaluate for top-k accuracy, the confusion matrix and
+        the loss.
         """
+        if model is None:
+            model = self.model
+        results = evaluate(model, X, y, batch_size=batch_size,
+                           num_samples=num_samples, rng=rng)
+        return results['acc']
+
 
-        # Maybe subsample the data
-        N = X.shape[0]
-        if num_samples is not None and N > num_samples:
-            mask = np.random.choice(N, num_samples)
-            N = num_samples
-            X = X[mask]
-            y = y[mask]
-
-        # Compute predictions in batches
-        num_batches = N // batch_size
-        if N % batch_size != 0:
-            num_batches += 1
-        y_pred = []
-        for i in range(num_batches):
-            start = i * batch_size
-            end = (i + 1) * batch_size
-            scores = self.model.loss(X[start:end])
-            y_pred.append(np.argmax(scores, axis=1))
-        y_pred = np.hstack(y_pred)
-        acc = np.mean(y_pred == y)
-
-        return acc
+    def _evaluate_snapshot(self, model, epoch, seed):
+        """
+        Check train and val accuracy of a copy of the model; this runs on the
+        worker thread when async_eval is set. The subsamples are drawn from a
+        RandomState seeded with seed, which the training thread draws from
+        np.random, so that np.random is never used off the training thread
+        and async and sync runs train identically.
+        """
+        rng = np.random.RandomState(seed)
+        train_acc = self.check_accuracy(self.X_train, self.y_train,
+            num_samples=self.num_train_samples, model=model, rng=rng)
+        val_acc = self.check_accuracy(self.X_val, self.y_val,
+            num_samples=self.num_val_samples, model=model, rng=rng)
+        return train_acc, val_acc, epoch, model.params
+
+
+    def _record_accuracy(self, train_acc, val_acc, epoch, params):
+        """
+        Record the accuracies of params, taken at the given epoch.
+        """
+        self.train_acc_history.append(train_acc)
+        self.val_acc_history.append(val_acc)
+        if self.lr_schedule is not None:
+            self.lr_schedule.observe(val_acc)
+
+        if self.verbose:
+            print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
+                   epoch, self.num_epochs, train_acc, val_acc))
+
+        # Keep track of the best model
+        if val_acc > self.best_val_acc:
+            self.best_val_acc = val_acc
+            self.best_shadow.copy_from(params)
+            self.best_params = self.best_shadow.params
+
+
+    def _num_iterations(self):
+        num_train = self.X_train.shape[0]
+        return self.num_epochs * max(num_train // self.batch_size, 1)
 
 
     def train(self):
         """
         Run optimization to train the model.
+
+        Each call runs num_epochs more epochs, except the first call after
+        resume(), which only runs the iterations that the interrupted call
+        had left.
         """
         num_train = self.X_train.shape[0]
         iterations_per_epoch = max(num_train // self.batch_size, 1)
-        num_iterations = self.num_epochs * iterations_per_epoch
-
-        for t in range(num_iterations):
+        num_iterations = self._num_iterations()
+        start, self._resume_iteration = self._resume_iteration, 0
+
+        # Fork the workers before starting any thread: a child forked while
+        # another thread holds a lock, e.g. inside a queue or malloc, would
+        # inherit the lock held forever.
+        if self.parallel is not None:
+            x_dtype = getattr(self.prefetcher, 'dtype', self.X_train.dtype)
+            self.parallel.start(self.batch_size, self.X_train.shape[1:],
+                                x_dtype, self.y_train.dtype)
+        if self.prefetcher is not None:
+            self.prefetcher.start()
+        if self.sampler is not None and self.iteration == 0:
+            self.sampler.set_epoch(0)
+
+        for t in range(start, num_iterations):
             self._step()
 
             # Maybe print training loss
@@ -283,24 +582,31 @@ class Solver(object):
             first_it = (t == 0)
             last_it = (t == num_iterations - 1)
             if first_it or last_it or epoch_end:
-                train_acc = self.check_accuracy(self.X_train, self.y_train,
-                    num_samples=self.num_train_samples)
-                val_acc = self.check_accuracy(self.X_val, self.y_val,
-                    num_samples=self.num_val_samples)
-                self.train_acc_history.append(train_acc)
-                self.val_acc_history.append(val_acc)
+                seed = np.random.randint(2 ** 31)
+                if self.evaluator is not None:
+                    self.evaluator.submit(self.model, self.epoch, seed)
+                else:
+                    self._record_accuracy(*self._evaluate_snapshot(self.model,
+                                                                   self.epoch, seed))
                 self._save_checkpoint()
 
-                if self.verbose:
-                    print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
-                           self.epoch, self.num_epochs, train_acc, val_acc))
-
-                # Keep track of the best model
-                if val_acc > self.best_val_acc:
-                    self.best_val_acc = val_acc
-                    self.best_params = {}
-                    for k, v in self.model.params.items():
-                        self.best_params[k] = v.copy()
-
-        # At the end of training swap the best params into the model
-        self.model.params = self.best_params
+            if self.evaluator is not None:
+                for results in self.evaluator.poll():
+                    self._record_accuracy(*results)
+
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.parallel is not None:
+            self.parallel.close()
+        if self.evaluator is not None:
+            for results in self.evaluator.wait():
+                self._record_accuracy(*results)
+            self.evaluator.close()
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
+
+        # At the end of training copy the best params into the model
+        if self.ema_shadow is not None:
+            self.ema_shadow.copy_to(self.model.params)
+        elif self.best_params:
+            self.best_shadow.copy_to(self.model.params)
@@ -0,0 +1,8 @@
+"""
+Tests for the cs231n package. Run them from the assignment2 directory with
+
+python -m unittest discover -s cs231n/tests -t .
+
+or with pytest. Tests of the fast layers are skipped unless the Cython
+extension has been built (see fast_layers.py).
+"""
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cs231n.checkpoint import CheckpointWriter, load_checkpoint, save_checkpoint
+
+
+class CheckpointTest(unittest.TestCase):
+    """
+    Checks that the npz checkpoint format round-trips every kind of leaf, and
+    that CheckpointWriter snapshots its state, prunes old files and reports
+    write errors.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.state = {
+            'params': {'W1': np.arange(6.0).reshape(2, 3), 'b1': np.zeros(3, dtype=np.float16)},
+            'history': [0.5, 0.25],
+            'random_state': ('MT19937', np.arange(4, dtype=np.uint32), 2, 0, 0.0),
+            'slices': {'W1': slice(0, 6, None)},
+            'dtype': np.dtype(np.float32),
+            'step': np.int64(7),
+            'name': 'adam',
+            'best': None,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertStateEqual(self, state, expected):
+        self.assertEqual(sorted(state), sorted(expected))
+        for k in ('W1', 'b1'):
+            self.assertEqual(state['params'][k].dtype, expected['params'][k].dtype)
+            self.assertTrue(np.array_equal(state['params'][k], expected['params'][k]))
+        self.assertEqual(state['history'], expected['history'])
+        self.assertIsInstance(state['random_state'], tuple)
+        self.assertTrue(np.array_equal(state['random_state'][1], expected['random_state'][1]))
+        self.assertEqual(state['slices'], expected['slices'])
+        self.assertEqual(state['dtype'], expected['dtype'])
+        self.assertEqual(state['step'], 7)
+        self.assertEqual(state['name'], 'adam')
+        self.assertIsNone(state['best'])
+
+    def test_round_trip(self):
+        filename = os.path.join(self.tmpdir, 'checkpoint.npz')
+        save_checkpoint(self.state, filename)
+        self.assertEqual(os.listdir(self.tmpdir), ['checkpoint.npz'])
+        self.assertStateEqual(load_checkpoint(filename), self.state)
+
+    def test_writer(self):
+        writer = CheckpointWriter(keep_last=2)
+        for epoch in range(4):
+            writer.save(self.state, os.path.join(self.tmpdir, 'epoch_%d.npz' % epoch))
+            # The writer must have copied the state before this update
+            self.state['params']['W1'] += 1
+        writer.close()
+
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['epoch_2.npz', 'epoch_3.npz'])
+        state = load_checkpoint(os.path.join(self.tmpdir, 'epoch_3.npz'))
+        self.assertTrue(np.array_equal(state['params']['W1'], self.state['params']['W1'] - 1))
+
+    def test_writer_error(self):
+        writer = CheckpointWriter()
+        writer.save(self.state, os.path.join(self.tmpdir, 'missing', 'checkpoint.npz'))
+        with self.assertRaises(EnvironmentError):
+            writer.wait()
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
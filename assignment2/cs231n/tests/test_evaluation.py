@@ -0,0 +1,110 @@
+import unittest
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.evaluation import AsyncEvaluator, evaluate
+from cs231n.layers import softmax_loss
+from cs231n.solver import Solver
+
+
+class LinearModel(object):
+    """
+    A model whose loss(X) returns the scores X.dot(W).
+    """
+
+    def __init__(self, W):
+        self.params = {'W': W}
+
+    def loss(self, X, y=None):
+        return X.dot(self.params['W'])
+
+
+class EvaluateTest(unittest.TestCase):
+    """
+    Checks the streaming evaluate against the metrics computed on the scores
+    of the whole dataset at once, and the ordering and snapshots of
+    AsyncEvaluator.
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = rng.randn(230, 6)
+        self.y = rng.randint(5, size=230)
+        self.model = LinearModel(rng.randn(6, 5))
+
+    def test_matches_full_batch(self):
+        scores = self.model.loss(self.X)
+        y_pred = np.argmax(scores, axis=1)
+        top3 = np.argsort(-scores, axis=1)[:, :3]
+        expected_loss, _ = softmax_loss(scores, self.y)
+        for batch_size in (1, 50, 100, 1000):
+            results = evaluate(self.model, self.X, self.y, batch_size=batch_size,
+                               top_k=(1, 3), confusion=True, loss=True)
+            self.assertTrue(np.array_equal(results['y_pred'], y_pred))
+            self.assertEqual(results['acc'], np.mean(y_pred == self.y))
+            self.assertEqual(results['top3'], np.mean((top3 == self.y[:, None]).any(axis=1)))
+            self.assertEqual(results['confusion'].sum(), len(self.y))
+            self.assertTrue(np.array_equal(np.diag(results['confusion']),
+                                           np.bincount(self.y[y_pred == self.y], minlength=5)))
+            self.assertAlmostEqual(results['loss'], expected_loss, places=10)
+
+        results = evaluate(self.model, self.X)
+        self.assertTrue(np.array_equal(results['y_pred'], y_pred))
+        self.assertNotIn('acc', results)
+
+    def test_subsample(self):
+        results = evaluate(self.model, self.X, self.y, num_samples=70,
+                           rng=np.random.RandomState(1))
+        idx = results['idx']
+        self.assertEqual(len(idx), 70)
+        self.assertTrue((np.diff(idx) > 0).all())
+        y_pred = np.argmax(self.model.loss(self.X[idx]), axis=1)
+        self.assertTrue(np.array_equal(results['y_pred'], y_pred))
+
+        again = evaluate(self.model, self.X, self.y, num_samples=70,
+                         rng=np.random.RandomState(1))
+        self.assertTrue(np.array_equal(again['idx'], idx))
+
+    def test_async_evaluator(self):
+        evaluator = AsyncEvaluator(lambda model, i: (i, model.params['W'].sum()))
+        W = self.model.params['W']
+        expected = []
+        for i in range(3):
+            evaluator.submit(self.model, i)
+            expected.append((i, W.sum()))
+            # The queued snapshot must not see this update
+            W += 1
+        results = evaluator.poll() + evaluator.wait()
+        evaluator.close()
+        self.assertEqual([i for i, _ in results], [0, 1, 2])
+        for (i, total), (_, expected_total) in zip(results, expected):
+            self.assertAlmostEqual(total, expected_total)
+
+    def test_async_evaluator_error(self):
+        def fail(model):
+            raise RuntimeError('evaluation failed')
+        evaluator = AsyncEvaluator(fail)
+        evaluator.submit(self.model)
+        with self.assertRaises(RuntimeError):
+            evaluator.wait()
+        evaluator.close()
+
+    def test_solver_async_eval_matches_sync(self):
+        data = {'X_train': self.X, 'y_train': self.y,
+                'X_val': self.X[:50], 'y_val': self.y[:50]}
+        histories = []
+        for async_eval in (False, True):
+            np.random.seed(0)
+            model = FullyConnectedNet([10], input_dim=6, num_classes=5)
+            solver = Solver(model, data, num_epochs=2, batch_size=50,
+                            num_train_samples=100, async_eval=async_eval,
+                            verbose=False)
+            solver.train()
+            histories.append((solver.loss_history, solver.train_acc_history,
+                              solver.val_acc_history))
+        self.assertEqual(histories[0], histories[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
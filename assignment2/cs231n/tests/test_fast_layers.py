@@ -0,0 +1,240 @@
+import unittest
+
+import numpy as np
+
+from cs231n.fast_layers import *
+from cs231n.gradient_check import eval_numerical_gradient_array
+from cs231n.layers import conv_forward_naive
+from cs231n.layers import max_pool_forward_naive, max_pool_backward_naive
+from cs231n.layers import conv_forward_vectorized, conv_backward_vectorized
+
+try:
+    from cs231n import im2col_cython
+except ImportError:
+    im2col_cython = None
+
+
+def rel_error(x, y):
+    """ returns relative error """
+    return np.max(np.abs(x - y) / (np.maximum(1e-8, np.abs(x) + np.abs(y))))
+
+
+class ConvEngineTest(unittest.TestCase):
+    """
+    Checks ConvEngine against conv_forward_naive and numeric gradients, also
+    when it reuses the workspace of an earlier call.
+    """
+
+    conv_params = ({'stride': 1, 'pad': 1}, {'stride': 2, 'pad': 1},
+                   {'stride': 2, 'pad': 0})
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = rng.randn(2, 3, 7, 7)
+        self.w = rng.randn(4, 3, 3, 3)
+        self.b = rng.randn(4)
+        self.dout_rng = rng
+
+    def test_forward_matches_naive(self):
+        engine = ConvEngine()
+        for conv_param in self.conv_params:
+            expected, _ = conv_forward_naive(self.x, self.w, self.b, conv_param)
+            for _ in range(2):
+                out, _ = engine.forward(self.x, self.w, self.b, conv_param)
+                self.assertLess(rel_error(out, expected), 1e-10, conv_param)
+
+    def test_backward_matches_numeric_gradient(self):
+        engine = ConvEngine()
+        for conv_param in self.conv_params:
+            out, cache = engine.forward(self.x, self.w, self.b, conv_param)
+            dout = self.dout_rng.randn(*out.shape)
+            dx, dw, db = engine.backward(dout, cache)
+            dx, dw, db = dx.copy(), dw.copy(), db.copy()
+
+            # A fresh engine for the numeric gradients leaves the workspace
+            # of the cache above alone
+            forward = lambda x, w, b: ConvEngine().forward(x, w, b, conv_param)[0]
+            dx_num = eval_numerical_gradient_array(lambda x: forward(x, self.w, self.b), self.x, dout)
+            dw_num = eval_numerical_gradient_array(lambda w: forward(self.x, w, self.b), self.w, dout)
+            db_num = eval_numerical_gradient_array(lambda b: forward(self.x, self.w, b), self.b, dout)
+            self.assertLess(rel_error(dx, dx_num), 1e-7, conv_param)
+            self.assertLess(rel_error(dw, dw_num), 1e-7, conv_param)
+            self.assertLess(rel_error(db, db_num), 1e-7, conv_param)
+
+    def test_reuses_workspace(self):
+        engine = ConvEngine()
+        conv_param = self.conv_params[0]
+        out1, _ = engine.forward(self.x, self.w, self.b, conv_param)
+        out2, _ = engine.forward(self.x, self.w, self.b, conv_param)
+        self.assertIs(out1, out2)
+        self.assertEqual(len(engine.workspaces), 1)
+
+
+@unittest.skipIf(im2col_cython is None, 'the Cython extension is not built')
+class ConvBackendTest(unittest.TestCase):
+    """
+    Checks every backend in CONV_BACKENDS, run through conv_forward_fast and
+    conv_backward_fast, against conv_forward_vectorized for the shapes the
+    backend supports.
+    """
+
+    conv_params = ({'stride': 1, 'pad': 1}, {'stride': 2, 'pad': 1},
+                   {'stride': 2, 'pad': 0})
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = rng.randn(2, 3, 7, 7)
+        self.w = rng.randn(4, 3, 3, 3)
+        self.b = rng.randn(4)
+        self.rng = rng
+
+    def test_backends_match_vectorized(self):
+        for conv_param in self.conv_params:
+            expected, cache = conv_forward_vectorized(self.x, self.w, self.b, conv_param)
+            dout = self.rng.randn(*expected.shape)
+            expected_grads = conv_backward_vectorized(dout, cache)
+            for backend, (_, _, supports) in sorted(CONV_BACKENDS.items()):
+                if not supports(self.x.shape, self.w.shape, conv_param):
+                    continue
+                name = '%s with %s' % (backend, conv_param)
+                param = dict(conv_param, backend=backend)
+                out, cache = conv_forward_fast(self.x, self.w, self.b, param)
+                self.assertLess(rel_error(out, expected), 1e-8, name)
+                grads = conv_backward_fast(dout, cache)
+                for grad, expected_grad in zip(grads, expected_grads):
+                    self.assertLess(rel_error(grad, expected_grad), 1e-8, name)
+
+
+class StridedPoolTest(unittest.TestCase):
+    """
+    Checks the strided max and average pooling layers against
+    max_pool_forward_naive and numeric gradients, for tiling and overlapping
+    windows.
+    """
+
+    pool_params = ({'pool_height': 2, 'pool_width': 2, 'stride': 2},
+                   {'pool_height': 3, 'pool_width': 3, 'stride': 2},
+                   {'pool_height': 3, 'pool_width': 2, 'stride': 1})
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.x = self.rng.randn(2, 3, 7, 8)
+
+    def test_max_pool_forward_matches_naive(self):
+        for pool_param in self.pool_params:
+            expected, _ = max_pool_forward_naive(self.x, pool_param)
+            out, _ = max_pool_forward_strided(self.x, pool_param)
+            self.assertTrue(np.array_equal(out, expected), pool_param)
+
+    def test_max_pool_backward_matches_numeric_gradient(self):
+        for pool_param in self.pool_params:
+            out, cache = max_pool_forward_strided(self.x, pool_param)
+            dout = self.rng.randn(*out.shape)
+            dx = max_pool_backward_strided(dout, cache)
+            dx_num = eval_numerical_gradient_array(
+                lambda x: max_pool_forward_strided(x, pool_param)[0], self.x, dout)
+            self.assertLess(rel_error(dx, dx_num), 1e-8, pool_param)
+
+    def test_avg_pool_backward_matches_numeric_gradient(self):
+        for pool_param in self.pool_params:
+            out, cache = avg_pool_forward_strided(self.x, pool_param)
+            ph, pw, stride = pool_param['pool_height'], pool_param['pool_width'], pool_param['stride']
+            self.assertAlmostEqual(out[1, 2, 1, 1],
+                                   self.x[1, 2, stride:stride + ph, stride:stride + pw].mean())
+            dout = self.rng.randn(*out.shape)
+            dx = avg_pool_backward_strided(dout, cache)
+            dx_num = eval_numerical_gradient_array(
+                lambda x: avg_pool_forward_strided(x, pool_param)[0], self.x, dout)
+            self.assertLess(rel_error(dx, dx_num), 1e-8, pool_param)
+
+
+class CompactPoolCacheTest(unittest.TestCase):
+    """
+    Checks that max_pool_forward_reshape with compact_cache computes the same
+    gradients as the full cache, which splits ties, and with split_ties False
+    the same as max_pool_backward_naive, which routes ties to the first max.
+    """
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.dout = self.rng.randn(2, 3, 4, 4)
+
+    def backward(self, x, pool_param):
+        out, cache = max_pool_forward_reshape(x, pool_param)
+        return out, max_pool_backward_reshape(self.dout, cache)
+
+    def check(self, x, size):
+        pool_param = {'pool_height': size, 'pool_width': size, 'stride': size}
+        out, dx = self.backward(x, pool_param)
+        compact = dict(pool_param, compact_cache=True)
+        compact_out, compact_dx = self.backward(x, compact)
+        self.assertTrue(np.array_equal(compact_out, out))
+        self.assertLess(rel_error(compact_dx, dx), 1e-12)
+
+        _, naive_cache = max_pool_forward_naive(x, pool_param)
+        naive_dx = max_pool_backward_naive(self.dout, naive_cache)
+        _, first_dx = self.backward(x, dict(compact, split_ties=False))
+        self.assertTrue(np.array_equal(first_dx, naive_dx))
+
+    def test_without_ties(self):
+        self.check(self.rng.randn(2, 3, 8, 8), 2)
+
+    def test_with_ties(self):
+        # Few distinct values, so most windows have tied maxima
+        self.check(self.rng.randint(3, size=(2, 3, 8, 8)).astype(np.float64), 2)
+
+    def test_wide_window(self):
+        # 3x3 windows need a uint16 tie bitmask
+        self.dout = self.rng.randn(2, 3, 3, 3)
+        self.check(self.rng.randint(3, size=(2, 3, 9, 9)).astype(np.float64), 3)
+
+
+@unittest.skipIf(im2col_cython is None, 'the Cython extension is not built')
+class ParallelIm2colTest(unittest.TestCase):
+    """
+    Checks that the multi-threaded im2col / col2im kernels return exactly what
+    the serial kernels return.
+    """
+
+    num_threads = 4
+    # (N, C, H, W, field size, pad, stride)
+    shapes = ((3, 2, 6, 6, 3, 1, 1), (5, 3, 7, 7, 3, 0, 2), (1, 1, 5, 5, 1, 0, 1))
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def test_im2col(self):
+        for N, C, H, W, field, pad, stride in self.shapes:
+            for dtype in (np.float32, np.float64):
+                x = self.rng.randn(N, C, H, W).astype(dtype)
+                expected = im2col_cython.im2col_cython(x, field, field, pad, stride)
+                cols = im2col_cython.im2col_cython_parallel(x, field, field, pad, stride,
+                                                            self.num_threads)
+                self.assertEqual(cols.dtype, expected.dtype)
+                self.assertTrue(np.array_equal(cols, expected))
+
+    def test_col2im(self):
+        for N, C, H, W, field, pad, stride in self.shapes:
+            out_h = (H + 2 * pad - field) // stride + 1
+            out_w = (W + 2 * pad - field) // stride + 1
+            cols = self.rng.randn(C * field * field, N * out_h * out_w)
+            expected = im2col_cython.col2im_cython(cols, N, C, H, W, field, field,
+                                                   pad, stride)
+            x = im2col_cython.col2im_cython_parallel(cols, N, C, H, W, field, field,
+                                                     pad, stride, self.num_threads)
+            self.assertTrue(np.allclose(x, expected, rtol=0, atol=1e-12))
+
+    def test_col2im_6d(self):
+        for N, C, H, W, field, pad, stride in self.shapes:
+            out_h = (H + 2 * pad - field) // stride + 1
+            out_w = (W + 2 * pad - field) // stride + 1
+            cols = self.rng.randn(C, field, field, N, out_h, out_w)
+            expected = im2col_cython.col2im_6d_cython(cols, N, C, H, W, field, field,
+                                                      pad, stride)
+            x = im2col_cython.col2im_6d_cython_parallel(cols, N, C, H, W, field, field,
+                                                        pad, stride, self.num_threads)
+            self.assertTrue(np.allclose(x, expected, rtol=0, atol=1e-12))
+
+
+if __name__ == '__main__':
+    unittest.main()
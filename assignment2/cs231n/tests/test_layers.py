@@ -0,0 +1,224 @@
+import unittest
+
+import numpy as np
+
+from cs231n.layers import *
+from cs231n.gradient_check import eval_numerical_gradient
+from cs231n.gradient_check import eval_numerical_gradient_array
+
+
+def rel_error(x, y):
+    """ returns relative error """
+    return np.max(np.abs(x - y) / (np.maximum(1e-8, np.abs(x) + np.abs(y))))
+
+
+class ConvVectorizedTest(unittest.TestCase):
+    """
+    Checks conv_forward_vectorized / conv_backward_vectorized against the
+    naive layers and numeric gradients.
+    """
+
+    conv_params = ({'stride': 1, 'pad': 1}, {'stride': 2, 'pad': 1},
+                   {'stride': 2, 'pad': 0}, {'stride': 1, 'pad': 2})
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = rng.randn(2, 3, 7, 7)
+        self.w = rng.randn(4, 3, 3, 3)
+        self.b = rng.randn(4)
+        self.rng = rng
+
+    def test_forward_matches_naive(self):
+        for conv_param in self.conv_params:
+            expected, _ = conv_forward_naive(self.x, self.w, self.b, conv_param)
+            out, _ = conv_forward_vectorized(self.x, self.w, self.b, conv_param)
+            self.assertLess(rel_error(out, expected), 1e-10, conv_param)
+
+    def test_backward_matches_naive(self):
+        # conv_backward_naive only handles pad > 0
+        for conv_param in self.conv_params:
+            if conv_param['pad'] == 0:
+                continue
+            out, cache = conv_forward_naive(self.x, self.w, self.b, conv_param)
+            dout = self.rng.randn(*out.shape)
+            expected = conv_backward_naive(dout, cache)
+            _, cache = conv_forward_vectorized(self.x, self.w, self.b, conv_param)
+            grads = conv_backward_vectorized(dout, cache)
+            for grad, expected_grad in zip(grads, expected):
+                self.assertLess(rel_error(grad, expected_grad), 1e-10, conv_param)
+
+    def test_backward_matches_numeric_gradient(self):
+        for conv_param in self.conv_params:
+            forward = lambda x, w, b: conv_forward_vectorized(x, w, b, conv_param)[0]
+            out, cache = conv_forward_vectorized(self.x, self.w, self.b, conv_param)
+            dout = self.rng.randn(*out.shape)
+            dx, dw, db = conv_backward_vectorized(dout, cache)
+
+            dx_num = eval_numerical_gradient_array(lambda x: forward(x, self.w, self.b), self.x, dout)
+            dw_num = eval_numerical_gradient_array(lambda w: forward(self.x, w, self.b), self.w, dout)
+            db_num = eval_numerical_gradient_array(lambda b: forward(self.x, self.w, b), self.b, dout)
+            self.assertLess(rel_error(dx, dx_num), 1e-7, conv_param)
+            self.assertLess(rel_error(dw, dw_num), 1e-7, conv_param)
+            self.assertLess(rel_error(db, db_num), 1e-7, conv_param)
+
+
+class BatchnormFusedTest(unittest.TestCase):
+    """
+    Checks the fused batchnorm layers against the staged batchnorm_forward /
+    batchnorm_backward, batchnorm_backward_alt and numeric gradients.
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = 4 * rng.randn(10, 5) + 2
+        self.gamma = rng.randn(5)
+        self.beta = rng.randn(5)
+        self.dout = rng.randn(10, 5)
+
+    def test_forward_matches_staged(self):
+        bn_param = {'mode': 'train'}
+        fused_param = {'mode': 'train'}
+        for _ in range(3):
+            expected, _ = batchnorm_forward(self.x, self.gamma, self.beta, bn_param)
+            out, _ = batchnorm_forward_fused(self.x, self.gamma, self.beta, fused_param)
+            self.assertLess(rel_error(out, expected), 1e-10)
+        for key in ('running_mean', 'running_var'):
+            self.assertLess(rel_error(fused_param[key], bn_param[key]), 1e-10)
+
+        bn_param['mode'] = fused_param['mode'] = 'test'
+        expected, _ = batchnorm_forward(self.x, self.gamma, self.beta, bn_param)
+        out, _ = batchnorm_forward_fused(self.x, self.gamma, self.beta, fused_param)
+        self.assertLess(rel_error(out, expected), 1e-10)
+
+    def test_backward_matches_staged(self):
+        _, cache = batchnorm_forward(self.x, self.gamma, self.beta, {'mode': 'train'})
+        expected = batchnorm_backward(self.dout, cache)
+        alt = batchnorm_backward_alt(self.dout, cache)
+        _, cache = batchnorm_forward_fused(self.x, self.gamma, self.beta, {'mode': 'train'})
+        grads = batchnorm_backward_fused(self.dout, cache)
+        for grad, alt_grad, expected_grad in zip(grads, alt, expected):
+            self.assertLess(rel_error(grad, expected_grad), 1e-10)
+            self.assertLess(rel_error(alt_grad, expected_grad), 1e-10)
+
+    def test_backward_matches_numeric_gradient(self):
+        forward = lambda x, gamma, beta: batchnorm_forward_fused(
+            x, gamma, beta, {'mode': 'train'})[0]
+        _, cache = batchnorm_forward_fused(self.x, self.gamma, self.beta, {'mode': 'train'})
+        dx, dgamma, dbeta = batchnorm_backward_fused(self.dout, cache)
+
+        dx_num = eval_numerical_gradient_array(
+            lambda x: forward(x, self.gamma, self.beta), self.x, self.dout)
+        dgamma_num = eval_numerical_gradient_array(
+            lambda gamma: forward(self.x, gamma, self.beta), self.gamma, self.dout)
+        dbeta_num = eval_numerical_gradient_array(
+            lambda beta: forward(self.x, self.gamma, beta), self.beta, self.dout)
+        self.assertLess(rel_error(dx, dx_num), 1e-7)
+        self.assertLess(rel_error(dgamma, dgamma_num), 1e-7)
+        self.assertLess(rel_error(dbeta, dbeta_num), 1e-7)
+
+    def test_inplace(self):
+        out, cache = batchnorm_forward_fused(self.x, self.gamma, self.beta, {'mode': 'train'})
+        grads = batchnorm_backward_fused(self.dout.copy(), cache)
+
+        x, dout = self.x.copy(), self.dout.copy()
+        inplace_out, cache = batchnorm_forward_fused(x, self.gamma, self.beta,
+                                                     {'mode': 'train', 'inplace': True})
+        inplace_grads = batchnorm_backward_fused(dout, cache)
+        self.assertLess(rel_error(inplace_out, out), 1e-12)
+        self.assertTrue(np.may_share_memory(inplace_grads[0], dout))
+        for grad, inplace_grad in zip(grads, inplace_grads):
+            self.assertLess(rel_error(inplace_grad, grad), 1e-12)
+
+
+class DropoutTest(unittest.TestCase):
+    """
+    Checks the keep rate, determinism and gradients of dropout_forward /
+    dropout_backward, and that a generator restored from get_rng_state
+    draws the same masks.
+    """
+
+    def setUp(self):
+        self.x = np.random.RandomState(0).randn(500, 500) + 10
+
+    def test_keep_rate(self):
+        for p in (0.25, 0.5, 0.75):
+            dropout_param = {'mode': 'train', 'p': p}
+            out, cache = dropout_forward(self.x, dropout_param)
+            kept = np.mean(out != 0)
+            self.assertAlmostEqual(kept, 1 - p, delta=0.01)
+            self.assertAlmostEqual(out.mean(), self.x.mean(), delta=0.1)
+            self.assertEqual(cache[1].nbytes, (self.x.size + 7) // 8)
+
+            out, _ = dropout_forward(self.x, {'mode': 'test', 'p': p})
+            self.assertTrue(np.array_equal(out, self.x))
+
+    def test_seed_is_deterministic(self):
+        dropout_param = {'mode': 'train', 'p': 0.5, 'seed': 123}
+        out1, _ = dropout_forward(self.x, dropout_param)
+        out2, _ = dropout_forward(self.x, dropout_param)
+        self.assertTrue(np.array_equal(out1, out2))
+
+    def test_backward_matches_numeric_gradient(self):
+        rng = np.random.RandomState(1)
+        x = rng.randn(10, 10) + 10
+        dout = rng.randn(10, 10)
+        dropout_param = {'mode': 'train', 'p': 0.2, 'seed': 123}
+        _, cache = dropout_forward(x, dropout_param)
+        dx = dropout_backward(dout, cache)
+        dx_num = eval_numerical_gradient_array(
+            lambda x: dropout_forward(x, dropout_param)[0], x, dout)
+        self.assertLess(rel_error(dx, dx_num), 1e-8)
+
+    def test_rng_state_round_trip(self):
+        dropout_param = {'mode': 'train', 'p': 0.5}
+        dropout_forward(self.x, dropout_param)
+        state = get_rng_state(dropout_param['rng'])
+        expected, _ = dropout_forward(self.x, dropout_param)
+
+        restored = {'mode': 'train', 'p': 0.5, 'rng': rng_from_state(state)}
+        out, _ = dropout_forward(self.x, restored)
+        self.assertTrue(np.array_equal(out, expected))
+
+
+class LossTest(unittest.TestCase):
+    """
+    Checks svm_loss and softmax_loss against numeric gradients, and that
+    chunked and in-place evaluation give the same loss and gradient.
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = 0.1 * rng.randn(50, 10)
+        self.y = rng.randint(10, size=50)
+
+    def test_numeric_gradient(self):
+        for loss_fn in (svm_loss, softmax_loss):
+            x = self.x.copy()
+            loss, dx = loss_fn(x, self.y)
+            self.assertTrue(np.array_equal(x, self.x), loss_fn.__name__)
+            dx_num = eval_numerical_gradient(lambda x: loss_fn(x, self.y)[0], x,
+                                             verbose=False)
+            self.assertLess(rel_error(dx, dx_num), 1e-7, loss_fn.__name__)
+
+        # Near-uniform scores give a softmax loss of about log(C)
+        loss, _ = softmax_loss(self.x, self.y)
+        self.assertAlmostEqual(loss, np.log(10), delta=0.1)
+
+    def test_chunked_and_inplace_match(self):
+        for loss_fn in (svm_loss, softmax_loss):
+            loss, dx = loss_fn(self.x, self.y)
+            for chunk_size in (1, 7, 50, 64):
+                name = '%s with chunk_size %d' % (loss_fn.__name__, chunk_size)
+                chunk_loss, chunk_dx = loss_fn(self.x, self.y, chunk_size=chunk_size)
+                self.assertAlmostEqual(chunk_loss, loss, places=12, msg=name)
+                self.assertLess(rel_error(chunk_dx, dx), 1e-12, name)
+
+            x = self.x.copy()
+            inplace_loss, inplace_dx = loss_fn(x, self.y, inplace=True, chunk_size=16)
+            self.assertIs(inplace_dx, x)
+            self.assertAlmostEqual(inplace_loss, loss, places=12)
+            self.assertLess(rel_error(inplace_dx, dx), 1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
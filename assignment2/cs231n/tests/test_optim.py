@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.solver import Solver
+
+
+class StateDtypeTest(unittest.TestCase):
+    """
+    Trains the same small FullyConnectedNet with every update rule and every
+    state_dtype, and checks that compact optimizer state converges like full
+    precision state: the loss must never rise above its initial value by more
+    than tolerance, and the mean loss of the last epoch must be within
+    tolerance of the full precision run.
+    """
+
+    rules = ('sgd_momentum', 'nesterov_momentum', 'rmsprop', 'adagrad', 'adam',
+             'adamw', 'lamb')
+    state_dtypes = (None, np.float16, 'bfloat16')
+    learning_rates = {'sgd_momentum': 1e-1, 'nesterov_momentum': 1e-1,
+                      'adagrad': 1e-2, 'lamb': 1e-2}
+    num_epochs = 5
+    tolerance = 0.1
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        X = rng.randn(1000, 3 * 32 * 32).astype(np.float32)
+        y = rng.randint(10, size=X.shape[0])
+        self.data = {'X_train': X, 'y_train': y, 'X_val': X[:100], 'y_val': y[:100]}
+
+    def train(self, rule, state_dtype):
+        """
+        Returns the loss history of a training run.
+        """
+        np.random.seed(0)
+        model = FullyConnectedNet([100, 100])
+        optim_config = {'learning_rate': self.learning_rates.get(rule, 1e-3),
+                        'state_dtype': state_dtype}
+        solver = Solver(model, self.data, update_rule=rule, batch_size=100,
+                        optim_config=optim_config, num_epochs=self.num_epochs,
+                        verbose=False)
+        solver.train()
+        return np.array(solver.loss_history, dtype=np.float64)
+
+    def test_compact_state_converges(self):
+        for rule in self.rules:
+            reference = None
+            for state_dtype in self.state_dtypes:
+                loss = self.train(rule, state_dtype)
+                first, peak = loss[0], loss.max()
+                final = loss[-len(loss) // self.num_epochs:].mean()
+                if reference is None:
+                    reference = final
+                name = '%s with state_dtype %s' % (rule, state_dtype)
+                self.assertTrue(np.isfinite(loss).all(), name)
+                self.assertLessEqual(peak, first + self.tolerance, name)
+                self.assertLessEqual(abs(final - reference), self.tolerance, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
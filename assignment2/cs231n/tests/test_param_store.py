@@ -0,0 +1,133 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.param_store import ParamShadow, ParamStore
+from cs231n.solver import Solver
+
+
+class ParamStoreTest(unittest.TestCase):
+    """
+    Checks that a ParamStore keeps every parameter as a view into its buffer
+    through assignment, pickling and rebuffer, and that a model gives the
+    same loss and gradients with flat parameters.
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.params = {'W1': rng.randn(3, 4), 'b1': rng.randn(4), 'W2': rng.randn(4, 2)}
+
+    def assertViews(self, store):
+        for k, v in self.params.items():
+            self.assertTrue(np.array_equal(store[k], v), k)
+            self.assertTrue(np.may_share_memory(store[k], store.data), k)
+            self.assertTrue(np.array_equal(store.data[store.slices[k]], v.ravel()), k)
+
+    def test_round_trip(self):
+        store = ParamStore(self.params)
+        self.assertEqual(store.data.size, 3 * 4 + 4 + 4 * 2)
+        self.assertViews(store)
+
+        copy = pickle.loads(pickle.dumps(store))
+        self.assertIsInstance(copy, ParamStore)
+        self.assertViews(copy)
+
+        store.rebuffer(np.empty_like(store.data), np.empty_like(store.grad_data))
+        self.assertViews(store)
+
+    def test_assignment_copies(self):
+        store = ParamStore(self.params)
+        view = store['W1']
+        store['W1'] = 2 * self.params['W1']
+        self.assertIs(store['W1'], view)
+        self.assertTrue(np.array_equal(view, 2 * self.params['W1']))
+        store.update({'b1': 0})
+        self.assertFalse(store['b1'].any())
+
+        with self.assertRaises(ValueError):
+            store['W1'] = np.zeros((4, 3))
+        with self.assertRaises(KeyError):
+            store['W3'] = np.zeros(2)
+
+    def test_set_grads(self):
+        store = ParamStore(self.params)
+        grad_data = store.set_grads({'W1': np.ones((3, 4)), 'W2': np.ones((4, 2))})
+        self.assertIs(grad_data, store.grad_data)
+        self.assertTrue((store.grads['W1'] == 1).all())
+        self.assertTrue((store.grads['W2'] == 1).all())
+        self.assertFalse(store.grads['b1'].any())
+
+    def test_model_with_flat_params(self):
+        rng = np.random.RandomState(1)
+        X, y = rng.randn(5, 6), rng.randint(3, size=5)
+        results = []
+        for flat_params in (False, True):
+            np.random.seed(0)
+            model = FullyConnectedNet([7, 7], input_dim=6, num_classes=3,
+                                      dtype=np.float64, flat_params=flat_params)
+            results.append(model.loss(X, y))
+        (loss, grads), (flat_loss, flat_grads) = results
+        self.assertEqual(loss, flat_loss)
+        for k in grads:
+            self.assertTrue(np.array_equal(grads[k], flat_grads[k]), k)
+
+
+class ParamShadowTest(unittest.TestCase):
+    """
+    Checks the copies and moving averages of ParamShadow, in memory and in a
+    memory-mapped file, and that the Solver restores its best parameters.
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.params = {'W1': rng.randn(3, 4), 'b1': rng.randn(4)}
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_copy_and_average(self):
+        filename = os.path.join(self.tmpdir, 'best.dat')
+        for flat in (False, True):
+            for shadow_file in (None, filename):
+                params = dict((k, v.copy()) for k, v in self.params.items())
+                if flat:
+                    params = ParamStore(params)
+                shadow = ParamShadow(params, shadow_file)
+                shadow.copy_from(params)
+                data = shadow.data
+                for k in params:
+                    params[k] += 1
+                shadow.update_average(params, 0.75)
+                self.assertIs(shadow.data, data)
+                for k, v in self.params.items():
+                    self.assertTrue(np.allclose(shadow.params[k], v + 0.25), k)
+
+                shadow.copy_to(params)
+                for k, v in self.params.items():
+                    self.assertTrue(np.allclose(params[k], v + 0.25), k)
+
+    def test_solver_restores_best_params(self):
+        rng = np.random.RandomState(1)
+        data = {'X_train': rng.randn(100, 6), 'y_train': rng.randint(3, size=100),
+                'X_val': rng.randn(20, 6), 'y_val': rng.randint(3, size=20)}
+        np.random.seed(0)
+        model = FullyConnectedNet([10], input_dim=6, num_classes=3, dtype=np.float64)
+        solver = Solver(model, data, num_epochs=3, batch_size=20,
+                        optim_config={'learning_rate': 1e-2}, verbose=False)
+        solver.train()
+        self.assertEqual(solver.best_val_acc, max(solver.val_acc_history))
+        self.assertEqual(solver.check_accuracy(data['X_val'], data['y_val']),
+                         solver.best_val_acc)
+        for k, v in model.params.items():
+            self.assertTrue(np.array_equal(v, solver.best_params[k]), k)
+            self.assertFalse(np.may_share_memory(v, solver.best_params[k]), k)
+
+
+if __name__ == '__main__':
+    unittest.main()
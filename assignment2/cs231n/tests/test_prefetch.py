@@ -0,0 +1,83 @@
+import unittest
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.prefetch import BatchPrefetcher
+from cs231n.solver import Solver
+
+
+class BatchPrefetcherTest(unittest.TestCase):
+    """
+    Checks that the prefetcher returns matching rows of X and y, reuses its
+    buffers, is reproducible with a seed and leaves np.random alone.
+    """
+
+    def setUp(self):
+        # Row i of X is filled with i, so every row can be matched to its label
+        self.X = np.repeat(np.arange(100, dtype=np.float64), 3).reshape(100, 3)
+        self.y = np.arange(100)
+
+    def take(self, prefetcher, num_batches):
+        batches = []
+        for i in range(num_batches):
+            X_batch, y_batch = next(prefetcher)
+            batches.append((X_batch.copy(), y_batch.copy()))
+        prefetcher.close()
+        return batches
+
+    def test_batches_match_labels(self):
+        prefetcher = BatchPrefetcher(self.X, self.y, 10, num_workers=2, dtype=np.float32)
+        for X_batch, y_batch in self.take(prefetcher, 20):
+            self.assertEqual(X_batch.shape, (10, 3))
+            self.assertEqual(X_batch.dtype, np.float32)
+            self.assertTrue(np.array_equal(X_batch, self.X[y_batch]))
+
+    def test_reuses_buffers(self):
+        prefetcher = BatchPrefetcher(self.X, self.y, 10, num_batches=2)
+        ids = set()
+        for i in range(20):
+            ids.add(id(next(prefetcher)[0]))
+        prefetcher.close()
+        self.assertLessEqual(len(ids), len(prefetcher.X_buffers))
+
+    def test_seed_is_reproducible(self):
+        np.random.seed(0)
+        state = np.random.get_state()[1].copy()
+        batches = [self.take(BatchPrefetcher(self.X, self.y, 10, seed=1), 5)
+                   for i in range(2)]
+        self.assertTrue(np.array_equal(np.random.get_state()[1], state))
+        for (X1, y1), (X2, y2) in zip(*batches):
+            self.assertTrue(np.array_equal(y1, y2))
+
+    def test_transform(self):
+        def transform(X_batch, y_batch, rng):
+            X_batch *= -1
+            return X_batch, y_batch
+        prefetcher = BatchPrefetcher(self.X, self.y, 10, transform=transform)
+        for X_batch, y_batch in self.take(prefetcher, 5):
+            self.assertTrue(np.array_equal(X_batch, -self.X[y_batch]))
+
+    def test_worker_error_is_raised(self):
+        def transform(X_batch, y_batch, rng):
+            raise RuntimeError('bad batch')
+        prefetcher = BatchPrefetcher(self.X, self.y, 10, transform=transform)
+        with self.assertRaises(RuntimeError):
+            next(prefetcher)
+        self.assertEqual(prefetcher._threads, [])
+
+    def test_solver_with_prefetch(self):
+        rng = np.random.RandomState(0)
+        data = {'X_train': rng.randn(50, 10), 'y_train': rng.randint(3, size=50),
+                'X_val': rng.randn(10, 10), 'y_val': rng.randint(3, size=10)}
+        model = FullyConnectedNet([8], input_dim=10, num_classes=3)
+        solver = Solver(model, data, num_epochs=2, batch_size=10, prefetch=2,
+                        verbose=False)
+        solver.train()
+        self.assertEqual(len(solver.loss_history), 10)
+        self.assertTrue(np.isfinite(solver.loss_history).all())
+        self.assertEqual(solver.prefetcher._threads, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+
+from cs231n.samplers import *
+
+
+class SamplerTest(unittest.TestCase):
+    """
+    Checks that the samplers without replacement visit every example once per
+    epoch, that StratifiedSampler keeps the class proportions, and that every
+    sampler continues with the same batches after set_state.
+    """
+
+    def setUp(self):
+        # Row i of X is filled with i, so every row can be matched to its label
+        self.X = np.repeat(np.arange(100, dtype=np.float64), 2).reshape(100, 2)
+        self.y = np.arange(100)
+
+    def epoch(self, sampler):
+        return [next(sampler) for i in range(sampler.num_batches)]
+
+    def test_batches_match_labels(self):
+        for name, sampler_class in sorted(SAMPLERS.items()):
+            sampler = sampler_class(self.X, self.y, 10, seed=0)
+            for X_batch, y_batch in self.epoch(sampler) + self.epoch(sampler):
+                self.assertEqual(X_batch.shape, (10, 2), name)
+                self.assertTrue(np.array_equal(X_batch[:, 0], y_batch), name)
+
+    def test_without_replacement(self):
+        for sampler_class in (PermutationSampler, SliceSampler):
+            sampler = sampler_class(self.X, self.y, 10, seed=0)
+            epochs = []
+            for epoch in range(2):
+                seen = np.concatenate([y for X, y in self.epoch(sampler)])
+                self.assertTrue(np.array_equal(np.sort(seen), self.y))
+                epochs.append(seen)
+            self.assertFalse(np.array_equal(epochs[0], epochs[1]))
+
+    def test_stratified_proportions(self):
+        y = np.repeat([0, 1, 2], [50, 30, 20])
+        sampler = StratifiedSampler(self.X, y, 10, seed=0)
+        for X_batch, y_batch in self.epoch(sampler):
+            self.assertTrue(np.array_equal(np.bincount(y_batch, minlength=3), [5, 3, 2]))
+
+        sampler = StratifiedSampler(self.X, y, 10, seed=0, balanced=True)
+        for X_batch, y_batch in self.epoch(sampler):
+            self.assertTrue((np.bincount(y_batch, minlength=3) >= 3).all())
+
+    def test_state_round_trip(self):
+        for name, sampler_class in sorted(SAMPLERS.items()):
+            sampler = sampler_class(self.X, self.y, 30, seed=0)
+            for i in range(4):
+                next(sampler)
+            state = sampler.get_state()
+            expected = [next(sampler)[1].copy() for i in range(4)]
+
+            restored = sampler_class(self.X, self.y, 30, seed=1)
+            restored.set_state(state)
+            for y_expected in expected:
+                self.assertTrue(np.array_equal(next(restored)[1], y_expected), name)
+
+    def test_set_epoch(self):
+        sampler = PermutationSampler(self.X, self.y, 10, seed=0)
+        self.epoch(sampler)
+        second = [y.copy() for X, y in self.epoch(sampler)]
+        sampler.set_epoch(1)
+        for y_expected in second:
+            self.assertTrue(np.array_equal(next(sampler)[1], y_expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
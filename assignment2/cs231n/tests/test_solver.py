@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from cs231n.classifiers.fc_net import FullyConnectedNet
+from cs231n.schedules import *
+from cs231n.solver import Solver
+
+
+class ScheduleTest(unittest.TestCase):
+    """
+    Checks the values of the learning rate schedules and that get_state /
+    set_state restore them, including wrapped schedules.
+    """
+
+    def test_values(self):
+        step = StepLR(1.0, step_size=10, gamma=0.5)
+        self.assertEqual([step(t) for t in (0, 9, 10, 25)], [1.0, 1.0, 0.5, 0.25])
+        milestones = StepLR(1.0, milestones=[5, 8], gamma=0.1)
+        self.assertAlmostEqual(milestones(8), 0.01)
+        self.assertAlmostEqual(ExponentialLR(1.0, 0.5, step_size=2)(3), 0.5 ** 1.5)
+
+        cosine = CosineLR(1.0, 100, min_lr=0.1)
+        self.assertEqual((cosine(0), cosine(100), cosine(200)), (1.0, 0.1, 0.1))
+        self.assertAlmostEqual(cosine(50), 0.55)
+
+        warmup = WarmupLR(ConstantLR(1.0), 4)
+        self.assertEqual([warmup(t) for t in range(5)], [0.25, 0.5, 0.75, 1.0, 1.0])
+
+        one_cycle = OneCycleLR(1.0, 100)
+        self.assertAlmostEqual(one_cycle(0), 1.0 / 25)
+        self.assertAlmostEqual(one_cycle(30), 1.0)
+        self.assertAlmostEqual(one_cycle(99), 1.0 / 25 / 1e4)
+
+        with self.assertRaises(ValueError):
+            StepLR(1.0)
+
+    def test_plateau(self):
+        schedule = ReduceLROnPlateau(1.0, factor=0.5, patience=1)
+        for metric in (0.5, 0.6, 0.6, 0.6, 0.6):
+            schedule.observe(metric)
+        self.assertEqual(schedule(0), 0.5)
+
+    def test_state_round_trip(self):
+        schedule = WarmupLR(ReduceLROnPlateau(1.0, factor=0.5, patience=0), 2)
+        for metric in (0.5, 0.4, 0.3):
+            schedule.observe(metric)
+        state = schedule.get_state()
+
+        restored = WarmupLR(ReduceLROnPlateau(1.0, factor=0.5, patience=0), 2)
+        restored.set_state(state)
+        self.assertIsInstance(restored.schedule, ReduceLROnPlateau)
+        for t in (0, 1, 5):
+            self.assertEqual(restored(t), schedule(t))
+        schedule.observe(0.2)
+        restored.observe(0.2)
+        self.assertEqual(restored(5), schedule(5))
+
+
+class SolverTrainTest(unittest.TestCase):
+    """
+    Checks that every call to train() trains for num_epochs, and that train()
+    after resume() only runs what the interrupted call had left, with the
+    same updates as an uninterrupted run.
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.data = {'X_train': rng.randn(50, 10), 'y_train': rng.randint(3, size=50),
+                     'X_val': rng.randn(10, 10), 'y_val': rng.randint(3, size=10)}
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_solver(self, **kwargs):
+        np.random.seed(1)
+        model = FullyConnectedNet([8], input_dim=10, num_classes=3,
+                                  dropout=0.5, dtype=np.float64)
+        return Solver(model, self.data, num_epochs=2, batch_size=10,
+                      lr_schedule=CosineLR(1e-2, 20), verbose=False, **kwargs)
+
+    def test_train_again(self):
+        solver = self.make_solver()
+        solver.train()
+        self.assertEqual(solver.iteration, 10)
+        solver.train()
+        self.assertEqual(solver.iteration, 20)
+        self.assertEqual(len(solver.loss_history), 20)
+        self.assertEqual(solver.epoch, 4)
+
+    def test_resume(self):
+        checkpoint_name = os.path.join(self.tmpdir, 'checkpoint')
+        solver = self.make_solver(checkpoint_name=checkpoint_name)
+        solver.train()
+
+        resumed = self.make_solver()
+        resumed.resume(checkpoint_name + '_epoch_1.npz')
+        self.assertEqual(resumed.iteration, 5)
+        resumed.train()
+        self.assertEqual(resumed.iteration, 10)
+        self.assertEqual(resumed.loss_history, solver.loss_history)
+        for k, v in solver.model.params.items():
+            self.assertTrue(np.array_equal(resumed.model.params[k], v), k)
+
+        # The last checkpoint of a finished call leaves nothing to run
+        finished = self.make_solver()
+        finished.resume(checkpoint_name + '_epoch_2.npz')
+        finished.train()
+        self.assertEqual(finished.iteration, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()